@@ -31,6 +31,7 @@ setup(name='tut',
       package_dir={'': 'src'},
       include_package_data=True,
       zip_safe=False,
+      python_requires='>=3.8',
       install_requires=install_requires,
       entry_points={
           'console_scripts': [
@@ -1,6 +1,6 @@
 def version():
     """Return the installed package version."""
 
-    import pkg_resources
+    from importlib import metadata
 
-    return pkg_resources.get_distribution('tut').version
+    return metadata.version('tut')
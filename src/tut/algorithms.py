@@ -0,0 +1,385 @@
+"""Line matching algorithms for tut:diff.
+
+Each algorithm is a difflib.SequenceMatcher subclass that replaces
+get_matching_blocks(), so get_opcodes() and get_grouped_opcodes() work
+unchanged. Lines are compared as whole strings; there is no junk
+heuristic. The 'git' algorithm instead parses the hunks git produces
+(see parse_hunks).
+
+"""
+
+import bisect
+import difflib
+import math
+import re
+
+
+# lines that occur more often than this are never used as histogram anchors
+MAX_CHAIN_LENGTH = 64
+
+# as in xdiff, Myers gives up on a minimal diff after this many edits
+# (or the square root of the input size, if larger) and splits at the
+# furthest point it reached instead
+MIN_MAX_COST = 256
+
+hunk_header_re = re.compile(
+    br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@', re.MULTILINE,
+)
+
+
+def _common_prefix(a, b, alo, ahi, blo, bhi, matches):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    return alo, blo
+
+
+def _common_suffix(a, b, alo, ahi, blo, bhi, matches):
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        matches.append((ahi, bhi))
+    return ahi, bhi
+
+
+def _furthest(row, offset, d, n, m):
+    """Return (x, y) of the point in row that got furthest in d edits."""
+
+    best = None
+    for k in range(-d, d + 1, 2):
+        x = min(row[offset + k], n)
+        y = x - k
+        if 0 <= y <= m and (best is None or x + y > best[0] + best[1]):
+            best = (x, y)
+
+    return best
+
+
+def _middle_snake(a, b, alo, ahi, blo, bhi, max_cost=None):
+    """Return the middle snake of a shortest edit script.
+
+    Searches forward from (alo, blo) and backward from (ahi, bhi) until
+    the paths overlap, keeping only one row of furthest-reaching points
+    per direction. Returns (x1, y1, x2, y2); the snake runs diagonally
+    from (x1, y1) to (x2, y2).
+
+    If the paths haven't met after max_cost edits, the point either
+    search got furthest to is returned as an empty snake instead, so
+    heavily rewritten ranges cost O((N + M) * max_cost) rather than
+    O((N + M) * D), at the price of a diff that may not be minimal.
+
+    """
+
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2 + 1
+    offset = max_d + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+
+    for d in range(max_d):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and
+                           forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+
+            reverse_k = delta - k
+            if (odd and -(d - 1) <= reverse_k <= d - 1 and
+                    x + backward[offset + reverse_k] >= n):
+                return alo + start_x, blo + start_y, alo + x, blo + y
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and
+                           backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+
+            forward_k = delta - k
+            if (not odd and -d <= forward_k <= d and
+                    x + forward[offset + forward_k] >= n):
+                return ahi - x, bhi - y, ahi - start_x, bhi - start_y
+
+        if max_cost is not None and d >= max_cost:
+            x, y = _furthest(forward, offset, d, n, m)
+            back_x, back_y = _furthest(backward, offset, d, n, m)
+            if back_x + back_y > x + y:
+                x, y = n - back_x, m - back_y
+            return alo + x, blo + y, alo + x, blo + y
+
+    raise AssertionError("No middle snake found.")
+
+
+def myers_matches(a, b, alo, ahi, blo, bhi, matches):
+    """Append the (i, j) pairs of a longest common subsequence.
+
+    This is Myers' O(ND) algorithm in its linear space form: split on
+    the middle snake and solve each side, using a stack rather than
+    recursion. Past MIN_MAX_COST edits the result is a common
+    subsequence, but not necessarily the longest.
+
+    """
+
+    max_cost = max(MIN_MAX_COST, math.isqrt(ahi - alo + bhi - blo))
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        alo, blo = _common_prefix(a, b, alo, ahi, blo, bhi, matches)
+        ahi, bhi = _common_suffix(a, b, alo, ahi, blo, bhi, matches)
+        if alo == ahi or blo == bhi:
+            continue
+        if set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+            # a complete rewrite; nothing to match
+            continue
+
+        x1, y1, x2, y2 = _middle_snake(a, b, alo, ahi, blo, bhi, max_cost)
+        matches.extend((x1 + i, y1 + i) for i in range(x2 - x1))
+        stack.append((alo, x1, blo, y1))
+        stack.append((x2, ahi, y2, bhi))
+
+
+def patience_matches(a, b, alo, ahi, blo, bhi, matches):
+    """Append matching pairs using patience diff.
+
+    Lines that occur exactly once on each side are aligned with a
+    longest increasing subsequence, and the gaps between them are
+    diffed the same way. Ranges without unique lines fall back to
+    Myers.
+
+    """
+
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        alo, blo = _common_prefix(a, b, alo, ahi, blo, bhi, matches)
+        ahi, bhi = _common_suffix(a, b, alo, ahi, blo, bhi, matches)
+        if alo == ahi or blo == bhi:
+            continue
+
+        a_counts = {}
+        for i in range(alo, ahi):
+            a_counts[a[i]] = i if a[i] not in a_counts else None
+        b_counts = {}
+        for j in range(blo, bhi):
+            b_counts[b[j]] = j if b[j] not in b_counts else None
+
+        unique = [
+            (i, b_counts[a[i]])
+            for i in range(alo, ahi)
+            if a_counts[a[i]] == i and b_counts.get(a[i]) is not None
+        ]
+        if not unique:
+            myers_matches(a, b, alo, ahi, blo, bhi, matches)
+            continue
+
+        # patience sort: the longest run of unique lines in order in b
+        tails = []
+        tail_indexes = []
+        previous = [None] * len(unique)
+        for index, (_, j) in enumerate(unique):
+            pile = bisect.bisect_left(tails, j)
+            if pile:
+                previous[index] = tail_indexes[pile - 1]
+            if pile == len(tails):
+                tails.append(j)
+                tail_indexes.append(index)
+            else:
+                tails[pile] = j
+                tail_indexes[pile] = index
+
+        anchors = []
+        index = tail_indexes[-1]
+        while index is not None:
+            anchors.append(unique[index])
+            index = previous[index]
+        anchors.reverse()
+
+        for i, j in anchors:
+            matches.append((i, j))
+            stack.append((alo, i, blo, j))
+            alo, blo = i + 1, j + 1
+        stack.append((alo, ahi, blo, bhi))
+
+
+def histogram_matches(a, b, alo, ahi, blo, bhi, matches):
+    """Append matching pairs using histogram diff.
+
+    As in git, the region is split around the longest common run that
+    contains the rarest line, and both sides are diffed the same way.
+    Ranges where every common line is too frequent fall back to Myers.
+
+    """
+
+    stack = [(alo, ahi, blo, bhi)]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        alo, blo = _common_prefix(a, b, alo, ahi, blo, bhi, matches)
+        ahi, bhi = _common_suffix(a, b, alo, ahi, blo, bhi, matches)
+        if alo == ahi or blo == bhi:
+            continue
+
+        positions = {}
+        for i in range(alo, ahi):
+            positions.setdefault(a[i], []).append(i)
+
+        best = None
+        j = blo
+        while j < bhi:
+            candidates = positions.get(b[j])
+            if not candidates or len(candidates) > MAX_CHAIN_LENGTH:
+                j += 1
+                continue
+
+            next_j = j + 1
+            for i in candidates:
+                start_i, start_j = i, j
+                while (start_i > alo and start_j > blo and
+                       a[start_i - 1] == b[start_j - 1]):
+                    start_i -= 1
+                    start_j -= 1
+                end_i, end_j = i + 1, j + 1
+                rarity = len(candidates)
+                while end_i < ahi and end_j < bhi and a[end_i] == b[end_j]:
+                    rarity = min(rarity, len(positions[a[end_i]]))
+                    end_i += 1
+                    end_j += 1
+
+                score = (rarity, start_i - end_i)
+                if best is None or score < best[0]:
+                    best = (score, start_i, end_i, start_j)
+                next_j = max(next_j, end_j)
+            j = next_j
+
+        if best is None:
+            myers_matches(a, b, alo, ahi, blo, bhi, matches)
+            continue
+
+        _, start_i, end_i, start_j = best
+        matches.extend(
+            (start_i + n, start_j + n) for n in range(end_i - start_i)
+        )
+        stack.append((alo, start_i, blo, start_j))
+        stack.append((end_i, ahi, start_j + end_i - start_i, bhi))
+
+
+class AlgorithmMatcher(difflib.SequenceMatcher):
+    """A SequenceMatcher whose matching blocks come from match_lines."""
+
+    match_lines = None
+
+    def __init__(self, a=(), b=()):
+        super(AlgorithmMatcher, self).__init__(None, a, b, autojunk=False)
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+
+        # compare small integers rather than whole lines
+        ids = {}
+        a = [ids.setdefault(line, len(ids)) for line in self.a]
+        b = [ids.setdefault(line, len(ids)) for line in self.b]
+
+        pairs = []
+        type(self).match_lines(a, b, 0, len(a), 0, len(b), pairs)
+        pairs.sort()
+
+        blocks = []
+        for i, j in pairs:
+            if blocks and blocks[-1][0] + blocks[-1][2] == i \
+                    and blocks[-1][1] + blocks[-1][2] == j:
+                blocks[-1][2] += 1
+            else:
+                blocks.append([i, j, 1])
+
+        self.matching_blocks = [difflib.Match(*block) for block in blocks]
+        self.matching_blocks.append(difflib.Match(len(a), len(b), 0))
+
+        return self.matching_blocks
+
+
+class MyersMatcher(AlgorithmMatcher):
+    match_lines = staticmethod(myers_matches)
+
+
+class PatienceMatcher(AlgorithmMatcher):
+    match_lines = staticmethod(patience_matches)
+
+
+class HistogramMatcher(AlgorithmMatcher):
+    match_lines = staticmethod(histogram_matches)
+
+
+class DifflibMatcher(difflib.SequenceMatcher):
+    """difflib's own matcher, with its junk heuristic."""
+
+    def __init__(self, a=(), b=()):
+        super(DifflibMatcher, self).__init__(None, a, b)
+
+
+ALGORITHMS = {
+    'difflib': DifflibMatcher,
+    'myers': MyersMatcher,
+    'patience': PatienceMatcher,
+    'histogram': HistogramMatcher,
+}
+
+
+def matcher(algorithm, a, b):
+    """Return a SequenceMatcher for a and b using the named algorithm."""
+
+    try:
+        return ALGORITHMS[algorithm](a, b)
+    except KeyError:
+        raise ValueError("Unknown diff algorithm {0!r}.".format(algorithm))
+
+
+# git diffs the blobs itself; see Tut.diff_opcodes
+NATIVE_ALGORITHMS = ('git',)
+
+
+def parse_hunks(patch):
+    """Return the opcodes for the hunks of a zero context unified diff.
+
+    patch is the output of ``git diff -U0`` as bytes. Only changes are
+    returned; lines between hunks are equal.
+
+    """
+
+    opcodes = []
+    for match in hunk_header_re.finditer(patch):
+        old_start, old_count, new_start, new_count = (
+            int(value) if value is not None else 1
+            for value in match.groups()
+        )
+
+        # an empty side is positioned after the line it names
+        i1 = old_start if old_count == 0 else old_start - 1
+        j1 = new_start if new_count == 0 else new_start - 1
+
+        if old_count == 0:
+            tag = 'insert'
+        elif new_count == 0:
+            tag = 'delete'
+        else:
+            tag = 'replace'
+
+        opcodes.append((tag, i1, i1 + old_count, j1, j1 + new_count))
+
+    return opcodes
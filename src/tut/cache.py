@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+
+
+class LRUCache(object):
+    """A least-recently-used cache bounded by the total size of its values.
+
+    Values must be sized (typically bytes), or be given an explicit
+    size when they are put. Hits, misses and evictions
+    are counted so callers can judge whether the bound is adequate.
+
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self.clear()
+
+    def __getstate__(self):
+        # cached values are cheap to refetch; don't carry them around
+        return {'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_size'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def clear(self):
+        self._entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        try:
+            value, _ = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value, size=None):
+        """Cache value; size defaults to len(value)."""
+
+        if key in self._entries:
+            self.size -= self._entries.pop(key)[1]
+
+        if size is None:
+            size = len(value)
+        if size > self.max_size:
+            # never let a single value flush the whole cache
+            return
+
+        self._entries[key] = (value, size)
+        self.size += size
+
+        while self.size > self.max_size:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def stats(self):
+        """Return a dict of the cache counters."""
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'size': self.size,
+        }
+
+
+class DiskCache(object):
+    """A cache of bytes values stored as files under path.
+
+    Keys may be any value with a stable repr; each is hashed to a file
+    name. Reads mark an entry as recently used by touching its file,
+    and when the total size passes max_size the least recently used
+    files are removed until the cache is back under three quarters of
+    the limit. Several processes may share a cache directory.
+
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+
+        # total size of the files, counted on the first write
+        self.size = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['max_size'])
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf8')).hexdigest()
+        return os.path.join(self.path, digest[:2], digest[2:])
+
+    def _entries(self):
+        for directory, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    # removed by another process
+                    pass
+
+    def get(self, key, default=None):
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as entry:
+                value = entry.read()
+        except FileNotFoundError:
+            return default
+
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            pass
+
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_size:
+            return
+
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # write to a temporary file so readers never see a partial entry
+        fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(filename))
+        with os.fdopen(fd, 'wb') as entry:
+            entry.write(value)
+
+        # the entry being replaced no longer counts
+        try:
+            replaced = os.stat(filename).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_name, filename)
+
+        if self.size is None:
+            self.size = sum(stat.st_size for _, stat in self._entries())
+        else:
+            self.size += len(value) - replaced
+
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until well under max_size."""
+
+        entries = sorted(
+            self._entries(), key=lambda entry: entry[1].st_mtime,
+        )
+        self.size = sum(stat.st_size for _, stat in entries)
+
+        for path, stat in entries:
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= stat.st_size
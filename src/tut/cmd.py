@@ -7,6 +7,7 @@ Usage:
   tut points
   tut edit <name>
   tut next [--merge]
+  tut propagate [<name>]
 
 Options:
   -h --help     Show this screen.
@@ -21,10 +22,16 @@ import sys
 from docopt import docopt
 
 import tut
-from tut.model import (
-    Tut,
-    TutException,
-)
+
+# tut.model (and through it sh and yaml) is imported by the functions
+# that use it, so that --help and --version start quickly
+
+
+class _Version(object):
+    """The version string, looked up only if docopt prints it."""
+
+    def __str__(self):
+        return 'Tut %s' % tut.version()
 
 
 def init(tut, args):
@@ -35,6 +42,8 @@ def init(tut, args):
     else:
         path = os.path.join(os.getcwd(), path)
 
+    from tut.model import Tut
+
     tut_repo = Tut(path)
 
     if not os.path.exists(os.path.join(path, '.git')):
@@ -43,13 +52,7 @@ def init(tut, args):
 
 def fetch(tut, args):
 
-    remote = args.get('<remote>')
-
-    for point in tut.points(remote):
-        tut.start(
-            point.split('/')[-1],
-            starting_point=point,
-        )
+    tut.fetch(args.get('<remote>'))
 
 def start(tut, args):
 
@@ -74,6 +77,12 @@ def next_step(tut, args):
     tut.next(merge=args.get('--merge'))
 
 
+def propagate(tut, args):
+
+    for point in tut.propagate(args.get('<name>')):
+        print("Updated %s" % point)
+
+
 CMD_MAP = {
     'start': start,
     'init': init,
@@ -81,11 +90,17 @@ CMD_MAP = {
     'edit': edit,
     'next': next_step,
     'fetch': fetch,
+    'propagate': propagate,
 }
 
 
 def main():
-    arguments = docopt(__doc__, version='Tut %s' % tut.version())
+    arguments = docopt(__doc__, version=_Version())
+
+    from tut.model import (
+        Tut,
+        TutException,
+    )
 
     for cmd in CMD_MAP:
         if arguments.get(cmd):
@@ -103,6 +118,8 @@ def main():
 
 def post_rewrite():
 
+    from tut.model import Tut
+
     tut = Tut(os.getcwd())
 
     for line in sys.stdin:
@@ -1,130 +1,285 @@
-import difflib
-
+import ast
+import bisect
+import io
 import re
+import tokenize
+
+from tut import algorithms
 
-from sphinx.pycode import ModuleAnalyzer as SphinxModuleAnalyzer
-from sphinx.pycode.pgen2 import token
 
+# bump when diff_contents output changes, so cached diffs are recomputed
+DIFF_VERSION = 1
 
 emptyline_re = re.compile(r'^\s*(#.*)?$')
 
 
-# Extend Sphinx's Module Analyzer to support top-leve constants
-class ModuleAnalyzer(SphinxModuleAnalyzer):
-
-    def find_tags(self):
-        """Find class, function and method definitions and their location."""
-        if self.tags is not None:
-            return self.tags
-        self.tokenize()
-        result = {}
-        namespace = []  # type: List[unicode]
-        stack = []      # type: List[Tuple[unicode, unicode, unicode, int]]
-        indent = 0
-        decopos = None
-        defline = False
-        expect_indent = False
-        emptylines = 0
-
-        def tokeniter(ignore = (token.COMMENT,)):
-            for tokentup in self.tokens:
-                if tokentup[0] not in ignore:
-                    yield tokentup
-        tokeniter = tokeniter()
-        for type, tok, spos, epos, line in tokeniter:  # type: ignore
-            if expect_indent and type != token.NL:
-                if type != token.INDENT:
-                    # no suite -- one-line definition
-                    assert stack
-                    dtype, fullname, startline, _ = stack.pop()
-                    endline = epos[0]
-                    namespace.pop()
-                    result[fullname] = (dtype, startline, endline - emptylines)
+# a statement's tag is its first token, if that's a name
+statement_name_re = re.compile(r'^([^\W\d]\w*)(?![\'"])')
+clause_re = re.compile(r'^(elif|else|except|finally)\b')
+
+
+def _statement_children(node):
+    """Yield the statement lists nested directly in node."""
+
+    for field in ('body', 'orelse', 'finalbody'):
+        yield getattr(node, field, None) or []
+    for handler in getattr(node, 'handlers', None) or []:
+        yield handler.body
+    for case in getattr(node, 'cases', None) or []:
+        yield case.body
+
+
+def _clause_statements(node, lines):
+    """Yield the statements in node's clauses, looking through elifs."""
+
+    for statements in _statement_children(node):
+        if (statements is getattr(node, 'orelse', None) and
+                len(statements) == 1 and
+                isinstance(statements[0], ast.If) and
+                lines[statements[0].lineno - 1].startswith('elif')):
+            for child in _clause_statements(statements[0], lines):
+                yield child
+            continue
+
+        for child in statements:
+            yield child
+
+
+def _code_end(lines, lineno):
+    """Return the line after the last code line before lineno (1 based)."""
+
+    while lineno > 1 and emptyline_re.match(lines[lineno - 2]):
+        lineno -= 1
+    return lineno
+
+
+def _scan_tags(source):
+    """Find tags in source that may not parse, from its tokens.
+
+    This follows the indentation of the token stream, so it works for
+    any source Python can tokenize: definitions end at the dedent that
+    closes them, top-level statements are tagged by their first name,
+    and clauses are not told apart. Tags still open where tokenizing
+    fails end at the last line.
+
+    """
+
+    result = {}
+    namespace = []
+    # (type, fullname, start, indent) of each open tag
+    stack = []
+    indent = 0
+    decorator = None
+    defline = False
+    expect_indent = False
+    emptylines = 0
+
+    def close(end):
+        tag_type, fullname, start, _ = stack.pop()
+        namespace.pop()
+        result[fullname] = (tag_type, start, end - emptylines)
+
+    def open_tag(tag_type, name, start):
+        namespace.append(name)
+        stack.append((tag_type, '.'.join(namespace), start, indent))
+
+    tokens = (
+        token for token in
+        tokenize.generate_tokens(io.StringIO(source).readline)
+        if token.type != tokenize.COMMENT
+    )
+    try:
+        for token in tokens:
+            if expect_indent and token.type != tokenize.NL:
+                if token.type != tokenize.INDENT:
+                    # no suite; a one-line definition or statement
+                    close(token.start[0])
                 expect_indent = False
-            if tok in ('def', 'class'):
-                name = next(tokeniter)[1]  # type: ignore
-                namespace.append(name)
-                fullname = '.'.join(namespace)
-                stack.append((tok, fullname, decopos or spos[0], indent))
+
+            if token.type == tokenize.NAME and token.string in (
+                    'def', 'class'):
+                open_tag(token.string, next(tokens).string,
+                         decorator or token.start[0])
                 defline = True
-                decopos = None
-            elif type == token.NAME and spos[1] == 0:
-                name = fullname = tok
-                namespace.append(name)
-                stack.append((tok, fullname, decopos or spos[0], indent))
+                decorator = None
+            elif token.type == tokenize.NAME and token.start[1] == 0:
+                if token.string == 'async':
+                    continue
+                open_tag(token.string, token.string,
+                         decorator or token.start[0])
                 defline = True
-                decopos = None
-            elif type == token.OP and tok == '@':
-                if decopos is None:
-                    decopos = spos[0]
-            elif type == token.INDENT:
+                decorator = None
+            elif token.type == tokenize.OP and token.string == '@':
+                if decorator is None:
+                    decorator = token.start[0]
+            elif token.type == tokenize.INDENT:
                 expect_indent = False
                 indent += 1
-            elif type == token.DEDENT:
+            elif token.type == tokenize.DEDENT:
                 indent -= 1
-                # if the stacklevel is the same as it was before the last
-                # def/class block, this dedent closes that block
+                # a dedent back to a tag's level closes it
                 if stack and indent == stack[-1][3]:
-                    dtype, fullname, startline, _ = stack.pop()
-                    endline = spos[0]
-                    namespace.pop()
-                    result[fullname] = (dtype, startline, endline - emptylines)
-            elif type == token.NEWLINE:
-                # if this line contained a definition, expect an INDENT
-                # to start the suite; if there is no such INDENT
-                # it's a one-line definition
+                    close(token.start[0])
+            elif token.type == tokenize.NEWLINE:
+                # a suite may follow the line that opened a tag
                 if defline:
                     defline = False
                     expect_indent = True
                 emptylines = 0
-            elif type == token.NL:
-                # count up if line is empty or comment only
-                if emptyline_re.match(line):
+            elif token.type == tokenize.NL:
+                if emptyline_re.match(token.line):
                     emptylines += 1
                 else:
                     emptylines = 0
-        self.tags = result
-        return result
+    except (SyntaxError, tokenize.TokenError):
+        pass
 
+    end = len(source.splitlines()) + 1
+    while stack:
+        close(end)
 
-def _find_object(codetext, pos_range, name):
-    """Find the Python object at pos_range needed for diff context.
+    return result
 
-    codetext is an array of lines
-    pos_range is a two-tuple: (start, end)
-    name is a string which may be used to identify the object
+
+def find_tags(source):
+    """Find definitions and top-level statements and their location.
+
+    Returns a dict mapping dotted names to (type, start, end), where
+    start is the first line (including decorators) and end is one past
+    the last line of code, both 1 based. Definitions have type 'def' or
+    'class'. Top-level statements that start with a name are tagged by
+    that name, and so are the clauses (else, except, ...) of top-level
+    compound statements; definitions inside them are named beneath the
+    clause. Later entries with the same name replace earlier ones.
+
+    Source that doesn't parse (Python 2 code, or an unfinished step) is
+    scanned with _scan_tags instead.
 
     """
-    lineno = pos_range[0]
 
-    code = ModuleAnalyzer.for_string(''.join(codetext), name)
-    tags = code.find_tags()
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return _scan_tags(source)
+
+    lines = source.splitlines()
+    result = {}
+
+    def visit(statements, namespace):
+        for node in statements:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                 ast.ClassDef)):
+                fullname = namespace + [node.name]
+                for children in _statement_children(node):
+                    visit(children, fullname)
+
+                start = node.lineno
+                if node.decorator_list:
+                    start = node.decorator_list[0].lineno
+                result['.'.join(fullname)] = (
+                    'class' if isinstance(node, ast.ClassDef) else 'def',
+                    start,
+                    node.end_lineno + 1,
+                )
+            elif namespace:
+                for children in _statement_children(node):
+                    visit(children, namespace)
+            else:
+                visit_toplevel(node)
+
+    def visit_toplevel(node):
+        match = None
+        if node.col_offset == 0:
+            match = statement_name_re.match(lines[node.lineno - 1])
+        if not match:
+            for children in _statement_children(node):
+                visit(children, [])
+            return
+
+        # clause keywords sit at column zero between the clause bodies
+        children = list(_clause_statements(node, lines))
+        covered = set()
+        for child in children:
+            covered.update(range(child.lineno, child.end_lineno + 1))
+        clauses = [(match.group(1), node.lineno)] + [
+            (clause_re.match(lines[lineno - 1]).group(1), lineno)
+            for lineno in range(node.lineno + 1, node.end_lineno + 1)
+            if lineno not in covered and clause_re.match(lines[lineno - 1])
+        ]
+
+        for i, (name, start) in enumerate(clauses):
+            if i + 1 < len(clauses):
+                end = _code_end(lines, clauses[i + 1][1])
+            else:
+                end = node.end_lineno + 1
+
+            visit(
+                [child for child in children if start <= child.lineno < end],
+                [name],
+            )
+            result[name] = (name, start, end)
+
+    visit(tree.body, [])
+
+    return result
+
+
+class ObjectLocator(object):
+    """Find the Python objects that enclose lines of a module.
+
+    The module is parsed once. Tag boundaries are kept in a sorted
+    array, and each segment between two boundaries records the tags
+    that cover it, so a lookup is a single bisect.
 
-    # order the tags by starting position and covert to 0 based indices
-    ordered_tags = sorted(
-        [[item_type, name, start - 1, end - 1]
-         for (name, (item_type, start, end)) in tags.items()],
-        key=lambda t: t[2],
-    )
+    """
+
+    def __init__(self, codetext):
+        """codetext is an array of lines."""
+
+        tags = find_tags(''.join(codetext))
+
+        # order the tags by starting position and covert to 0 based indices
+        ordered_tags = sorted(
+            [[item_type, name, start - 1, end - 1]
+             for (name, (item_type, start, end)) in tags.items()],
+            key=lambda t: t[2],
+        )
+
+        # determine the "display end" of each tag
+        for i in range(len(ordered_tags) - 1):
+            ordered_tags[i].append(ordered_tags[i+1][2])
+        if ordered_tags:
+            ordered_tags[-1].append(ordered_tags[-1][-1])
 
-    if not ordered_tags:
-        return
+        self.tags = ordered_tags
 
-    # determine the "display end" of each tag
-    for i in range(len(ordered_tags) - 1):
-        ordered_tags[i].append(ordered_tags[i+1][2])
-    ordered_tags[-1].append(ordered_tags[-1][-1])
+        # split the lines into segments at every start and end; each
+        # segment is covered by the same tags throughout
+        self.boundaries = sorted(
+            set(tag[2] for tag in ordered_tags) |
+            set(tag[3] for tag in ordered_tags)
+        )
+        self.segments = [[] for _ in self.boundaries]
+        for index, (_, _, start, end, _) in enumerate(ordered_tags):
+            first = bisect.bisect_left(self.boundaries, start)
+            last = bisect.bisect_left(self.boundaries, end)
+            for segment in range(first, last):
+                self.segments[segment].append(index)
 
-    # find all overlapping segments
-    segments = [
-        (item_type, name, start, end, display_end)
-        for (item_type, name, start, end, display_end) in ordered_tags
-        if (lineno >= start and lineno < end)
-    ]
+    def find(self, lineno):
+        """Yield (start, display end) for each object containing lineno.
 
-    # generate (start, end) pairs
-    for _, _, start, _, end in segments:
-        yield start, end
+        Objects are yielded in order of their starting line.
+
+        """
+
+        segment = bisect.bisect_right(self.boundaries, lineno) - 1
+        if segment < 0:
+            return
+
+        for index in self.segments[segment]:
+            _, _, start, _, display_end = self.tags[index]
+            yield start, display_end
 
 
 def _strip_lines(lines):
@@ -144,35 +299,52 @@ def _strip_lines(lines):
     return lines[start:end]
 
 
-def diff_contents(previously, now, name=''):
-    """Given two versions of code and return the diff needed for documentation."""
+def diff_contents(previously, now, name='', algorithm='difflib',
+                  opcodes=None):
+    """Given two versions of code and return the diff needed for documentation.
+
+    algorithm names the line matching algorithm to use; see
+    tut.algorithms.ALGORITHMS. If the changes have already been found
+    (by git, for example) they may be passed as opcodes instead, in which
+    case previously is not used.
+
+    """
 
-    previously = previously.splitlines(keepends=True)
     now = now.splitlines(keepends=True)
+    if opcodes is None:
+        previously = previously.splitlines(keepends=True)
+        matcher = algorithms.matcher(algorithm, previously, now)
+        opcodes = [
+            opcode
+            for group in matcher.get_grouped_opcodes(n=0)
+            for opcode in group
+        ]
 
     result = []
     ranges = []
-
-    for group in difflib.SequenceMatcher(None, previously, now).get_grouped_opcodes(n=0):
-        for tag, i1, i2, j1, j2 in group:
-            if tag == 'equal':
-                ## result.extend(now[j1:j2])
-                continue
-
-            if tag in ('insert', 'replace'):
-                # determine if this is an indented block or not
-                fl_no, first_line = next(
-                    (i, line) for (i, line) in enumerate(now[j1:j2], j1)
-                    if line.rstrip()
-                )
-
-                if first_line[0] != ' ':
-                    # this block is unindented, just append it to the result
-                    ranges.append((j1, j2))
-                else:
-                    # grab the object from the code analyzer
-                    for start, end in _find_object(now, (fl_no, j2), name=name):
-                        ranges.append((start, end))
+    locator = None
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            ## result.extend(now[j1:j2])
+            continue
+
+        if tag in ('insert', 'replace'):
+            # determine if this is an indented block or not
+            fl_no, first_line = next(
+                (i, line) for (i, line) in enumerate(now[j1:j2], j1)
+                if line.rstrip()
+            )
+
+            if first_line[0] != ' ':
+                # this block is unindented, just append it to the result
+                ranges.append((j1, j2))
+            else:
+                # grab the object from the code analyzer
+                if locator is None:
+                    locator = ObjectLocator(now)
+                for start, end in locator.find(fl_no):
+                    ranges.append((start, end))
 
     # fix up overlapping ranges
     for i in range(len(ranges) - 1):
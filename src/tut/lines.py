@@ -0,0 +1,191 @@
+"""Line-indexed access to blobs that are too big to split in memory."""
+
+from array import array
+import codecs
+from collections.abc import Sequence
+import itertools
+import re
+import tempfile
+
+
+# blobs larger than this are spooled to disk while they are indexed
+SPOOL_SIZE = 1024 * 1024
+
+# number of lines decoded at a time when iterating
+READ_LINES = 1024
+
+# line boundaries str.splitlines() honors besides \n (and \r\n)
+other_boundary_re = re.compile(
+    br'\r(?!\n)|[\x0b\x0c\x1c\x1d\x1e]|\xc2\x85|\xe2\x80[\xa8\xa9]'
+)
+
+# bytes that start one of those boundaries; searching for each with
+# "in" is much faster than running the expression over every chunk
+boundary_starts = (b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e',
+                   b'\xc2\x85', b'\xe2\x80')
+
+
+class BlobIndex(object):
+    """A blob's contents and the offset of each line within them.
+
+    Write the blob's contents in chunks and call finish(); the line
+    offsets are kept in an array, so the index costs 8 bytes per line
+    however long the lines are. plain is False if the blob contains
+    line boundaries other than newlines, in which case the index will
+    not match str.splitlines(). decodes() tells whether the contents
+    are valid in an encoding, so views don't fail partway through.
+
+    """
+
+    def __init__(self):
+        self.data = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.offsets = array('Q', [0])
+        self.size = 0
+        self.plain = True
+        self.ascii = True
+        self.utf8 = True
+
+        self._tail = b''
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def write(self, chunk):
+        self.data.write(chunk)
+
+        # each line but the last in the chunk ends one past its newline
+        ends = itertools.accumulate(
+            len(line) + 1 for line in chunk.split(b'\n')[:-1]
+        )
+        self.offsets.extend(self.size + end for end in ends)
+
+        if self.plain:
+            # boundaries may be split across chunks; the last two bytes
+            # are checked again with the next chunk
+            scanned = self._tail + chunk
+            if any(start in scanned for start in boundary_starts):
+                for match in other_boundary_re.finditer(scanned):
+                    if match.start() < len(scanned) - 2:
+                        self.plain = False
+                        break
+            self._tail = scanned[-2:]
+
+        if self.ascii and not chunk.isascii():
+            self.ascii = False
+        if not self.ascii and self.utf8:
+            # earlier chunks were ascii, so the decoder starts clean
+            try:
+                self._decoder.decode(chunk)
+            except UnicodeDecodeError:
+                self.utf8 = False
+
+        self.size += len(chunk)
+
+    def finish(self):
+        if self.plain and other_boundary_re.search(self._tail):
+            self.plain = False
+        if self.utf8:
+            try:
+                self._decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                self.utf8 = False
+        if self.offsets[-1] != self.size:
+            # the last line has no newline
+            self.offsets.append(self.size)
+
+        return self
+
+    def decodes(self, encoding):
+        """Return whether the blob is valid ascii, utf-8 or utf-8-sig."""
+
+        name = codecs.lookup(encoding).name
+        if name == 'ascii':
+            return self.ascii
+        if name in ('utf-8', 'utf-8-sig'):
+            return self.utf8
+
+        raise ValueError("Can't check %s without decoding." % encoding)
+
+    def memory_size(self):
+        """Return the approximate number of bytes held in memory."""
+
+        in_memory = self.size if self.size <= SPOOL_SIZE else 0
+        return in_memory + len(self.offsets) * self.offsets.itemsize
+
+    def read(self, start, stop):
+        """Return the bytes of lines start to stop."""
+
+        if start >= stop:
+            return b''
+
+        self.data.seek(self.offsets[start])
+        return self.data.read(self.offsets[stop] - self.offsets[start])
+
+    def lines(self, encoding='utf-8', tab_width=None):
+        """Return a BlobLines view of the whole blob."""
+
+        return BlobLines(self, encoding, tab_width, 0, len(self))
+
+
+class BlobLines(Sequence):
+    """A read-only list of a blob's lines, decoded on demand.
+
+    Slicing returns another view without reading anything, so filters
+    that narrow the lines down only decode what they keep.
+
+    """
+
+    def __init__(self, index, encoding, tab_width, start, stop):
+        self.index = index
+        self.encoding = encoding
+        self.tab_width = tab_width
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _decode(self, start, stop):
+        encoding = self.encoding
+        if start and encoding == 'utf-8-sig':
+            # only the first line may start with a byte order mark
+            encoding = 'utf-8'
+
+        text = self.index.read(start, stop).decode(encoding)
+        if self.tab_width is not None:
+            text = text.expandtabs(self.tab_width)
+
+        return text.splitlines(True)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return list(self)[item]
+            return BlobLines(
+                self.index, self.encoding, self.tab_width,
+                self.start + start, self.start + max(start, stop),
+            )
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError(item)
+
+        line = self.start + item
+        return self._decode(line, line + 1)[0]
+
+    def __iter__(self):
+        for start in range(self.start, self.stop, READ_LINES):
+            for line in self._decode(start, min(start + READ_LINES, self.stop)):
+                yield line
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, BlobLines)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
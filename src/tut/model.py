@@ -1,30 +1,255 @@
+import contextlib
+import copy
+import fcntl
 import functools
+import hashlib
 import os
+import re
 
-from sh import git
-import yaml
+from tut.algorithms import parse_hunks
+from tut.cache import LRUCache
+from tut.lines import BlobIndex
+from tut.objects import (
+    BACKENDS,
+    ObjectMissing,
+    UnsupportedName,
+)
 
 
 DEFAULT_CONFIG = {
     'points': [],
 }
 
+# upper bound on the total size of blobs cached by each Tut
+DEFAULT_CACHE_SIZE = 32 * 1024 * 1024
+
+# distance between the positions of neighboring points in a PointIndex
+POINT_GAP = 1 << 16
+
 
 class TutException(Exception):
     pass
 
 
+def git(*args, **kwargs):
+    """Run git through sh.
+
+    sh (like yaml) is imported on first use; it's slow to import, and
+    commands such as ``tut points`` don't need it.
+
+    """
+
+    from sh import git
+
+    return git(*args, **kwargs)
+
+
+# propagate merges with git merge-tree --write-tree, added in git 2.38
+MERGE_TREE_GIT_VERSION = (2, 38)
+
+
+@functools.lru_cache()
+def git_version():
+    """Return the version of the installed git as a tuple of ints."""
+
+    # e.g. "git version 2.39.2" or "git version 2.39.3 (Apple Git-145)"
+    version = str(git('--version')).split()[2]
+    return tuple(int(part) for part in re.findall(r'\d+', version)[:3])
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Hold an exclusive lock on path for the duration of the block."""
+
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _worktree_head(path):
+    """Return the commit checked out in the (detached) worktree at path."""
+
+    with open(os.path.join(path, '.git')) as dot_git:
+        git_dir = dot_git.read().split('gitdir:', 1)[-1].strip()
+
+    with open(os.path.join(path, git_dir, 'HEAD')) as head:
+        return head.read().strip()
+
+
+class PointIndex(object):
+    """An ordered index of checkpoint names.
+
+    Neighbors are kept in linked maps, so previous(), next() and
+    insert_after() take constant time. Positions are numbered with gaps
+    (POINT_GAP apart), so a new point takes the number halfway between
+    its neighbors and position() is a dict lookup; the points are only
+    renumbered when two neighbors have no number left between them.
+
+    A frozen index raises TypeError on insert; copy() it to change it.
+
+    """
+
+    def __init__(self, points=()):
+        self._previous = {}
+        self._next = {}
+        self._positions = {}
+        self._first = self._last = None
+        self._frozen = False
+
+        for point in points:
+            self.append(point)
+
+    def __contains__(self, name):
+        return name in self._next
+
+    def __len__(self):
+        return len(self._next)
+
+    def __iter__(self):
+        point = self._first
+        while point is not None:
+            yield point
+            point = self._next[point]
+
+    def _check(self, name):
+        if name not in self._next:
+            raise KeyError(name)
+
+    def previous(self, name):
+        """Return the point before name, or None if it is the first."""
+
+        self._check(name)
+        return self._previous[name]
+
+    def next(self, name):
+        """Return the point after name, or None if it is the last."""
+
+        self._check(name)
+        return self._next[name]
+
+    def position(self, name):
+        """Return a number that orders name among the points.
+
+        Positions increase along the index, but aren't consecutive, and
+        an insert may renumber the other points; only compare positions
+        read since the last insert.
+
+        """
+
+        self._check(name)
+        return self._positions[name]
+
+    def after(self, name):
+        """Yield the points that follow name, in order."""
+
+        point = self.next(name)
+        while point is not None:
+            yield point
+            point = self._next[point]
+
+    @property
+    def last(self):
+        """The last point, or None if there are none."""
+
+        return self._last
+
+    def freeze(self):
+        """Refuse any later insert, and return the index."""
+
+        self._frozen = True
+        return self
+
+    def copy(self):
+        """Return a new, unfrozen index of the same points."""
+
+        return PointIndex(self)
+
+    def append(self, new):
+        """Insert new after the last point."""
+
+        self.insert_after(self._last, new)
+
+    def insert_after(self, name, new):
+        """Insert new after name, or at the start if name is None."""
+
+        if self._frozen:
+            raise TypeError("The point index is frozen; copy() it first.")
+        if new in self._next:
+            raise ValueError("Duplicate point %s." % new)
+
+        if name is None:
+            following = self._first
+            self._first = new
+        else:
+            following = self.next(name)
+            self._next[name] = new
+
+        self._previous[new] = name
+        self._next[new] = following
+        if following is None:
+            self._last = new
+        else:
+            self._previous[following] = new
+
+        self._number(new)
+
+    def _number(self, new):
+        previous, following = self._previous[new], self._next[new]
+
+        if previous is None and following is None:
+            self._positions[new] = 0
+        elif following is None:
+            self._positions[new] = self._positions[previous] + POINT_GAP
+        elif previous is None:
+            self._positions[new] = self._positions[following] - POINT_GAP
+        else:
+            low = self._positions[previous]
+            high = self._positions[following]
+            if high - low < 2:
+                # no room left between the neighbors
+                self._positions = dict(
+                    (point, position * POINT_GAP)
+                    for position, point in enumerate(self)
+                )
+            else:
+                self._positions[new] = (low + high) // 2
+
+
 class Tut(object):
 
-    def __init__(self, path):
+    def __init__(self, path, backend='git', cache_size=DEFAULT_CACHE_SIZE,
+                 fsmonitor=None):
         self.path = path
 
-        # record the current branch
+        # use git's fsmonitor and untracked cache when checking the tree;
+        # None follows the repository's tut.fsmonitor setting
+        self.fsmonitor = fsmonitor
+
+        # objects are read through git by default; the python backend
+        # reads the object database directly and never spawns git
+        self.backend = backend
+        self._objects = BACKENDS[backend](os.path.join(path, '.git'))
+
+        # blobs are cached by sha, so entries never go stale
+        self.blob_cache = LRUCache(cache_size)
+        self.index_cache = LRUCache(cache_size)
+
+        # blob names resolved by prefetch(), kept until reset()
+        self._prefetched = {}
+
+        # parsed tut.cfg, keyed by the sha of the tut branch
+        self._config_cache = (None, None)
+        self._index_cache = (None, None)
+
+        # whether the index differs from HEAD, keyed by the index's
+        # mtime and size and the sha of HEAD
+        self._staged_cache = (None, None)
+
+        # the branch to restore on reset, recorded at the first checkout
         self._initial_rev = None
-        try:
-            self._initial_rev = self._current_branch()
-        except Exception as e:
-            pass
 
     def _git(self, *args, **kwargs):
 
@@ -34,40 +259,173 @@ class Tut(object):
             *args, **kwargs
         )
 
+    def _status_git(self, *args, **kwargs):
+        """Run a git command that inspects the work tree."""
+
+        if self.fsmonitor is None:
+            self.fsmonitor = self._git(
+                'config', '--bool', '--get', 'tut.fsmonitor',
+                _ok_code=[0, 1],
+            ).strip() == 'true'
+
+        if self.fsmonitor:
+            args = (
+                '-c', 'core.fsmonitor=true',
+                '-c', 'core.untrackedCache=true',
+            ) + args
+
+        return self._git(*args, **kwargs)
+
+    def _index_state(self):
+        try:
+            index = os.stat(os.path.join(self.path, '.git', 'index'))
+            return (index.st_mtime_ns, index.st_size, self.resolve('HEAD'))
+        except FileNotFoundError:
+            return (None, None, self.resolve('HEAD'))
+
     def _repo_dirty(self):
-        """Return True if the repository is dirty."""
+        """Return True if the repository is dirty.
 
-        UNCHANGED_STATUSES = (' ', '?', '!')
+        Untracked files don't count. Both checks stop at the first
+        change they find; the index check is skipped while neither the
+        index nor HEAD has changed since it last ran.
 
-        for status_line in self._git('status', porcelain=True):
-            if not(status_line[0] in UNCHANGED_STATUSES and
-                   status_line[1] in UNCHANGED_STATUSES):
-                return True
+        """
 
-        return False
+        state = self._index_state()
+        cached_state, staged = self._staged_cache
+        if state != cached_state:
+            staged = self._git(
+                'diff-index', '--quiet', '--cached', 'HEAD', '--',
+                _ok_code=[0, 1],
+            ).exit_code != 0
+            self._staged_cache = (state, staged)
+
+        if staged:
+            return True
+
+        # edits don't touch the index, so the work tree is always checked
+        if self._status_git(
+                'diff-files', '--quiet', _ok_code=[0, 1]).exit_code == 0:
+            return False
+
+        # files that were only touched look changed until their stat
+        # info is refreshed; that walks the whole index, so it's only
+        # done once something looks changed
+        self._status_git('update-index', '-q', '--refresh', _ok_code=[0, 1])
+        # refreshing rewrites the index, but not what's staged in it
+        self._staged_cache = (self._index_state(), False)
+
+        return self._status_git(
+            'diff-files', '--quiet',
+            _ok_code=[0, 1],
+        ).exit_code != 0
+
+    def _load_config(self, branch='tut'):
+        """Return the parsed configuration, shared between callers."""
+
+        try:
+            sha = self._objects.resolve(branch)
+        except ObjectMissing:
+            if branch != 'tut':
+                raise TutException("No tut configuration at %s." % branch)
+            raise TutException("No tut branch; run tut init first.")
+
+        cached_sha, config = self._config_cache
+        if sha != cached_sha:
+            import yaml
+            config = yaml.load(
+                self.file(sha, 'tut.cfg'),
+                Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader),
+            )
+            self._config_cache = (sha, config)
+
+        return config
 
     def _config(self):
-        return yaml.load(self.file('tut', 'tut.cfg'))
+        """Return a copy of the configuration that may be modified."""
+
+        return copy.deepcopy(self._load_config())
 
     def _update_config(self, config, log=None):
 
-        branch = self._current_branch()
+        import yaml
+
+        self._commit_file(
+            'tut', 'tut.cfg',
+            yaml.dump(config, default_flow_style=False),
+            log or 'Update configuration.',
+        )
+
+    def _write_tree(self, tree, parts, blob):
+        """Write a copy of tree with the file at parts set to blob.
 
+        tree is a tree-ish, or None to start from an empty tree; parts
+        is the file's path split on '/'. Returns the new tree's sha.
+
+        """
+
+        entries = {}
+        if tree is not None:
+            listing = self._git('ls-tree', '-z', tree).stdout.decode('utf8')
+            for entry in listing.split('\0'):
+                if entry:
+                    entries[entry.split('\t', 1)[1]] = entry
+
+        name = parts[0]
+        if len(parts) == 1:
+            entries[name] = '100644 blob {0}\t{1}'.format(blob, name)
+        else:
+            subtree = None
+            if name in entries and entries[name].split()[1] == 'tree':
+                subtree = entries[name].split()[2]
+            entries[name] = '040000 tree {0}\t{1}'.format(
+                self._write_tree(subtree, parts[1:], blob), name,
+            )
+
+        return self._git(
+            'mktree', '-z',
+            _in=''.join(entry + '\0' for entry in entries.values()),
+        ).strip()
+
+    def _commit_file(self, branch, path, content, message):
+        """Commit content to path on branch using git plumbing.
+
+        The new tree and commit are built directly in the object
+        database, so neither the work tree nor the index is touched
+        (unless branch is checked out, in which case they're updated
+        to match the new commit).
+
+        """
+
+        # not self.resolve: a prefetched sha may be out of date
         try:
-            self._git('checkout', 'tut')
-            with open(os.path.join(self.path, 'tut.cfg'), 'w') as tut_cfg:
-                yaml.dump(
-                    config,
-                    tut_cfg,
-                    default_flow_style=False,
+            parent = self._objects.resolve(branch)
+        except ObjectMissing:
+            raise TutException("Unknown branch %s." % branch)
+
+        blob = self._git('hash-object', '-w', '--stdin', _in=content).strip()
+        tree = self._write_tree(parent + '^{tree}', path.split('/'), blob)
+        commit = self._git('commit-tree', tree, '-p', parent, m=message).strip()
+
+        # only move the branch if nobody else has in the meantime
+        result = self._git(
+            'update-ref', 'refs/heads/' + branch, commit, parent,
+            _ok_code=[0, 128],
+        )
+        if result.exit_code:
+            raise TutException(
+                "Could not update {0}: {1}".format(
+                    branch, result.stderr.decode('utf8').strip(),
                 )
-            self._git('add', 'tut.cfg')
-            self._git('commit',
-                m=log or 'Update configuration.',
             )
+        # resolutions looked up ahead of time may name the old commit
+        self._prefetched.clear()
 
-        finally:
-            self._git('checkout', branch)
+        if self._current_branch() == branch:
+            self._git('read-tree', '-m', '-u', parent, commit)
+
+        return commit
 
     def init(self):
         """Create a new repository with an initial commit."""
@@ -75,7 +433,7 @@ class Tut(object):
         cwd = os.getcwd()
 
         # initialize the empty repository
-        git.init(self.path)
+        git('init', self.path)
 
         self._git('commit',
             m='Initializing empty Tut project.',
@@ -88,10 +446,110 @@ class Tut(object):
             DEFAULT_CONFIG,
             log='Initializing Tut configuration.',
         )
-        self._git('checkout', 'master')
+
+    def _blob_sha(self, branch, path):
+        name = f'{branch}:{path}'
+        try:
+            sha = self._prefetched[name]
+        except KeyError:
+            sha = self.resolve(name)
+
+        if sha is None:
+            raise TutException(
+                "{0} does not exist at {1}.".format(path, branch)
+            )
+
+        return sha
+
+    def write_file(self, branch, path, content, message=None):
+        """Commit content to path on branch, unless it's already there.
+
+        Unchanged content costs a hash comparison against the blob on
+        branch. Returns the new commit's sha, or None if nothing changed.
+
+        """
+
+        if isinstance(content, str):
+            content = content.encode('utf8')
+
+        header = 'blob {0}\0'.format(len(content)).encode('ascii')
+        sha = hashlib.sha1(header + content).hexdigest()
+        if sha == self.resolve(f'{branch}:{path}'):
+            return None
+
+        return self._commit_file(
+            branch, path, content, message or 'Update {0}.'.format(path),
+        )
 
     def file(self, branch, path):
-        return self._git('--no-pager', 'show', f'{branch}:{path}').stdout
+        """Return the contents of path on branch as bytes."""
+
+        sha = self._blob_sha(branch, path)
+
+        data = self.blob_cache.get(sha)
+        if data is None:
+            _, _, data = self._objects.read(sha)
+            self.blob_cache.put(sha, data)
+
+        return data
+
+    def blob_index(self, branch, path):
+        """Return a BlobIndex of the lines of path on branch.
+
+        The blob is streamed from git into the index, so it is never
+        held in memory whole (unless it's small). Indexes are cached by
+        blob sha.
+
+        """
+
+        sha = self._blob_sha(branch, path)
+
+        index = self.index_cache.get(sha)
+        if index is None:
+            index = BlobIndex()
+            data = self.blob_cache.get(sha)
+            if data is not None:
+                index.write(data)
+            else:
+                self._objects.copy(sha, index)
+            index.finish()
+            self.index_cache.put(sha, index, size=index.memory_size())
+
+        return index
+
+    def prefetch(self, names):
+        """Resolve names and read their blobs into the cache in bulk.
+
+        names are ``branch:path`` object names. They are resolved in
+        one batch, and the blobs that aren't cached yet are read in
+        another, as many as fit in the blob cache. Later calls to file()
+        and resolve() for these names use the shas found here until
+        reset(), so only prefetch names whose branches won't move in the
+        meantime, as in a documentation build. Returns a dict mapping
+        each name to its sha, or None if it does not exist.
+
+        """
+
+        names = list(dict.fromkeys(names))
+        stats = self._objects.stat_many(names)
+
+        resolved = {}
+        wanted = {}
+        room = self.blob_cache.max_size - self.blob_cache.size
+        for name in names:
+            sha, obj_type, size = stats.get(name, (None, None, 0))
+            resolved[name] = sha
+
+            if (obj_type == 'blob' and sha not in wanted and
+                    sha not in self.blob_cache and size <= room):
+                wanted[sha] = name
+                room -= size
+
+        for sha, (_, _, data) in self._objects.read_many(list(wanted)).items():
+            self.blob_cache.put(sha, data)
+
+        self._prefetched.update(resolved)
+        return resolved
 
     def points(self, remote=None):
         """Return a list of existing checkpoints (branches).
@@ -100,11 +558,36 @@ class Tut(object):
 
         """
 
-        return self._config()['points']
+        if remote is not None:
+            return [
+                '{0}/{1}'.format(remote, point)
+                for point in self._load_config(remote + '/tut')['points']
+            ]
+
+        return list(self._load_config()['points'])
+
+    def point_index(self):
+        """Return a PointIndex of the checkpoints.
+
+        The index is shared between callers, so it is frozen; copy() it
+        to insert points.
+
+        """
+
+        points = self._load_config()['points']
+        sha, index = self._index_cache
+        if sha != self._config_cache[0]:
+            index = PointIndex(points).freeze()
+            self._index_cache = (self._config_cache[0], index)
+
+        return index
 
     def _current_branch(self):
         """Return the current branch of the repo."""
 
+        if self.backend == 'python':
+            return self._objects.current_branch()
+
         return self._git('rev-parse', '--abbrev-ref', 'HEAD').strip()
 
     def current(self):
@@ -112,7 +595,7 @@ class Tut(object):
 
         current_branch = self._current_branch()
 
-        if current_branch in self.points():
+        if current_branch in self.point_index():
             return current_branch
 
         return None
@@ -121,23 +604,22 @@ class Tut(object):
         """Start a new step (branch)."""
 
         # make sure this is not a known checkpoint
-        if name in self.points():
+        index = self.point_index()
+        if name in index:
             raise TutException("Duplicate checkpoint.")
 
-        # make sure the repo is clean
-        if self._repo_dirty():
-            raise TutException("Dirty tree.")
-
         # create the new branch
         self._git('branch', name)
 
         # add the branch to config
         config = self._config()
-        points = config['points']
-        if self.current():
-            points.insert(points.index(self.current()) + 1, name)
+        index = index.copy()
+        current = self.current()
+        if current:
+            index.insert_after(current, name)
         else:
-            points.append(name)
+            index.append(name)
+        config['points'] = list(index)
 
         self._update_config(
             config,
@@ -147,14 +629,131 @@ class Tut(object):
         # checkout the new branch
         self._git('checkout', name)
 
+    def fetch(self, remote):
+        """Create checkpoints for every point on remote.
+
+        All of the branches are created in a single ref transaction and
+        recorded with a single configuration commit; only the last new
+        checkpoint is checked out.
+
+        """
+
+        remote_points = self.points(remote)
+        if not remote_points:
+            return
+
+        names = [point.split('/')[-1] for point in remote_points]
+        known = self.point_index()
+        for name in names:
+            if name in known:
+                raise TutException("Duplicate checkpoint %s." % name)
+            if self.resolve('refs/heads/' + name) is not None:
+                raise TutException(
+                    "Branch %s already exists and is not a checkpoint." % name
+                )
+
+        shas = self._git('rev-parse', *remote_points).split()
+        self._git(
+            'update-ref', '--stdin',
+            _in=''.join(
+                'create refs/heads/{0} {1}\n'.format(name, sha)
+                for name, sha in zip(names, shas)
+            ),
+        )
+
+        config = self._config()
+        index = known.copy()
+        previous = self.current() or index.last
+        for name in names:
+            index.insert_after(previous, name)
+            previous = name
+        config['points'] = list(index)
+
+        self._update_config(
+            config,
+            log='Adding points from %s' % remote,
+        )
+
+        self._git('checkout', names[-1])
+
+    def diff_opcodes(self, old, new, algorithm='histogram'):
+        """Return the opcodes that change the object old into new.
+
+        old and new are names of blobs. The diff is computed by git, and
+        only the changes are returned, as (tag, i1, i2, j1, j2) tuples
+        like those of difflib.SequenceMatcher.get_opcodes().
+
+        """
+
+        patch = self._git(
+            'diff', '--no-color', '--no-ext-diff', '--no-textconv',
+            '--diff-algorithm=' + algorithm, '-U0', old, new,
+        ).stdout
+
+        return parse_hunks(patch)
+
+    def resolve(self, name):
+        """Return the sha name refers to, or None if it does not exist."""
+
+        if name in self._prefetched:
+            return self._prefetched[name]
+
+        try:
+            return self._objects.resolve(name)
+        except ObjectMissing:
+            return None
+        except UnsupportedName:
+            raise TutException(
+                "The python backend can't resolve {0}; "
+                "use the git backend for names like it.".format(name)
+            )
+
     def checkout(self, ref):
+        if self._initial_rev is None:
+            try:
+                self._initial_rev = self._current_branch()
+            except Exception as e:
+                pass
+
         self._git('checkout', ref)
 
+    def worktree(self, ref, cache_dir):
+        """Return the path of a worktree with ref checked out.
+
+        Worktrees are created under cache_dir the first time a ref is
+        requested and reused afterwards; they are only checked out
+        again when ref has moved since the last call.
+
+        """
+
+        sha = self.resolve(ref)
+        if sha is None:
+            raise TutException("Unknown checkpoint.")
+
+        repo_dir = os.path.join(
+            cache_dir,
+            hashlib.sha1(self.path.encode('utf8')).hexdigest()[:12],
+        )
+        path = os.path.join(repo_dir, ref.replace('/', '-'))
+        os.makedirs(repo_dir, exist_ok=True)
+
+        # parallel readers may ask for the same worktree at once
+        with _locked(os.path.join(repo_dir, '.lock')):
+            if not os.path.exists(path):
+                # forget worktrees whose directories have been removed
+                self._git('worktree', 'prune')
+                self._git('worktree', 'add', '--detach', path, sha)
+
+            elif _worktree_head(path) != sha:
+                git('-C', path, 'checkout', '--quiet', '--force', '--detach', sha)
+
+        return path
+
     def edit(self, name):
         """Start editing the checkpoint point_name."""
 
         # make sure this is a known checkpoint
-        if name not in self.points():
+        if name not in self.point_index():
             raise TutException("Unknown checkpoint.")
 
         # make sure the repo is clean
@@ -165,12 +764,11 @@ class Tut(object):
 
     def next(self, merge=False):
         current = self.current()
+        if current is None:
+            raise TutException("Not on a checkpoint.")
 
-        try:
-            switch_to = self.points()[
-                self.points().index(current) + 1
-            ]
-        except IndexError:
+        switch_to = self.point_index().next(current)
+        if switch_to is None:
             # we've reached the end of the list; switch to master
             switch_to = 'master'
 
@@ -179,8 +777,89 @@ class Tut(object):
         if merge:
             self._git('merge', current)
 
+    def propagate(self, name=None):
+        """Merge name (default: the current step) into every later step.
+
+        Merges are done with merge-tree, so nothing is checked out along
+        the way. Stops at the first conflict, leaving the steps before
+        it updated; the TutException raised names them, and lists them
+        as its ``updated`` attribute. Returns the names of the steps
+        that were updated.
+
+        """
+
+        if git_version() < MERGE_TREE_GIT_VERSION:
+            raise TutException(
+                "tut propagate needs git {0} or later; found git {1}.".format(
+                    '.'.join(map(str, MERGE_TREE_GIT_VERSION)),
+                    '.'.join(map(str, git_version())),
+                )
+            )
+
+        index = self.point_index()
+        name = name or self.current()
+        if name not in index:
+            raise TutException("Unknown checkpoint.")
+
+        later = list(index.after(name))
+        current_branch = self._current_branch()
+        if current_branch in later and self._repo_dirty():
+            raise TutException("Dirty tree.")
+
+        updated = []
+        source = name
+        for target in later:
+            source_sha = self.resolve(source)
+            target_sha = self.resolve(target)
+
+            merged = self._git(
+                'merge-base', '--is-ancestor', source_sha, target_sha,
+                _ok_code=[0, 1],
+            ).exit_code == 0
+            if not merged:
+                result = self._git(
+                    'merge-tree', '--write-tree', '--name-only',
+                    '--no-messages', target_sha, source_sha,
+                    _ok_code=[0, 1],
+                )
+                lines = result.stdout.decode('utf8').splitlines()
+                if result.exit_code:
+                    message = "Conflict merging {0} into {1}:\n{2}".format(
+                        source, target,
+                        '\n'.join('  ' + path for path in lines[1:]),
+                    )
+                    if updated:
+                        message += "\nAlready updated: {0}".format(
+                            ', '.join(updated),
+                        )
+                    error = TutException(message)
+                    error.updated = updated
+                    raise error
+
+                commit = self._git(
+                    'commit-tree', lines[0],
+                    '-p', target_sha, '-p', source_sha,
+                    m="Merge branch '{0}' into {1}".format(source, target),
+                ).strip()
+                self._git(
+                    'update-ref', 'refs/heads/' + target, commit, target_sha,
+                )
+                if target == current_branch:
+                    self._git('read-tree', '-m', '-u', target_sha, commit)
+                updated.append(target)
+
+            source = target
+
+        return updated
+
     def reset(self):
         """Reset the repo to the rev it was at when we started."""
 
+        self._prefetched.clear()
         if self._initial_rev is not None:
             self.checkout(self._initial_rev)
+
+    def close(self):
+        """Release any git processes held open by this Tut."""
+
+        self._objects.close()
@@ -0,0 +1,760 @@
+import binascii
+import glob
+import mmap
+import os
+import re
+import struct
+import subprocess
+import threading
+import zlib
+
+
+class ObjectMissing(KeyError):
+    pass
+
+
+class UnsupportedName(ValueError):
+    """An object name that ObjectStore can't resolve, but git might."""
+
+
+class CatFile(object):
+    """Read objects from a repository through long-lived git processes.
+
+    A ``git cat-file --batch`` process (and, for lookups that do not
+    need the contents, a ``--batch-check`` process) is started on first
+    use and every subsequent request is streamed through it, so reading
+    many blobs costs one process start rather than one per blob.
+
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+
+        self._processes = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the git processes and lock are per-process; start fresh on unpickle
+        return {'git_dir': self.git_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['git_dir'])
+
+    def _start(self, mode):
+        return subprocess.Popen(
+            ['git', '--git-dir={0}'.format(self.git_dir),
+             'cat-file', mode],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def _process(self, mode):
+        if self._pid != os.getpid():
+            # we've been forked (by a parallel Sphinx read); the pipes
+            # belong to the parent, so start processes of our own
+            self._processes = {}
+            self._pid = os.getpid()
+
+        if mode not in self._processes:
+            self._processes[mode] = self._start(mode)
+
+        return self._processes[mode]
+
+    def _write(self, process, request):
+        try:
+            process.stdin.write(request)
+            process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # the process has exited (or been closed after a failed
+            # read); the reader sees end of file
+            pass
+
+    def _header(self, process, name):
+        header = process.stdout.readline()
+        if not header:
+            self.close()
+            raise IOError("git cat-file exited unexpectedly.")
+
+        fields = header.split()
+        if fields[-1] in (b'missing', b'ambiguous'):
+            raise ObjectMissing(name)
+
+        sha, obj_type, size = fields
+        return sha.decode('ascii'), obj_type.decode('ascii'), int(size)
+
+    def _request(self, mode, name):
+        process = self._process(mode)
+        self._write(process, name.encode('utf8') + b'\n')
+
+        return (process,) + self._header(process, name)
+
+    def _batch(self, mode, names):
+        """Yield (name, process, sha, type, size) for each of names.
+
+        Every request is written before the first answer is read, from
+        a separate thread so a full output pipe can't stall the writes.
+        Missing names are skipped. The caller must hold the lock.
+
+        """
+
+        process = self._process(mode)
+        writer = threading.Thread(
+            target=self._write,
+            args=(process, b''.join(
+                name.encode('utf8') + b'\n' for name in names
+            )),
+        )
+        writer.start()
+
+        try:
+            for name in names:
+                try:
+                    yield (name, process) + self._header(process, name)
+                except ObjectMissing:
+                    pass
+        finally:
+            writer.join()
+
+    def resolve(self, name):
+        """Return the hex sha for an object name."""
+
+        with self._lock:
+            _, sha, _, _ = self._request('--batch-check', name)
+
+        return sha
+
+    def read(self, name):
+        """Return (sha, type, data) for the object identified by name.
+
+        name may be anything git understands as an object name, such as
+        ``branch:path/to/file``.
+
+        """
+
+        with self._lock:
+            process, sha, obj_type, size = self._request('--batch', name)
+            data = process.stdout.read(size)
+            # each object is followed by a newline
+            process.stdout.read(1)
+
+        return sha, obj_type, data
+
+    def copy(self, name, out, chunk_size=65536):
+        """Write the contents of an object to out, a chunk at a time.
+
+        Returns (sha, type, size); the contents are never held in
+        memory all at once.
+
+        """
+
+        with self._lock:
+            process, sha, obj_type, size = self._request('--batch', name)
+            remaining = size
+            while remaining:
+                chunk = process.stdout.read(min(chunk_size, remaining))
+                out.write(chunk)
+                remaining -= len(chunk)
+            process.stdout.read(1)
+
+        return sha, obj_type, size
+
+    def stat_many(self, names):
+        """Return {name: (sha, type, size)} for names that exist.
+
+        All of the names are looked up in a single round trip.
+
+        """
+
+        with self._lock:
+            return {
+                name: (sha, obj_type, size)
+                for name, _, sha, obj_type, size
+                in self._batch('--batch-check', names)
+            }
+
+    def read_many(self, names):
+        """Return {name: (sha, type, data)} for names that exist.
+
+        All of the objects are read in a single round trip.
+
+        """
+
+        result = {}
+        with self._lock:
+            for name, process, sha, obj_type, size in self._batch(
+                    '--batch', names):
+                result[name] = (sha, obj_type, process.stdout.read(size))
+                process.stdout.read(1)
+
+        return result
+
+    def close(self):
+        """Shut down any running git processes."""
+
+        processes, self._processes = self._processes, {}
+        for process in processes.values():
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                # the process already exited; the request was lost anyway
+                pass
+            process.wait()
+            process.stdout.close()
+
+
+OBJECT_TYPES = {
+    1: 'commit',
+    2: 'tree',
+    3: 'blob',
+    4: 'tag',
+}
+OFS_DELTA = 6
+REF_DELTA = 7
+
+REF_PREFIXES = (
+    '',
+    'refs/',
+    'refs/tags/',
+    'refs/heads/',
+    'refs/remotes/',
+)
+
+# an abbreviated sha, as git accepts it
+short_sha_re = re.compile(r'[0-9a-fA-F]{4,39}')
+# one ^{type}, ^<n> or ~<n> suffix of a revision
+rev_suffix_re = re.compile(r'\^\{(\w*)\}|\^(\d*)|~(\d*)')
+
+
+def _apply_delta(base, delta):
+    """Apply a git delta to base and return the result."""
+
+    def varint(pos):
+        value = shift = 0
+        while True:
+            byte = delta[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value, pos
+
+    _, pos = varint(0)   # base size
+    _, pos = varint(pos)  # result size
+
+    result = []
+    while pos < len(delta):
+        opcode = delta[pos]
+        pos += 1
+        if opcode & 0x80:
+            # copy a range from the base object
+            offset = size = 0
+            for i in range(4):
+                if opcode & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if opcode & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            result.append(base[offset:offset + (size or 0x10000)])
+        elif opcode:
+            # insert literal data from the delta
+            result.append(delta[pos:pos + opcode])
+            pos += opcode
+        else:
+            raise ValueError("Invalid delta opcode.")
+
+    return b''.join(result)
+
+
+class Pack(object):
+    """A packfile and its version 2 index, accessed through mmap."""
+
+    def __init__(self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-len('.idx')] + '.pack'
+
+        with open(self.idx_path, 'rb') as idx_file:
+            self._idx = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(self.pack_path, 'rb') as pack_file:
+            self._pack = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._idx[:4] != b'\377tOc' or self._idx[4:8] != b'\0\0\0\2':
+            raise ValueError("Unsupported pack index %s." % idx_path)
+
+        self._fanout = struct.unpack('>256I', self._idx[8:8 + 1024])
+        self._count = self._fanout[-1]
+        self._shas = 8 + 1024
+        self._offsets = self._shas + self._count * 24
+        self._large_offsets = self._offsets + self._count * 4
+
+    def close(self):
+        self._idx.close()
+        self._pack.close()
+
+    def offset(self, sha):
+        """Return the pack offset of the binary sha, or None."""
+
+        first = sha[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._shas + mid * 20
+            candidate = self._idx[pos:pos + 20]
+            if candidate < sha:
+                lo = mid + 1
+            elif candidate > sha:
+                hi = mid
+            else:
+                pos = self._offsets + mid * 4
+                offset, = struct.unpack('>I', self._idx[pos:pos + 4])
+                if offset & 0x80000000:
+                    pos = self._large_offsets + (offset & 0x7fffffff) * 8
+                    offset, = struct.unpack('>Q', self._idx[pos:pos + 8])
+                return offset
+
+        return None
+
+    def shas_with_prefix(self, prefix):
+        """Yield the hex shas in the pack that start with prefix."""
+
+        # the smallest binary sha with the prefix
+        lowest = binascii.unhexlify(prefix + '0' * (len(prefix) % 2))
+        first = lowest[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._shas + mid * 20
+            if self._idx[pos:pos + 20] < lowest:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        for index in range(lo, self._count):
+            pos = self._shas + index * 20
+            sha = binascii.hexlify(self._idx[pos:pos + 20]).decode('ascii')
+            if not sha.startswith(prefix):
+                break
+            yield sha
+
+    def _inflate(self, pos, size):
+        decompressor = zlib.decompressobj()
+        chunks = []
+        while not decompressor.eof:
+            if pos >= len(self._pack):
+                raise ValueError("Truncated object in %s." % self.pack_path)
+            chunk = decompressor.decompress(self._pack[pos:pos + 65536])
+            chunks.append(chunk)
+            pos += 65536
+        return b''.join(chunks)[:size]
+
+    def read_at(self, offset, store):
+        """Return (type, data) for the object at offset."""
+
+        pos = offset
+        byte = self._pack[pos]
+        pos += 1
+        obj_type = (byte >> 4) & 0x7
+        size = byte & 0x0f
+        shift = 4
+        while byte & 0x80:
+            byte = self._pack[pos]
+            pos += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+
+        if obj_type == OFS_DELTA:
+            byte = self._pack[pos]
+            pos += 1
+            base_offset = byte & 0x7f
+            while byte & 0x80:
+                byte = self._pack[pos]
+                pos += 1
+                base_offset = ((base_offset + 1) << 7) | (byte & 0x7f)
+            base_type, base = self.read_at(offset - base_offset, store)
+            return base_type, _apply_delta(base, self._inflate(pos, size))
+
+        if obj_type == REF_DELTA:
+            base_sha = binascii.hexlify(self._pack[pos:pos + 20]).decode('ascii')
+            base_type, base = store.read_object(base_sha)
+            return base_type, _apply_delta(base, self._inflate(pos + 20, size))
+
+        return OBJECT_TYPES[obj_type], self._inflate(pos, size)
+
+
+# refs kept per worktree rather than shared through the common directory
+WORKTREE_REF_PREFIXES = ('refs/worktree/', 'refs/bisect/', 'refs/rewritten/')
+
+
+def _git_dirs(git_dir):
+    """Return (git_dir, common_dir) for a repository's .git.
+
+    git_dir may be a gitfile (``gitdir: <path>``), as in a worktree or a
+    submodule; the directory it names is followed. Linked worktrees
+    share refs and objects through the directory named by ``commondir``.
+
+    """
+
+    if os.path.isfile(git_dir):
+        with open(git_dir) as gitfile:
+            value = gitfile.read().strip()
+        if not value.startswith('gitdir: '):
+            raise IOError("{0} is not a git directory.".format(git_dir))
+        git_dir = os.path.join(os.path.dirname(git_dir), value[8:])
+
+    try:
+        with open(os.path.join(git_dir, 'commondir')) as commondir:
+            common_dir = os.path.join(git_dir, commondir.read().strip())
+    except FileNotFoundError:
+        common_dir = git_dir
+
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+class ObjectStore(object):
+    """Read objects directly from a repository's object database.
+
+    Refs (loose and packed), loose objects and packfiles are read in
+    process, so no git subprocess is needed to fetch file contents.
+    Gitfiles, linked worktrees and alternate object directories are
+    followed. Only reads are supported; writes still go through git.
+
+    """
+
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+
+        self._git_dir, self._common_dir = _git_dirs(git_dir)
+        self._object_dirs = self._find_object_dirs(
+            os.path.join(self._common_dir, 'objects'),
+        )
+        self._packs = {}
+
+    def __getstate__(self):
+        # mmapped packs are reopened on demand after unpickling
+        return {'git_dir': self.git_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state['git_dir'])
+
+    def _find_object_dirs(self, objects_dir, found=None):
+        """Return objects_dir and the alternates it borrows from."""
+
+        found = found if found is not None else []
+        if objects_dir in found:
+            return found
+        found.append(objects_dir)
+
+        try:
+            with open(os.path.join(objects_dir, 'info', 'alternates')) as alts:
+                alternates = alts.read().splitlines()
+        except FileNotFoundError:
+            alternates = []
+
+        for alternate in alternates:
+            if alternate and not alternate.startswith('#'):
+                self._find_object_dirs(
+                    os.path.normpath(os.path.join(objects_dir, alternate)),
+                    found,
+                )
+
+        return found
+
+    def _load_packs(self):
+        for objects_dir in self._object_dirs:
+            for idx_path in glob.glob(
+                    os.path.join(objects_dir, 'pack', '*.idx')):
+                if idx_path not in self._packs:
+                    self._packs[idx_path] = Pack(idx_path)
+
+    def _packed_refs(self):
+        refs = {}
+        try:
+            with open(os.path.join(self._common_dir, 'packed-refs')) as packed:
+                for line in packed:
+                    if line.startswith(('#', '^')):
+                        continue
+                    sha, ref = line.split()
+                    refs[ref] = sha
+        except FileNotFoundError:
+            pass
+
+        return refs
+
+    def _read_ref(self, ref, packed):
+        ref_dir = self._common_dir
+        if not ref.startswith('refs/') or ref.startswith(WORKTREE_REF_PREFIXES):
+            ref_dir = self._git_dir
+
+        try:
+            with open(os.path.join(ref_dir, ref)) as ref_file:
+                value = ref_file.read().strip()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            return packed.get(ref)
+
+        if value.startswith('ref: '):
+            return self._read_ref(value[5:], packed)
+
+        return value
+
+    def current_branch(self):
+        """Return the checked out branch, or HEAD if it is detached."""
+
+        with open(os.path.join(self._git_dir, 'HEAD')) as head:
+            value = head.read().strip()
+
+        if value.startswith('ref: refs/heads/'):
+            return value[len('ref: refs/heads/'):]
+
+        return 'HEAD'
+
+    def resolve_ref(self, name):
+        """Return the sha a ref name points to, or None."""
+
+        if len(name) == 40:
+            try:
+                binascii.unhexlify(name)
+                return name
+            except binascii.Error:
+                pass
+
+        packed = self._packed_refs()
+        for prefix in REF_PREFIXES:
+            if not prefix and not name.isupper():
+                # only pseudo-refs such as HEAD live directly in GIT_DIR
+                continue
+            sha = self._read_ref(prefix + name, packed)
+            if sha is not None:
+                return sha
+
+        return self._read_ref('refs/remotes/%s/HEAD' % name, packed)
+
+    def _expand_sha(self, prefix):
+        """Return the sha abbreviated to prefix, or None.
+
+        Raises ObjectMissing if more than one object matches, as git
+        cat-file does.
+
+        """
+
+        prefix = prefix.lower()
+        found = set()
+        for objects_dir in self._object_dirs:
+            try:
+                entries = os.listdir(os.path.join(objects_dir, prefix[:2]))
+            except FileNotFoundError:
+                continue
+            found.update(
+                prefix[:2] + entry for entry in entries
+                if entry.startswith(prefix[2:]) and len(entry) == 38
+            )
+
+        self._load_packs()
+        for pack in self._packs.values():
+            found.update(pack.shas_with_prefix(prefix))
+
+        if len(found) > 1:
+            raise ObjectMissing(prefix)
+
+        return found.pop() if found else None
+
+    def _parents(self, sha):
+        _, data = self._peel(sha, 'commit')
+        header = data.split(b'\n\n', 1)[0]
+
+        return [
+            line.split()[1].decode('ascii')
+            for line in header.split(b'\n')
+            if line.startswith(b'parent ')
+        ]
+
+    def read_object(self, sha):
+        """Return (type, data) for the object with the hex sha."""
+
+        for objects_dir in self._object_dirs:
+            loose = os.path.join(objects_dir, sha[:2], sha[2:])
+            try:
+                with open(loose, 'rb') as loose_file:
+                    raw = zlib.decompress(loose_file.read())
+            except FileNotFoundError:
+                continue
+            header, data = raw.split(b'\0', 1)
+            return header.split()[0].decode('ascii'), data
+
+        binsha = binascii.unhexlify(sha)
+        for attempt in range(2):
+            for pack in self._packs.values():
+                offset = pack.offset(binsha)
+                if offset is not None:
+                    return pack.read_at(offset, self)
+            # new packs may have been written since we last looked
+            self._load_packs()
+
+        raise ObjectMissing(sha)
+
+    def _peel(self, sha, wanted):
+        obj_type, data = self.read_object(sha)
+        while obj_type != wanted:
+            if obj_type == 'tag':
+                sha = data.split(b'\n', 1)[0].split()[1].decode('ascii')
+            elif obj_type == 'commit' and wanted == 'tree':
+                sha = data.split(b'\n', 1)[0].split()[1].decode('ascii')
+            else:
+                raise ObjectMissing(sha)
+            obj_type, data = self.read_object(sha)
+
+        return sha, data
+
+    def _tree_entry(self, tree, name):
+        pos = 0
+        while pos < len(tree):
+            space = tree.index(b' ', pos)
+            nul = tree.index(b'\0', space)
+            if tree[space + 1:nul] == name:
+                return binascii.hexlify(tree[nul + 1:nul + 21]).decode('ascii')
+            pos = nul + 21
+
+        return None
+
+    def _resolve_base(self, name):
+        if name == '@':
+            name = 'HEAD'
+
+        sha = self.resolve_ref(name)
+        if sha is None and short_sha_re.fullmatch(name):
+            sha = self._expand_sha(name)
+
+        return sha
+
+    def _apply_suffix(self, sha, match):
+        peel, parent, ancestor = match.groups()
+
+        if peel is not None:
+            if peel == 'object':
+                return sha
+            if peel == '':
+                # ^{} peels tags
+                obj_type, data = self.read_object(sha)
+                while obj_type == 'tag':
+                    sha = data.split(b'\n', 1)[0].split()[1].decode('ascii')
+                    obj_type, data = self.read_object(sha)
+                return sha
+            return self._peel(sha, peel)[0]
+
+        if parent is not None:
+            number = int(parent or 1)
+            if number == 0:
+                return self._peel(sha, 'commit')[0]
+            parents = self._parents(sha)
+            if number > len(parents):
+                raise ObjectMissing(sha)
+            return parents[number - 1]
+
+        for _ in range(int(ancestor or 1)):
+            parents = self._parents(sha)
+            if not parents:
+                raise ObjectMissing(sha)
+            sha = parents[0]
+
+        return sha
+
+    def resolve(self, name):
+        """Return the hex sha for an object name.
+
+        Supported names are refs, full and abbreviated shas, followed
+        by any of ``~<n>``, ``^<n>`` and ``^{type}``, and optionally
+        ``:path/to/file``. Other forms git understands (reflogs,
+        ``:/text``, the index) raise UnsupportedName.
+
+        """
+
+        rev, sep, path = name.partition(':')
+        if (sep and not rev) or '@{' in rev or '..' in rev:
+            raise UnsupportedName(name)
+
+        base = re.split(r'[~^]', rev, 1)[0]
+        sha = self._resolve_base(base)
+        if sha is None:
+            raise ObjectMissing(name)
+
+        pos = len(base)
+        while pos < len(rev):
+            match = rev_suffix_re.match(rev, pos)
+            if match is None:
+                raise UnsupportedName(name)
+            try:
+                sha = self._apply_suffix(sha, match)
+            except ObjectMissing:
+                raise ObjectMissing(name)
+            pos = match.end()
+
+        if not sep:
+            return sha
+
+        sha, tree = self._peel(sha, 'tree')
+        parts = path.split('/') if path else []
+        for i, part in enumerate(parts):
+            sha = self._tree_entry(tree, part.encode('utf8'))
+            if sha is None:
+                raise ObjectMissing(name)
+            if i < len(parts) - 1:
+                obj_type, tree = self.read_object(sha)
+                if obj_type != 'tree':
+                    raise ObjectMissing(name)
+
+        return sha
+
+    def read(self, name):
+        """Return (sha, type, data) for the object identified by name."""
+
+        sha = self.resolve(name)
+        obj_type, data = self.read_object(sha)
+
+        return sha, obj_type, data
+
+    def copy(self, name, out):
+        """Write the contents of an object to out."""
+
+        sha, obj_type, data = self.read(name)
+        out.write(data)
+
+        return sha, obj_type, len(data)
+
+    def stat_many(self, names):
+        """Return {name: (sha, type, size)} for names that exist."""
+
+        return {
+            name: (sha, obj_type, len(data))
+            for name, (sha, obj_type, data) in self.read_many(names).items()
+        }
+
+    def read_many(self, names):
+        """Return {name: (sha, type, data)} for names that exist."""
+
+        result = {}
+        for name in names:
+            try:
+                result[name] = self.read(name)
+            except (ObjectMissing, UnsupportedName):
+                # left for resolve() or read() to report
+                pass
+
+        return result
+
+    def close(self):
+        """Release any mapped packfiles."""
+
+        packs, self._packs = self._packs, {}
+        for pack in packs.values():
+            pack.close()
+
+
+BACKENDS = {
+    'git': CatFile,
+    'python': ObjectStore,
+}
@@ -0,0 +1,298 @@
+"""Long-lived shells for running a tutorial's commands."""
+
+import os
+import select
+import shlex
+import signal
+import subprocess
+import time
+import uuid
+
+
+# bump when the way commands are run or cached changes
+EXEC_VERSION = 1
+
+
+class ShellError(Exception):
+    pass
+
+
+class ShellSession(object):
+    """A shell that runs commands one at a time, keeping its state.
+
+    Every command is run by the same shell process, so ``cd``, variables
+    and functions carry over from one command to the next. Output is
+    read up to a sentinel line the shell prints after each command,
+    which also carries the command's exit status. Commands read from
+    /dev/null rather than the shell's input.
+
+    A command that runs longer than timeout seconds kills the shell.
+    Output beyond max_output bytes is read but not kept.
+
+    """
+
+    def __init__(self, cwd, env=None, shell='bash', timeout=None,
+                 max_output=None):
+        self.cwd = cwd
+        self.env = env
+        self.shell = shell
+        self.timeout = timeout
+        self.max_output = max_output
+
+        self._process = None
+        self._sentinel = uuid.uuid4().hex.encode('ascii')
+
+    def __getstate__(self):
+        # the shell is per-process; start a fresh one on unpickle
+        return {
+            'cwd': self.cwd,
+            'env': self.env,
+            'shell': self.shell,
+            'timeout': self.timeout,
+            'max_output': self.max_output,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _start(self):
+        env = None
+        if self.env:
+            env = dict(os.environ, **self.env)
+
+        return subprocess.Popen(
+            [self.shell],
+            cwd=self.cwd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            # in its own process group, so a timeout can kill it all
+            start_new_session=True,
+        )
+
+    def _read(self, process, deadline):
+        if deadline is not None:
+            ready, _, _ = select.select(
+                [process.stdout], [], [], max(deadline - time.monotonic(), 0),
+            )
+            if not ready:
+                return None
+
+        return os.read(process.stdout.fileno(), 65536)
+
+    def run(self, command):
+        """Run command and return (status, output).
+
+        output is the bytes written to stdout and stderr. Raises
+        ShellError if the shell itself exits.
+
+        """
+
+        if self._process is None:
+            self._process = self._start()
+        process = self._process
+
+        # eval keeps a syntax error from ending the shell
+        script = "eval {0} < /dev/null 2>&1\nprintf '\\n%s %d\\n' {1} $?\n".format(
+            shlex.quote(command), self._sentinel.decode('ascii'),
+        )
+        try:
+            process.stdin.write(script.encode('utf8'))
+            process.stdin.flush()
+        except BrokenPipeError:
+            pass
+
+        marker = b'\n' + self._sentinel + b' '
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.monotonic() + self.timeout
+
+        data = bytearray()
+        dropped = 0
+        searched = 0
+        position = -1
+        while True:
+            if position == -1:
+                position = data.find(marker, max(0, searched - len(marker)))
+                searched = len(data)
+            if position != -1:
+                end = data.find(b'\n', position + len(marker))
+                if end != -1:
+                    break
+
+            chunk = self._read(process, deadline)
+            if chunk is None:
+                self.kill()
+                raise ShellError(
+                    "{0!r} timed out after {1} seconds.".format(
+                        command, self.timeout,
+                    )
+                )
+            if not chunk:
+                self.close()
+                raise ShellError(
+                    "The shell exited running {0!r}:\n{1}".format(
+                        command, data.decode('utf8', 'replace'),
+                    )
+                )
+            data += chunk
+
+            keep = len(marker) + 32
+            if (self.max_output is not None and position == -1 and
+                    len(data) > self.max_output + keep):
+                # drop what's past the limit, but keep enough of the end
+                # to find the sentinel in
+                excess = len(data) - self.max_output - keep
+                del data[self.max_output:self.max_output + excess]
+                dropped += excess
+                searched = min(searched, self.max_output)
+
+        status = int(data[position + len(marker):end])
+        output = bytes(data[:position])
+        if self.max_output is not None and len(output) > self.max_output:
+            dropped += len(output) - self.max_output
+            output = output[:self.max_output]
+        if dropped:
+            output += '\n[{0} more bytes of output]\n'.format(
+                dropped,
+            ).encode('utf8')
+
+        return status, output
+
+    def kill(self):
+        """Stop the shell and anything it's running."""
+
+        process = self._process
+        if process is not None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.close()
+
+    def close(self):
+        """Stop the shell."""
+
+        process, self._process = self._process, None
+        if process is None:
+            return
+
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        process.wait()
+        process.stdout.close()
+
+
+class ExecSession(object):
+    """Runs a checkpoint's commands in a shell, from a cache when it can.
+
+    A command's output depends on the commands run before it in the
+    same shell, so cache keys include every command run so far. Cached
+    commands are only run for real, to bring the shell up to date, when
+    a later command misses the cache. results, if given, maps command
+    histories to outputs (or errors) found by an earlier run, and is
+    consulted before the cache. Once a command ends the shell, later
+    commands raise ShellError rather than run without its state.
+
+    """
+
+    def __init__(self, shell, tree=None, cache=None, env=None, results=None):
+        self.shell = shell
+        self.tree = tree
+        self.cache = cache if tree is not None else None
+        self.env = env or {}
+        self.results = results or {}
+
+        self.history = []
+        self._pending = []
+        # the error that ended the shell, if one has
+        self._error = None
+
+    def _key(self, history):
+        return (
+            self.tree, tuple(history), tuple(sorted(self.env.items())),
+            EXEC_VERSION,
+        )
+
+    def is_cached(self, commands):
+        """Return True if running commands next would not need a shell."""
+
+        if self.cache is None:
+            return False
+
+        history = list(self.history)
+        for command in commands:
+            history.append(command)
+            if self.cache.get(self._key(history)) is None:
+                return False
+
+        return True
+
+    def run(self, command):
+        """Return the output of command as text."""
+
+        if self._error is not None:
+            raise ShellError(
+                "{0!r} was not run; an earlier command failed: {1}".format(
+                    command, self._error,
+                )
+            )
+
+        self.history.append(command)
+        history = tuple(self.history)
+
+        if history in self.results:
+            result = self.results[history]
+            if isinstance(result, ShellError):
+                self._error = result
+                raise result
+            self._pending.append(command)
+            return result
+
+        key = self._key(history)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            self._pending.append(command)
+            return cached.decode('utf8')
+
+        try:
+            for pending in self._pending:
+                self.shell.run(pending)
+            self._pending = []
+
+            _, output = self.shell.run(command)
+        except ShellError as error:
+            self._error = error
+            raise
+
+        text = output.decode('utf8', 'replace')
+        if self.cache is not None:
+            self.cache.put(key, text.encode('utf8'))
+
+        return text
+
+    def run_all(self, commands):
+        """Run commands, returning the results to hand to a later session.
+
+        Stops at the first command the shell fails to run, recording
+        its error.
+
+        """
+
+        results = {}
+        for command in commands:
+            try:
+                output = self.run(command)
+            except ShellError as error:
+                output = error
+            results[tuple(self.history)] = output
+            if isinstance(output, ShellError):
+                break
+
+        return results
+
+    def close(self):
+        self.shell.close()
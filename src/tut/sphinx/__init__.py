@@ -1,36 +1,64 @@
 from docutils.nodes import reference
 
 from tut import version
+from tut.model import DEFAULT_CACHE_SIZE
+from tut.sphinx.manager import (
+    DEFAULT_DIFF_CACHE_SIZE,
+    DEFAULT_EXEC_CACHE_SIZE,
+    DEFAULT_EXEC_MAX_OUTPUT,
+)
 from tut.sphinx.checkpoint import (
     TutDefaults,
     TutCheckpoint,
     initialize,
     cleanup,
+    get_outdated,
+    merge_info,
+    purge_doc,
+)
+from tut.sphinx.content import (
+    TutContent,
+    TutExec,
 )
-# from tut.sphinx.content import (
-#     TutContent,
-#     TutExec,
-# )
 from tut.sphinx.code import (
     TutCodeDiff,
     TutLiteralInclude,
 )
+from tut.sphinx.scan import read_ahead
 
 
 def setup(app):
 
     app.add_directive('tut', TutDefaults)
-    # app.add_directive('tut:exec', TutExec)
-    # app.add_directive('tut:content', TutContent)
+    app.add_directive('tut:exec', TutExec)
+    app.add_directive('tut:content', TutContent)
     app.add_directive('checkpoint', TutCheckpoint)
     app.add_directive('tut:checkpoint', TutCheckpoint)
     app.add_directive('tut:literalinclude', TutLiteralInclude)
     app.add_directive('tut:diff', TutCodeDiff)
 
+    app.add_config_value('tut_backend', 'git', 'env')
+    app.add_config_value('tut_cache_size', DEFAULT_CACHE_SIZE, '')
+    app.add_config_value('tut_checkpoint_mode', 'checkout', 'env')
+    app.add_config_value('tut_content_mode', 'write', 'env')
+    app.add_config_value('tut_worktree_dir', None, '')
+    app.add_config_value('tut_diff_algorithm', 'difflib', 'env')
+    app.add_config_value('tut_diff_cache_size', DEFAULT_DIFF_CACHE_SIZE, '')
+    app.add_config_value('tut_exec_env', {}, 'env')
+    app.add_config_value('tut_exec_cache_size', DEFAULT_EXEC_CACHE_SIZE, '')
+    app.add_config_value('tut_exec_timeout', None, 'env')
+    app.add_config_value('tut_exec_max_output', DEFAULT_EXEC_MAX_OUTPUT, 'env')
+    app.add_config_value('tut_exec_workers', None, '')
+
     app.connect('builder-inited', initialize)
     app.connect('build-finished', cleanup)
+    app.connect('env-get-outdated', get_outdated)
+    app.connect('env-before-read-docs', read_ahead)
+    app.connect('env-purge-doc', purge_doc)
+    app.connect('env-merge-info', merge_info)
 
     return {
         'version': version(),
-        'parallel_read_safe': False,
+        # reset to False by initialize() for tut_checkpoint_mode = 'checkout'
+        'parallel_read_safe': True,
     }
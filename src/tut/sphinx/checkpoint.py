@@ -5,6 +5,7 @@ import sh
 from docutils.parsers.rst import Directive, directives
 import sphinx.pycode
 
+from tut.model import TutException
 from .manager import TutManager
 
 
@@ -15,8 +16,9 @@ class TutDefaults(Directive):
     }
 
     def run(self):
-        manager = TutManager.get(self.state.document.settings.env)
-        manager.update_defaults(self.options)
+        env = self.state.document.settings.env
+        manager = TutManager.get(env)
+        manager.update_defaults(self.options, env.docname)
 
         return []
 
@@ -32,19 +34,69 @@ class TutCheckpoint(Directive):
     }
 
     def run(self):
-        manager = TutManager.get(self.state.document.settings.env)
+        env = self.state.document.settings.env
+        manager = TutManager.get(env)
         path = manager.resolve_option(self, 'path')
 
         # paths are relative to the project root
-        rel_path, tut_path = self.state.document.settings.env.relfn2path(path)
+        rel_path, tut_path = env.relfn2path(path)
         git_ref = self.arguments[0].strip().lower()
+        manager.note_checkpoint(
+            getattr(env, 'docname', None), tut_path, git_ref,
+        )
 
+        if manager.checkpoint_mode == 'objects':
+            # only record the ref; tut directives read from the object db
+            if manager.tut(tut_path).resolve(git_ref) is None:
+                raise ValueError(
+                    "git checkpoint '%s' does not exist." % (git_ref,)
+                )
+            self.state.document.git_ref = git_ref
+
+            return []
+
+        if manager.checkpoint_mode == 'worktree':
+            try:
+                worktree = manager.tut(tut_path).worktree(
+                    git_ref, manager.worktree_dir,
+                )
+            except TutException:
+                raise ValueError(
+                    "git checkpoint '%s' does not exist." % (git_ref,)
+                )
+            self.state.document.git_ref = git_ref
+
+            # anything in the worktree may be included, so the document
+            # depends on the whole checkpoint
+            manager.note_dependency(env.docname, tut_path, git_ref)
+
+            # WorktreePaths sends file lookups in the repo here
+            env.temp_data.setdefault('tut_worktrees', {})[tut_path] = worktree
+
+            return []
+
+        if manager.checked_out.get(tut_path) == git_ref:
+            # still checked out from an earlier checkpoint, so the work
+            # tree (and what's been analyzed from it) is current
+            self.state.document.git_ref = git_ref
+            manager.note_dependency(
+                getattr(env, 'docname', None), tut_path, git_ref,
+            )
+
+            return []
+
+        manager.checked_out.pop(tut_path, None)
         try:
             manager.tut(tut_path).checkout(git_ref)
+            manager.checked_out[tut_path] = git_ref
             self.state.document.git_ref = git_ref
+            manager.note_dependency(
+                getattr(env, 'docname', None), tut_path, git_ref,
+            )
 
         except sh.ErrorReturnCode_1 as git_error:
-            if ("error: pathspec '%s' did not match any file(s) known to git.\n" % (git_ref,)).encode() == git_error.stderr:
+            if (("error: pathspec '%s' did not match any file(s) known to git" % (git_ref,)).encode()
+                    in git_error.stderr):
                 raise ValueError(
                     "git checkpoint '%s' does not exist." % (git_ref,)
                 )
@@ -55,9 +107,61 @@ class TutCheckpoint(Directive):
         return []
 
 
+class WorktreePaths(object):
+    """Replacement for BuildEnvironment.relfn2path in worktree mode.
+
+    Paths inside a repository that the current document has a
+    checkpoint for are redirected into that checkpoint's worktree, so
+    stock directives such as literalinclude see the checkpoint's files.
+
+    """
+
+    def __init__(self, env):
+        self.env = env
+
+    def __call__(self, filename, docname=None):
+        rel_fn, abs_fn = type(self.env).relfn2path(self.env, filename, docname)
+
+        worktrees = self.env.temp_data.get('tut_worktrees', {})
+        for tut_path, worktree in worktrees.items():
+            if abs_fn.startswith(tut_path + os.sep):
+                abs_fn = worktree + abs_fn[len(tut_path):]
+                break
+
+        return rel_fn, abs_fn
+
+
 def initialize(app):
 
-    TutManager.get(app.env).reset()
+    manager = TutManager.get(app.env)
+    manager.reset()
+    manager.configure(app)
+
+    if manager.checkpoint_mode == 'worktree':
+        app.env.relfn2path = WorktreePaths(app.env)
+    else:
+        app.env.__dict__.pop('relfn2path', None)
+
+    # checkouts change the shared work tree, so documents can only be
+    # read in parallel when checkpoints leave it alone
+    app.extensions['tut.sphinx'].parallel_read_safe = (
+        manager.checkpoint_mode != 'checkout'
+    )
+
+
+def get_outdated(app, env, added, changed, removed):
+
+    return TutManager.get(env).outdated() - removed
+
+
+def purge_doc(app, env, docname):
+
+    TutManager.get(env).purge_doc(docname)
+
+
+def merge_info(app, env, docnames, other):
+
+    TutManager.get(env).merge(docnames, TutManager.get(other))
 
 
 def cleanup(app, exception):
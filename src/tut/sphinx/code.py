@@ -1,3 +1,5 @@
+import codecs
+
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
 from docutils.statemachine import ViewList
@@ -6,25 +8,42 @@ from sphinx.directives.code import (
     LiteralInclude,
     LiteralIncludeReader as SphinxLiteralIncludeReader,
 )
+from sphinx.locale import _
 from sphinx.util.nodes import set_source_info
 
 from tut import diff
+from tut.algorithms import NATIVE_ALGORITHMS
 from .manager import TutManager
 
 
+# encodings in which each line can be decoded separately
+LINE_ENCODINGS = ('ascii', 'utf-8', 'utf-8-sig')
+
+
 class LiteralIncludeReader(SphinxLiteralIncludeReader):
 
-    def __init__(self, filename, options, config, tut, gitref):
+    def __init__(self, filename, options, config, tut, gitref, path):
         self._tut = tut
         self._gitref = gitref
+        self._path = path
 
         super().__init__(filename, options, config)
 
     def read_file(self, filename, location=None):
         # type: (unicode, Any) -> List[unicode]
 
+        if ('dedent' not in self.options and
+                codecs.lookup(self.encoding).name in LINE_ENCODINGS):
+            # decode only the lines the filters keep
+            index = self._tut.blob_index(self._gitref, self._path)
+            # otherwise, decoding below reports the problem
+            if index.plain and index.decodes(self.encoding):
+                return index.lines(
+                    self.encoding, self.options.get('tab-width'),
+                )
+
         try:
-            text = self._tut.file(self._gitref, self.filename[len(self._tut.path) + 1:]).decode(self.encoding)
+            text = self._tut.file(self._gitref, self._path).decode(self.encoding)
 
             if 'tab-width' in self.options:
                 text = text.expandtabs(self.options['tab-width'])
@@ -41,6 +60,19 @@ class LiteralIncludeReader(SphinxLiteralIncludeReader):
                                  'be wrong, try giving an :encoding: option') %
                                (self.encoding, filename))
 
+    def prepend_filter(self, lines, location=None):
+        if self.options.get('prepend'):
+            lines = list(lines)
+
+        return super().prepend_filter(lines, location=location)
+
+    def append_filter(self, lines, location=None):
+        if self.options.get('append'):
+            lines = list(lines)
+
+        return super().append_filter(lines, location=location)
+
+
 class TutLiteralInclude(LiteralInclude):
 
     def run(self):
@@ -65,15 +97,22 @@ class TutLiteralInclude(LiteralInclude):
         try:
             location = self.state_machine.get_source_and_line(self.lineno)
             rel_filename, filename = env.relfn2path(self.arguments[0])
-            env.note_dependency(rel_filename)
+            path = rel_filename[len(rel_path) + 1:]
 
             reader = LiteralIncludeReader(
                 filename, self.options, env.config,
                 tut=manager.tut(tut_path),
                 gitref=self.state.document.git_ref,
+                path=path,
             )
             text, lines = reader.read(location=location)
 
+            # the file comes from git, not the work tree; depend on the blob
+            manager.note_dependency(
+                env.docname, tut_path,
+                '{0}:{1}'.format(self.state.document.git_ref, path),
+            )
+
             retnode = nodes.literal_block(text, text, source=filename)
             set_source_info(self, retnode)
             if self.options.get('diff'):  # if diff is set, set udiff
@@ -116,10 +155,12 @@ class TutCodeDiff(Directive):
         'path': directives.path,
         'prev_ref': directives.unchanged,
         'ref': directives.unchanged,
+        'algorithm': directives.unchanged,
     }
 
     def run(self):
-        manager = TutManager.get(self.state.document.settings.env)
+        env = self.state.document.settings.env
+        manager = TutManager.get(env)
 
         tut_path = manager.resolve_option(self, 'path')
         tut_href = manager.resolve_option(self, 'href', None)
@@ -138,13 +179,57 @@ class TutCodeDiff(Directive):
         # use the previous point if prev_ref is not specified
         prev_ref = self.options.get('prev_ref')
         if not prev_ref:
-            points = manager.tut(tut_path).points()
-            prev_ref = points[points.index(ref) - 1]
+            try:
+                prev_ref = manager.tut(tut_path).point_index().previous(ref)
+            except KeyError:
+                prev_ref = None
+            if prev_ref is None:
+                raise ValueError(
+                    "checkpoint '%s' has no previous checkpoint." % (ref,)
+                )
+            manager.note_dependency(env.docname, tut_path, 'tut:tut.cfg')
+
+        for dependency in (ref, prev_ref):
+            manager.note_dependency(
+                env.docname, tut_path,
+                '{0}:{1}'.format(dependency, rel_obj_name),
+            )
 
-        new = manager.tut(tut_path).file(ref, rel_obj_name).decode('utf8')
-        old = manager.tut(tut_path).file(prev_ref, rel_obj_name).decode('utf8')
+        tut = manager.tut(tut_path)
+        algorithm = self.options.get('algorithm', manager.diff_algorithm)
+
+        # blobs are immutable, so a diff of the same pair never changes
+        old_sha = tut.resolve('{0}:{1}'.format(prev_ref, rel_obj_name))
+        new_sha = tut.resolve('{0}:{1}'.format(ref, rel_obj_name))
+        key = (old_sha, new_sha, rel_obj_name, algorithm, diff.DIFF_VERSION)
+        cache = manager.diff_cache if None not in key else None
+        cached = cache.get(key) if cache is not None else None
+
+        if cached is not None:
+            code = cached.decode('utf8')
+        else:
+            new = tut.file(ref, rel_obj_name).decode('utf8')
+
+            if algorithm in NATIVE_ALGORITHMS:
+                # let git match the lines; only the new file is read
+                if old_sha is None:
+                    # report the missing file the usual way
+                    tut.file(prev_ref, rel_obj_name)
+                code = diff.diff_contents(
+                    None, new,
+                    name=rel_obj_name,
+                    opcodes=tut.diff_opcodes(old_sha, new_sha),
+                )
+            else:
+                old = tut.file(prev_ref, rel_obj_name).decode('utf8')
+                code = diff.diff_contents(
+                    old, new,
+                    name=rel_obj_name,
+                    algorithm=algorithm,
+                )
+            if cache is not None:
+                cache.put(key, code.encode('utf8'))
 
-        code = diff.diff_contents(old, new, name=rel_obj_name)
         literal = nodes.literal_block(code, code)
         literal['language'] = 'python'
 
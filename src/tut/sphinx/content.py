@@ -1,15 +1,65 @@
 from __future__ import absolute_import
+from concurrent.futures import ThreadPoolExecutor
 import os
-import subprocess
 
 from docutils import nodes
 from docutils.parsers.rst import Directive, directives
 import sphinx.pycode
 from sphinx.directives.code import dedent_lines
 
+from tut.model import TutException
+from tut.shell import (
+    ExecSession,
+    ShellError,
+)
 from .manager import TutManager
 
 
+def run_ahead(manager, commands):
+    """Run the tut:exec commands for every checkpoint at once.
+
+    commands maps (path, ref) to the commands documents will run at that
+    checkpoint, in reading order. Each checkpoint whose output isn't
+    cached gets a shell of its own in the worktree TutExec would use,
+    and up to tut_exec_workers of them run at a time. TutExec then takes
+    the output from the results. In checkout mode the checkpoints share
+    the work tree, so nothing is run ahead.
+
+    """
+
+    if manager.checkpoint_mode == 'checkout':
+        return
+
+    jobs = {}
+    for (path, ref), lines in commands.items():
+        tree = manager.tut(path).resolve(ref + '^{tree}')
+        probe = ExecSession(
+            None, tree=tree, cache=manager.exec_cache, env=manager.exec_env,
+        )
+        if tree is not None and not probe.is_cached(lines):
+            jobs[(path, ref)] = (tree, lines)
+
+    sessions = {
+        (path, ref): ExecSession(
+            manager.shell(manager.exec_dir(path, ref)), tree=tree,
+            cache=manager.exec_cache, env=manager.exec_env,
+        )
+        for (path, ref), (tree, lines) in jobs.items()
+    }
+    try:
+        with ThreadPoolExecutor(max_workers=manager.exec_workers) as pool:
+            futures = {
+                key: pool.submit(session.run_all, jobs[key][1])
+                for key, session in sessions.items()
+            }
+    finally:
+        for session in sessions.values():
+            session.close()
+
+    for key, future in futures.items():
+        manager.exec_results[key] = future.result()
+
+
 class TutExec(Directive):
 
     has_content = True
@@ -24,9 +74,14 @@ class TutExec(Directive):
     # TK: include_commands, include_output, final_prompt, prelude
 
     def run(self):
-        manager = TutManager.get(self.state.document.settings.env)
-        root = self.options.get('path', manager.default_path)
-        rel_path, root = self.state.document.settings.env.relfn2path(root)
+        env = self.state.document.settings.env
+        manager = TutManager.get(env)
+        rel_path, root = env.relfn2path(manager.resolve_option(self, 'path'))
+        git_ref = getattr(self.state.document, 'git_ref', None)
+
+        if git_ref is not None:
+            manager.note_dependency(env.docname, root, git_ref)
+        session = manager.exec_session(root, git_ref)
 
         show_commands = 'hide-commands' not in self.options
         show_output = 'hide-output' not in self.options
@@ -35,18 +90,16 @@ class TutExec(Directive):
         lines = self.content
 
         for line in lines:
-            cmd = subprocess.run(
-                line.strip().split('$ ', 1)[-1],
-                cwd=root, shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                encoding='utf8',
-                universal_newlines=True,
-            )
+            try:
+                cmd_output = session.run(line.strip().split('$ ', 1)[-1])
+            except ShellError as error:
+                return [self.state.document.reporter.warning(
+                    str(error), line=self.lineno,
+                )]
             if show_commands:
                 output.append(line)
             # TK: check stderr
-            cmd_output = cmd.stdout.strip()
+            cmd_output = cmd_output.strip()
             if show_output and cmd_output:
                 output.append(cmd_output)
 
@@ -66,13 +119,46 @@ class TutContent(Directive):
     }
 
     def run(self):
-        manager = TutManager.get(self.state.document.settings.env)
-        root = self.options.get('path', manager.default_path)
-        path = os.path.join(root, self.arguments[0])
-        rel_path, path = self.state.document.settings.env.relfn2path(path)
+        document = self.state.document
+        env = document.settings.env
+        manager = TutManager.get(env)
+        root = manager.resolve_option(self, 'path')
+        rel_path, tut_path = env.relfn2path(root)
+        rel_filename, filename = env.relfn2path(
+            os.path.join(root, self.arguments[0]),
+        )
 
         content = '\n'.join(self.content)
-        open(path, 'w').write(content)
+
+        if manager.content_mode == 'commit':
+            git_ref = getattr(document, 'git_ref', None)
+            if git_ref is None:
+                return [document.reporter.warning(
+                    'tut:content needs a checkpoint to commit to.',
+                    line=self.lineno,
+                )]
+            try:
+                manager.tut(tut_path).write_file(
+                    git_ref, rel_filename[len(rel_path) + 1:], content,
+                    'Update {0} from {1}.'.format(
+                        self.arguments[0], env.docname,
+                    ),
+                )
+            except TutException as error:
+                return [document.reporter.warning(
+                    str(error), line=self.lineno,
+                )]
+        else:
+            data = content.encode('utf8')
+            try:
+                with open(filename, 'rb') as existing:
+                    unchanged = existing.read() == data
+            except IOError:
+                unchanged = False
+            # leave unchanged files alone, so their mtimes don't move
+            if not unchanged:
+                with open(filename, 'wb') as outfile:
+                    outfile.write(data)
 
         # TK: Highlighting as in code blocks
         return [
@@ -1,4 +1,47 @@
-from tut.model import Tut
+import os
+
+from tut.algorithms import (
+    ALGORITHMS,
+    NATIVE_ALGORITHMS,
+)
+from tut.cache import DiskCache
+from tut.model import (
+    DEFAULT_CACHE_SIZE,
+    Tut,
+)
+from tut.shell import (
+    ExecSession,
+    ShellSession,
+)
+
+
+# how checkpoint directives make a ref available to later directives
+CHECKPOINT_MODES = (
+    # check the ref out in the repository's work tree
+    'checkout',
+    # record the ref on the document; tut directives read from git objects
+    'objects',
+    # check the ref out in a cached worktree and resolve paths there
+    'worktree',
+)
+
+# where tut:content puts the files it writes
+CONTENT_MODES = (
+    # write them into the repository's work tree
+    'write',
+    # commit them to the checkpoint's branch, leaving the work tree alone
+    'commit',
+)
+
+
+# upper bound on the size of the tut:diff cache in the doctree directory
+DEFAULT_DIFF_CACHE_SIZE = 64 * 1024 * 1024
+
+# upper bound on the size of the tut:exec output cache
+DEFAULT_EXEC_CACHE_SIZE = 64 * 1024 * 1024
+
+# output kept from a single tut:exec command
+DEFAULT_EXEC_MAX_OUTPUT = 1024 * 1024
 
 
 class UNSET(object):
@@ -16,15 +59,95 @@ class TutManager(object):
         return env._tut_mgr
 
     def __init__(self):
+        # per-document state; this is kept with the environment between
+        # builds, and merged back from parallel readers
+        self.doc_options = {}
+        self.checkpoints = {}
+        self.dependencies = {}
+
         self.reset()
 
     def reset(self):
         self.tuts = {}
         self._options = {}
 
+        # the ref last checked out in each repository this build
+        self.checked_out = {}
+
+        # tut:exec shells, and the results of running their commands
+        # ahead of time, by repository and ref
+        self.exec_sessions = {}
+        self.exec_results = {}
+
         self.DEFAULT_PATH = None
         self.RESET_PATHS = {}
 
+        self.backend = 'git'
+        self.cache_size = DEFAULT_CACHE_SIZE
+        self.checkpoint_mode = 'checkout'
+        self.content_mode = 'write'
+        self.worktree_dir = None
+        self.diff_algorithm = 'difflib'
+        self.diff_cache = None
+        self.exec_env = {}
+        self.exec_cache = None
+        self.exec_timeout = None
+        self.exec_max_output = DEFAULT_EXEC_MAX_OUTPUT
+        self.exec_workers = None
+
+    def configure(self, app):
+        """Apply the tut_* settings from the Sphinx configuration."""
+
+        config = app.config
+
+        self.backend = config.tut_backend
+        self.cache_size = config.tut_cache_size
+
+        if config.tut_checkpoint_mode not in CHECKPOINT_MODES:
+            raise ValueError(
+                "Unknown tut_checkpoint_mode {0!r}.".format(
+                    config.tut_checkpoint_mode,
+                )
+            )
+        self.checkpoint_mode = config.tut_checkpoint_mode
+
+        if config.tut_content_mode not in CONTENT_MODES:
+            raise ValueError(
+                "Unknown tut_content_mode {0!r}.".format(
+                    config.tut_content_mode,
+                )
+            )
+        self.content_mode = config.tut_content_mode
+
+        self.worktree_dir = config.tut_worktree_dir or os.path.join(
+            app.doctreedir, 'tut_worktrees',
+        )
+
+        if config.tut_diff_algorithm not in (
+                tuple(ALGORITHMS) + NATIVE_ALGORITHMS):
+            raise ValueError(
+                "Unknown tut_diff_algorithm {0!r}.".format(
+                    config.tut_diff_algorithm,
+                )
+            )
+        self.diff_algorithm = config.tut_diff_algorithm
+
+        if config.tut_diff_cache_size:
+            self.diff_cache = DiskCache(
+                os.path.join(app.doctreedir, 'tut_diffs'),
+                config.tut_diff_cache_size,
+            )
+
+        self.exec_env = dict(config.tut_exec_env or {})
+        self.exec_timeout = config.tut_exec_timeout
+        self.exec_max_output = config.tut_exec_max_output
+        self.exec_workers = config.tut_exec_workers
+        if config.tut_exec_cache_size:
+            self.exec_cache = DiskCache(
+                os.path.join(app.doctreedir, 'tut_exec'),
+                config.tut_exec_cache_size,
+            )
+
     @property
     def reset_paths(self):
         return {
@@ -35,23 +158,145 @@ class TutManager(object):
     def tut(self, path):
         """Return a Tut for the given path."""
         if path not in self.tuts:
-            self.tuts[path] = Tut(path)
+            self.tuts[path] = Tut(
+                path,
+                backend=self.backend,
+                cache_size=self.cache_size,
+            )
 
         return self.tuts[path]
 
+    def exec_session(self, path, ref):
+        """Return the ExecSession for ref in the repository at path.
+
+        Commands run in the work tree in checkout mode and in ref's
+        worktree otherwise; their output is cached by ref's tree. With
+        no ref, they run in path and nothing is cached.
+
+        """
+
+        if (path, ref) not in self.exec_sessions:
+            tree = None
+            if ref is not None:
+                tree = self.tut(path).resolve(ref + '^{tree}')
+
+            self.exec_sessions[(path, ref)] = ExecSession(
+                self.shell(self.exec_dir(path, ref)),
+                tree=tree,
+                cache=self.exec_cache,
+                env=self.exec_env,
+                results=self.exec_results.get((path, ref)),
+            )
+
+        return self.exec_sessions[(path, ref)]
+
+    def exec_dir(self, path, ref):
+        """Return the directory ref's commands run in."""
+
+        if ref is None or self.checkpoint_mode == 'checkout':
+            return path
+
+        return self.tut(path).worktree(ref, self.worktree_dir)
+
+    def shell(self, cwd):
+        """Return a ShellSession in cwd with the tut_exec_* settings."""
+
+        return ShellSession(
+            cwd,
+            env=self.exec_env,
+            timeout=self.exec_timeout,
+            max_output=self.exec_max_output,
+        )
+
     def reset_tuts(self):
         for tut in self.tuts.values():
             tut.reset()
+            tut.close()
 
-    def update_defaults(self, options):
+        for session in self.exec_sessions.values():
+            session.close()
+
+        self.checked_out = {}
+        self.exec_sessions = {}
+        self.exec_results = {}
+
+    def update_defaults(self, options, docname=None):
 
         self._options = options.copy()
+        if docname is not None:
+            self.doc_options[docname] = options.copy()
+
+    def note_checkpoint(self, docname, path, ref):
+        """Record that docname uses ref from the repository at path."""
+
+        self.checkpoints.setdefault(docname, []).append((path, ref))
+
+    def note_dependency(self, docname, path, name):
+        """Record that docname depends on the object name in path.
+
+        name is any object name Tut can resolve, such as a ref or
+        ``ref:path/to/file``; the sha it currently resolves to is kept
+        so that outdated() can tell when it changes.
+
+        """
+
+        self.dependencies.setdefault(docname, {})[(path, name)] = (
+            self._resolve(path, name)
+        )
+
+    def _resolve(self, path, name):
+        try:
+            return self.tut(path).resolve(name)
+        except IOError:
+            # the repository can't be read; record the object as missing
+            # and leave reporting the error to the directive that needs it
+            return None
+
+    def outdated(self):
+        """Return the documents whose recorded dependencies have moved."""
+
+        current = {}
+        result = set()
+
+        for docname, dependencies in self.dependencies.items():
+            for (path, name), sha in dependencies.items():
+                if (path, name) not in current:
+                    current[(path, name)] = self._resolve(path, name)
+                if current[(path, name)] != sha:
+                    result.add(docname)
+                    break
+
+        return result
+
+    def purge_doc(self, docname):
+        """Forget the state recorded while reading docname."""
+
+        self.doc_options.pop(docname, None)
+        self.checkpoints.pop(docname, None)
+        self.dependencies.pop(docname, None)
+
+    def merge(self, docnames, other):
+        """Merge the state recorded for docnames by another manager."""
+
+        for docname in docnames:
+            if docname in other.doc_options:
+                self.doc_options[docname] = other.doc_options[docname]
+            if docname in other.checkpoints:
+                self.checkpoints[docname] = other.checkpoints[docname]
+            if docname in other.dependencies:
+                self.dependencies[docname] = other.dependencies[docname]
 
     def resolve_option(self, node, key, default=UNSET):
 
         if key in node.options:
             return node.options[key]
 
+        # defaults set in this document win over ones carried over
+        # from documents read earlier in the same process
+        docname = getattr(node.state.document.settings.env, 'docname', None)
+        if key in self.doc_options.get(docname, {}):
+            return self.doc_options[docname][key]
+
         if key in self._options:
             return self._options[key]
 
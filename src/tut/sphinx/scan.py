@@ -0,0 +1,369 @@
+import io
+import os
+import re
+import textwrap
+
+from sphinx.util import logging
+
+from tut.model import TutException
+from .content import run_ahead
+from .manager import TutManager
+
+
+logger = logging.getLogger(__name__)
+
+directive_re = re.compile(
+    r'^\s*\.\.\s+(?P<name>[\w:-]+)::(?P<argument>.*)$'
+)
+option_re = re.compile(r'^\s+:(?P<name>[\w-]+):(?P<value>.*)$')
+
+CHECKPOINT_DIRECTIVES = ('checkpoint', 'tut:checkpoint')
+
+# stock directives that may read files from a checked out repository;
+# so may any autodoc directive (auto*)
+WORK_TREE_DIRECTIVES = (
+    'include', 'literalinclude', 'image', 'figure', 'csv-table', 'raw',
+)
+
+
+def scan_directives(source):
+    """Yield (name, argument, options, content) for each directive.
+
+    This is a line-based approximation of the reST parser: options are
+    the field lines directly following the directive, content is the
+    indented block after them (as a list of lines), and directives in
+    comments or literal blocks are found too.
+
+    """
+
+    lines = source.splitlines()
+    for lineno, line in enumerate(lines):
+        match = directive_re.match(line)
+        if match is None:
+            continue
+
+        options = {}
+        body = lineno + 1
+        for option_line in lines[body:]:
+            option = option_re.match(option_line)
+            if option is None:
+                break
+            options[option.group('name')] = option.group('value').strip()
+            body += 1
+
+        indent = len(line) - len(line.lstrip())
+        content = []
+        for content_line in lines[body:]:
+            if (content_line.strip() and
+                    len(content_line) - len(content_line.lstrip()) <= indent):
+                break
+            content.append(content_line)
+        content = textwrap.dedent('\n'.join(content)).strip('\n')
+
+        yield (
+            match.group('name'), match.group('argument').strip(), options,
+            content.split('\n') if content else [],
+        )
+
+
+class DocumentScan(object):
+    """What reading a document will ask of tut.
+
+    names are the (tut path, object name) pairs its directives read,
+    checkouts the (tut path, ref) pairs its checkpoints check out, and
+    commands the (tut path, ref, command) its tut:exec directives run,
+    in order. The flags record how reading the document may depend on
+    the documents read before it.
+
+    """
+
+    def __init__(self):
+        self.names = []
+        self.checkouts = []
+        self.commands = []
+
+        # it has a tut directive, whose defaults later documents inherit
+        self.sets_defaults = False
+        # it relies on tut defaults set by an earlier document
+        self.inherits_defaults = False
+        # it may read the work tree before checking anything out
+        self.reads_work_tree = False
+        # it runs commands, in shells shared with other documents
+        self.runs_commands = False
+        # it writes files that documents read after it may use
+        self.writes_files = False
+
+
+def scan_document(manager, env, docname, source, defaults):
+    """Return (scan, defaults) for a document.
+
+    defaults are the tut directive options in effect when the document
+    starts; the ones in effect when it ends are returned.
+
+    """
+
+    scan = DocumentScan()
+    ref = None
+
+    for directive, argument, options, content in scan_directives(source):
+        if directive == 'tut':
+            defaults = options
+            scan.sets_defaults = True
+            continue
+
+        if ref is None and (directive in WORK_TREE_DIRECTIVES or
+                            directive.startswith('auto') or
+                            directive == 'tut:exec'):
+            scan.reads_work_tree = True
+        if directive == 'tut:content':
+            scan.writes_files = True
+            path = options.get('path', defaults.get('path'))
+            if (manager.content_mode == 'commit' and path is not None and
+                    ref is not None):
+                # comparing against the committed blob needs its sha
+                rel_path, tut_path = env.relfn2path(path, docname)
+                rel_filename, _ = env.relfn2path(
+                    os.path.join(path, argument), docname,
+                )
+                scan.names.append((tut_path, '{0}:{1}'.format(
+                    ref, rel_filename[len(rel_path) + 1:],
+                )))
+            continue
+        if directive not in CHECKPOINT_DIRECTIVES + (
+                'tut:literalinclude', 'tut:diff', 'tut:exec'):
+            continue
+
+        needed = ('path', 'href') if directive == 'tut:diff' else ('path',)
+        if not scan.sets_defaults and not all(
+                key in options for key in needed):
+            scan.inherits_defaults = True
+
+        if directive == 'tut:exec':
+            scan.runs_commands = True
+            path = options.get('path', defaults.get('path'))
+            if path is not None and ref is not None:
+                _, tut_path = env.relfn2path(path, docname)
+                scan.commands.extend(
+                    (tut_path, ref, line.strip().split('$ ', 1)[-1])
+                    for line in content
+                )
+            continue
+
+        path = options.get('path', defaults.get('path'))
+        if path is None:
+            continue
+        rel_path, tut_path = env.relfn2path(path, docname)
+
+        if directive in CHECKPOINT_DIRECTIVES:
+            ref = argument.lower()
+            scan.names.append((tut_path, ref))
+            scan.checkouts.append((tut_path, ref))
+            continue
+
+        rel_filename, _ = env.relfn2path(argument, docname)
+        filename = rel_filename[len(rel_path) + 1:]
+
+        if directive == 'tut:literalinclude':
+            refs = [ref]
+        else:
+            new_ref = options.get('ref', ref)
+            prev_ref = options.get('prev_ref')
+            if not prev_ref and new_ref:
+                # looking up the previous point depends on tut.cfg
+                scan.names.append((tut_path, 'tut:tut.cfg'))
+                try:
+                    prev_ref = manager.tut(tut_path).point_index().previous(
+                        new_ref,
+                    )
+                except KeyError:
+                    prev_ref = None
+            refs = [new_ref, prev_ref]
+
+        scan.names.extend(
+            (tut_path, '{0}:{1}'.format(name, filename))
+            for name in refs if name
+        )
+
+    return scan, defaults
+
+
+def count_checkouts(checkouts, state):
+    """Return how many of checkouts change the refs in state.
+
+    state maps tut paths to the ref last checked out, and is updated.
+
+    """
+
+    count = 0
+    for tut_path, ref in checkouts:
+        if state.get(tut_path) != ref:
+            state[tut_path] = ref
+            count += 1
+
+    return count
+
+
+def _cheapest_first(scans, docnames, state):
+    remaining = list(docnames)
+    order = []
+
+    while remaining:
+        # ties go to the document that came first
+        docname = min(
+            remaining,
+            key=lambda docname: count_checkouts(
+                scans[docname].checkouts, dict(state),
+            ),
+        )
+        remaining.remove(docname)
+        order.append(docname)
+        count_checkouts(scans[docname].checkouts, state)
+
+    return order
+
+
+def schedule(scans, docnames):
+    """Return docnames in an order that needs fewer checkouts.
+
+    Each document is followed by the one that can be read with the
+    fewest checkouts. Documents whose output may depend on what was
+    read before them (including any that run commands), and ones that
+    write files, stay where they are, as do the documents before one
+    that reads the work tree, so the output doesn't change. Documents
+    missing from scans are treated as reading the work tree.
+
+    """
+
+    inherited = any(scan.inherits_defaults for scan in scans.values())
+
+    order = []
+    state = {}
+    movable = []
+    for docname in docnames:
+        scan = scans.get(docname)
+        if scan is not None and not (
+                scan.inherits_defaults or scan.reads_work_tree or
+                scan.runs_commands or scan.writes_files or
+                (inherited and scan.sets_defaults)):
+            movable.append(docname)
+            continue
+
+        if scan is not None and not scan.reads_work_tree:
+            movable = _cheapest_first(scans, movable, state)
+        else:
+            for previous in movable:
+                count_checkouts(scans[previous].checkouts, state)
+        order.extend(movable)
+        movable = []
+
+        order.append(docname)
+        if scan is not None:
+            count_checkouts(scan.checkouts, state)
+
+    order.extend(_cheapest_first(scans, movable, state))
+
+    return order
+
+
+def _total_checkouts(scans, docnames):
+    state = {}
+    return sum(
+        count_checkouts(scans[docname].checkouts, state)
+        for docname in docnames if docname in scans
+    )
+
+
+def _scan_documents(manager, env, docnames):
+    defaults = manager._options
+    scans = {}
+
+    for docname in docnames:
+        try:
+            with io.open(env.doc2path(docname),
+                         encoding=env.config.source_encoding) as source:
+                scans[docname], defaults = scan_document(
+                    manager, env, docname, source.read(), defaults,
+                )
+        except (IOError, UnicodeError, TutException):
+            # leave reporting the problem to the directives
+            continue
+
+    return scans
+
+
+def read_ahead(app, env, docnames):
+    """Prepare to read docnames.
+
+    Each document is scanned for tut directives. A checkpoint's tut:exec
+    commands share one shell, so documents running commands in the same
+    shell as one being read are read again too. Documents are not read
+    in parallel if any of them run commands, write files or rely on
+    tut defaults set by another document.
+    When checkpoints are checked out, the documents are reordered to
+    need fewer checkouts. The refs and blobs the directives name are
+    then fetched with one batch per repository, so directives find them
+    cached instead of asking git one at a time, and the tut:exec
+    commands are run, each checkpoint's in parallel with the others.
+
+    """
+
+    manager = TutManager.get(env)
+    scans = _scan_documents(manager, env, docnames)
+
+    shells = set(
+        (tut_path, ref)
+        for scan in scans.values()
+        for tut_path, ref, _ in scan.commands
+    )
+    if shells:
+        # each document's commands run after those of the documents
+        # before it; reading it alone would start with a fresh shell
+        everything = _scan_documents(
+            manager, env, sorted(set(docnames) | set(env.found_docs)),
+        )
+        for docname, scan in everything.items():
+            if docname not in scans and any(
+                    (tut_path, ref) in shells
+                    for tut_path, ref, _ in scan.commands):
+                scans[docname] = scan
+                docnames.append(docname)
+        docnames.sort()
+
+    if any(scan.runs_commands or scan.writes_files or scan.inherits_defaults
+           for scan in scans.values()):
+        # parallel readers would each start their own shells, wouldn't
+        # see (or would race) the files others write, and wouldn't have
+        # the tut defaults set by documents read in other processes
+        app.extensions['tut.sphinx'].parallel_read_safe = False
+
+    if manager.checkpoint_mode == 'checkout':
+        order = schedule(scans, docnames)
+        before = _total_checkouts(scans, docnames)
+        after = _total_checkouts(scans, order)
+        if after < before:
+            docnames[:] = order
+            logger.info(
+                'tut: reading documents with %d checkouts instead of %d',
+                after, before,
+            )
+
+    wanted = {}
+    for scan in scans.values():
+        for tut_path, name in scan.names:
+            wanted.setdefault(tut_path, []).append(name)
+
+    for tut_path, names in wanted.items():
+        try:
+            manager.tut(tut_path).prefetch(names)
+        except IOError:
+            continue
+
+    commands = {}
+    for docname in docnames:
+        if docname in scans:
+            for tut_path, ref, command in scans[docname].commands:
+                commands.setdefault((tut_path, ref), []).append(command)
+
+    # files written while reading would change what the commands see
+    if commands and not any(scan.writes_files for scan in scans.values()):
+        run_ahead(manager, commands)
@@ -0,0 +1,151 @@
+import random
+import time
+import unittest
+from unittest.mock import patch
+
+from tut import algorithms
+
+
+def _lcs_length(a, b):
+
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(
+                previous[j] + 1 if x == y else max(previous[j + 1], current[j])
+            )
+        previous = current
+
+    return previous[-1]
+
+
+class AlgorithmTests(unittest.TestCase):
+
+    NAMES = ('myers', 'patience', 'histogram')
+
+    def assertValidBlocks(self, matcher, a, b):
+
+        last_i = last_j = 0
+        for i, j, size in matcher.get_matching_blocks():
+            self.assertGreaterEqual(i, last_i)
+            self.assertGreaterEqual(j, last_j)
+            self.assertEqual(a[i:i + size], b[j:j + size])
+            last_i, last_j = i + size, j + size
+        self.assertEqual((last_i, last_j), (len(a), len(b)))
+
+        # applying the opcodes to a must give b
+        result = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            result.extend(a[i1:i2] if tag == 'equal' else b[j1:j2])
+        self.assertEqual(result, b)
+
+    def test_random_sequences(self):
+
+        rng = random.Random(1)
+        for trial in range(300):
+            a = [rng.choice('abcde') for _ in range(rng.randint(0, 15))]
+            b = [rng.choice('abcde') for _ in range(rng.randint(0, 15))]
+            for name in self.NAMES:
+                self.assertValidBlocks(algorithms.matcher(name, a, b), a, b)
+
+    def test_myers_finds_longest_common_subsequence(self):
+
+        rng = random.Random(2)
+        for trial in range(300):
+            a = [rng.choice('abc') for _ in range(rng.randint(0, 12))]
+            b = [rng.choice('abc') for _ in range(rng.randint(0, 12))]
+            blocks = algorithms.matcher('myers', a, b).get_matching_blocks()
+            self.assertEqual(
+                sum(block.size for block in blocks),
+                _lcs_length(a, b),
+            )
+
+    def test_cost_limit_keeps_blocks_valid(self):
+
+        rng = random.Random(3)
+        with patch.object(algorithms, 'MIN_MAX_COST', 1):
+            for trial in range(300):
+                a = [rng.choice('abcde') for _ in range(rng.randint(0, 30))]
+                b = [rng.choice('abcde') for _ in range(rng.randint(0, 30))]
+                for name in self.NAMES:
+                    self.assertValidBlocks(
+                        algorithms.matcher(name, a, b), a, b,
+                    )
+
+    def test_large_rewrites_are_not_quadratic(self):
+
+        # a shared line every 50 keeps the sides from being disjoint
+        old = ['old %d\n' % n if n % 50 else 'same\n' for n in range(5000)]
+        new = ['new %d\n' % n if n % 50 else 'same\n' for n in range(5000)]
+
+        for name in self.NAMES:
+            start = time.monotonic()
+            matcher = algorithms.matcher(name, old, new)
+            self.assertValidBlocks(matcher, old, new)
+            # a minimal diff takes over ten seconds
+            self.assertLess(time.monotonic() - start, 5, name)
+
+    def test_popular_lines_are_not_junk(self):
+
+        old = ['}\n'] * 300
+        new = ['}\n'] * 150 + ['x\n'] + ['}\n'] * 150
+
+        for name in self.NAMES:
+            opcodes = [
+                opcode
+                for opcode in algorithms.matcher(name, old, new).get_opcodes()
+                if opcode[0] != 'equal'
+            ]
+            self.assertEqual(opcodes, [('insert', 150, 150, 150, 151)])
+
+    def test_unknown_algorithm_raises_value_error(self):
+
+        with self.assertRaises(ValueError):
+            algorithms.matcher('nope', [], [])
+
+
+class ParseHunksTests(unittest.TestCase):
+
+    def test_parses_zero_context_hunks(self):
+
+        patch = (
+            b'diff --git a/x b/x\n'
+            b'--- a/x\n'
+            b'+++ b/x\n'
+            b'@@ -2,0 +3,2 @@ def foo():\n'
+            b'+    a = 1\n'
+            b'+    b = 2\n'
+            b'@@ -5 +7 @@\n'
+            b'-@@ not a header\n'
+            b'+changed\n'
+            b'@@ -9,2 +10,0 @@\n'
+            b'-gone\n'
+            b'-gone\n'
+        )
+
+        self.assertEqual(
+            algorithms.parse_hunks(patch),
+            [
+                ('insert', 2, 2, 2, 4),
+                ('replace', 4, 5, 6, 7),
+                ('delete', 8, 10, 10, 10),
+            ],
+        )
+
+    def test_matches_difflib_changes(self):
+
+        old = ['a\n', 'b\n', 'c\n', 'd\n', 'e\n']
+        new = ['a\n', 'x\n', 'c\n', 'e\n', 'f\n']
+
+        expected = [
+            opcode
+            for opcode in algorithms.matcher('myers', old, new).get_opcodes()
+            if opcode[0] != 'equal'
+        ]
+        patch = (
+            b'@@ -2 +2 @@\n-b\n+x\n'
+            b'@@ -4 +3,0 @@\n-d\n'
+            b'@@ -5,0 +5 @@\n+f\n'
+        )
+        self.assertEqual(algorithms.parse_hunks(patch), expected)
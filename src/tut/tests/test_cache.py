@@ -0,0 +1,114 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from tut.cache import (
+    DiskCache,
+    LRUCache,
+)
+
+
+class LRUCacheTests(unittest.TestCase):
+
+    def test_get_counts_hits_and_misses(self):
+
+        cache = LRUCache(10)
+        cache.put('a', b'12345')
+
+        self.assertEqual(cache.get('a'), b'12345')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_evicts_least_recently_used(self):
+
+        cache = LRUCache(10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        cache.get('a')
+        cache.put('c', b'12345')
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.size, 10)
+
+    def test_oversized_values_are_not_cached(self):
+
+        cache = LRUCache(10)
+        cache.put('a', b'12345')
+        cache.put('b', b'x' * 11)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_explicit_sizes(self):
+
+        cache = LRUCache(10)
+        cache.put('a', object(), size=6)
+        cache.put('b', object(), size=6)
+
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 6)
+
+
+class DiskCacheTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_values_persist_between_instances(self):
+
+        DiskCache(self.path, 100).put(('a', 1), b'12345')
+
+        cache = DiskCache(self.path, 100)
+        self.assertEqual(cache.get(('a', 1)), b'12345')
+        self.assertIsNone(cache.get(('a', 2)))
+
+    def test_evicts_least_recently_used(self):
+
+        cache = DiskCache(self.path, 20)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, b'123456')
+            # mtimes may share a timestamp; make the order explicit
+            os.utime(cache._filename(key), (0, ord(key)))
+        cache.get('a')
+
+        cache.put('d', b'123456')
+
+        self.assertEqual(cache.get('a'), b'123456')
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('d'), b'123456')
+        self.assertLessEqual(cache.size, 15)
+
+    def test_replacing_an_entry_keeps_the_size(self):
+
+        cache = DiskCache(self.path, 20)
+        cache.put('a', b'123456')
+        cache.put('b', b'123456')
+        for _ in range(3):
+            cache.put('b', b'1234')
+
+        self.assertEqual(cache.size, 10)
+        self.assertEqual(cache.get('a'), b'123456')
+
+    def test_oversized_values_are_not_stored(self):
+
+        cache = DiskCache(self.path, 4)
+        cache.put('a', b'12345')
+
+        self.assertIsNone(cache.get('a'))
+
+    def test_pickles_without_counts(self):
+
+        cache = DiskCache(self.path, 100)
+        cache.put('a', b'12345')
+
+        restored = pickle.loads(pickle.dumps(cache))
+        self.assertIsNone(restored.size)
+        self.assertEqual(restored.get('a'), b'12345')
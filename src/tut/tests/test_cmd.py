@@ -0,0 +1,80 @@
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+import tut
+from tut.model import Tut
+
+
+# modules that are slow to import, and that startup should leave alone
+SLOW_MODULES = ('pkg_resources', 'sh', 'yaml')
+
+RUN_TUT = '''
+import json, sys
+sys.argv = ['tut'] + sys.argv[1:]
+import tut.cmd
+try:
+    tut.cmd.main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps(sorted(sys.modules)))
+'''
+
+
+def _run_tut(*args, **kwargs):
+    """Run the tut command in a new interpreter.
+
+    Returns (stdout, the names of the modules it imported, seconds).
+
+    """
+
+    start = time.monotonic()
+    process = subprocess.run(
+        [sys.executable, '-c', RUN_TUT] + list(args),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True, **kwargs
+    )
+    elapsed = time.monotonic() - start
+
+    return process.stdout, set(json.loads(process.stderr)), elapsed
+
+
+class StartupTests(TestCase):
+
+    def test_version_imports_nothing_slow(self):
+
+        output, modules, _ = _run_tut('--version')
+
+        self.assertEqual(output.strip(), 'Tut %s' % tut.version())
+        self.assertFalse(modules.intersection(SLOW_MODULES))
+        self.assertNotIn('tut.model', modules)
+
+    def test_points_does_not_import_sh(self):
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        Tut(path).init()
+        Tut(path).start('step_one')
+
+        output, modules, _ = _run_tut('points', cwd=path)
+
+        self.assertEqual(output.split(), ['step_one'])
+        self.assertNotIn('sh', modules)
+        self.assertNotIn('pkg_resources', modules)
+
+    def test_startup_time(self):
+
+        start = time.monotonic()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        baseline = time.monotonic() - start
+
+        # take the best of a few runs, to ride out a busy machine
+        elapsed = min(_run_tut('--help')[2] for _ in range(3))
+
+        # generous; importing sh, yaml and pkg_resources up front cost
+        # a few tenths of a second on top of the bare interpreter
+        self.assertLess(elapsed - baseline, 0.5)
@@ -1,5 +1,6 @@
 import textwrap
 import unittest
+from unittest.mock import patch
 
 from tut import diff
 
@@ -262,3 +263,213 @@ from uuid import (
 )
 import sys
 """
+
+
+class FindTagsTests(unittest.TestCase):
+
+    def test_definitions_and_constants(self):
+
+        source = textwrap.dedent(
+            """\
+            import os
+
+            DEBUG = True
+
+            @decorate
+            class Adder(object):
+
+                def add(self, n):
+                    return n
+
+                @property
+                def total(self): return 0
+
+
+            def helper():
+                pass
+            """
+        )
+
+        self.assertEqual(
+            diff.find_tags(source),
+            {
+                'import': ('import', 1, 2),
+                'DEBUG': ('DEBUG', 3, 4),
+                'Adder': ('class', 5, 13),
+                'Adder.add': ('def', 8, 10),
+                'Adder.total': ('def', 11, 13),
+                'helper': ('def', 15, 17),
+            },
+        )
+
+    def test_top_level_clauses(self):
+
+        source = textwrap.dedent(
+            """\
+            if DEBUG:
+                def log():
+                    pass
+
+            elif VERBOSE:
+                x = 1
+            else:
+                def log(): pass
+            """
+        )
+
+        self.assertEqual(
+            diff.find_tags(source),
+            {
+                'if': ('if', 1, 4),
+                'if.log': ('def', 2, 4),
+                'elif': ('elif', 5, 7),
+                'else': ('else', 7, 9),
+                'else.log': ('def', 8, 9),
+            },
+        )
+
+    def test_python_2_source_is_scanned(self):
+
+        source = textwrap.dedent(
+            """\
+            class Adder(object):
+
+                def add(self, n):
+                    print "adding", n
+                    return n
+
+                @property
+                def total(self): return 0
+
+
+            def helper():
+                pass
+            """
+        )
+
+        self.assertEqual(
+            diff.find_tags(source),
+            {
+                'Adder': ('class', 1, 9),
+                'Adder.add': ('def', 3, 6),
+                'Adder.total': ('def', 7, 9),
+                'helper': ('def', 11, 13),
+            },
+        )
+
+    def test_unfinished_source_tags_end_at_the_last_line(self):
+
+        self.assertEqual(
+            diff.find_tags('class A:\n    def f(self):\n        x = (1,\n'),
+            {'A': ('class', 1, 4), 'A.f': ('def', 2, 4)},
+        )
+
+    def test_diff_of_python_2_source_has_context(self):
+
+        previous = textwrap.dedent(
+            """\
+            class Adder(object):
+
+                def add(self, n):
+                    return n
+            """
+        )
+        now = textwrap.dedent(
+            """\
+            class Adder(object):
+
+                def add(self, n):
+                    print "adding", n
+                    return n
+            """
+        )
+
+        self.assertEqual(
+            diff.diff_contents(previous, now),
+            'class Adder(object):\n'
+            '    def add(self, n):\n'
+            '        print "adding", n\n'
+            '        return n\n',
+        )
+
+
+class ObjectLocatorTests(unittest.TestCase):
+
+    def test_find_returns_enclosing_objects(self):
+
+        locator = diff.ObjectLocator(TEST_CLASS_2.splitlines(keepends=True))
+        lines = TEST_CLASS_2.splitlines()
+        lineno = lines.index('        return sum(self._args)')
+
+        found = [
+            lines[start].strip() for start, _ in locator.find(lineno)
+        ]
+        self.assertEqual(
+            found,
+            ['class Adder(object):', 'def result(self):'],
+        )
+        self.assertEqual(list(locator.find(-1)), [])
+
+    def test_module_is_parsed_once_per_diff(self):
+
+        previous = ''.join(
+            'def f%d():\n    return %d\n\n' % (n, n) for n in range(20)
+        )
+        now = ''.join(
+            'def f%d():\n    return %d\n\n' % (n, n + 1) for n in range(20)
+        )
+
+        with patch.object(
+                diff, 'find_tags', wraps=diff.find_tags) as find_tags:
+            result = diff.diff_contents(previous, now)
+
+        self.assertEqual(find_tags.call_count, 1)
+        self.assertIn('def f19():\n    return 20\n', result)
+
+
+class DiffAlgorithmTests(unittest.TestCase):
+
+    previous = textwrap.dedent(
+        """
+        import sys
+
+        def foo():
+            a = 42
+            return a
+
+        def bar():
+            pass
+        """,
+    )
+    now = textwrap.dedent(
+        """
+        import sys
+
+        def foo():
+            return 42
+
+        def bar():
+            return None
+        """,
+    )
+
+    def test_algorithms_agree_on_simple_changes(self):
+
+        expected = diff.diff_contents(self.previous, self.now)
+        for algorithm in ('myers', 'patience', 'histogram'):
+            self.assertEqual(
+                diff.diff_contents(
+                    self.previous, self.now, algorithm=algorithm,
+                ),
+                expected,
+            )
+
+    def test_myers_avoids_junk_replace(self):
+
+        previous = '}\n' * 300
+        now = '}\n' * 150 + 'x = 1\n' + '}\n' * 150
+
+        self.assertEqual(
+            diff.diff_contents(previous, now, algorithm='myers'),
+            'x = 1\n',
+        )
@@ -0,0 +1,85 @@
+import unittest
+
+from tut.lines import (
+    BlobIndex,
+    BlobLines,
+)
+
+
+def _index(data, chunk_size=3):
+
+    index = BlobIndex()
+    for start in range(0, len(data), chunk_size):
+        index.write(data[start:start + chunk_size])
+
+    return index.finish()
+
+
+class BlobIndexTests(unittest.TestCase):
+
+    def test_lines_match_splitlines(self):
+
+        for text in ('', 'a', 'a\n', 'a\nbb\n\nccc', 'x\r\ny\r\n'):
+            index = _index(text.encode('utf8'))
+
+            self.assertTrue(index.plain)
+            self.assertEqual(list(index.lines()), text.splitlines(True))
+            self.assertEqual(len(index), len(text.splitlines(True)))
+
+    def test_other_boundaries_are_not_plain(self):
+
+        for text in ('a\rb', 'a\x0cb\n', 'a b', 'a\r'):
+            self.assertFalse(_index(text.encode('utf8')).plain, text)
+
+    def test_byte_order_mark_only_stripped_from_first_line(self):
+
+        index = _index('a\nb\n'.encode('utf-8-sig'))
+
+        self.assertEqual(index.lines('utf-8-sig')[0], 'a\n')
+        self.assertEqual(list(index.lines('utf-8-sig')), ['a\n', 'b\n'])
+
+    def test_decodes_checks_the_whole_blob(self):
+
+        index = _index('a\n\u00e9\n'.encode('utf8'))
+        self.assertFalse(index.decodes('ascii'))
+        self.assertTrue(index.decodes('utf-8'))
+        self.assertTrue(index.decodes('utf_8_sig'))
+
+        # a character split across chunks is still valid
+        self.assertTrue(_index('\u20ac'.encode('utf8'), 1).decodes('utf8'))
+
+        self.assertTrue(_index(b'plain\n').decodes('ascii'))
+        self.assertFalse(_index(b'a\n\xe9\n').decodes('utf-8'))
+        self.assertFalse(_index(b'a\n\xe2\x82').decodes('utf-8'))
+
+
+class BlobLinesTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.text = ''.join('\tline %d\n' % n for n in range(10))
+        self.lines = _index(self.text.encode('utf8')).lines()
+
+    def test_slices_are_views(self):
+
+        view = self.lines[2:8][1:3]
+
+        self.assertIsInstance(view, BlobLines)
+        self.assertEqual(view, self.text.splitlines(True)[3:5])
+        self.assertEqual(self.lines[5:2], [])
+
+    def test_indexing(self):
+
+        expected = self.text.splitlines(True)
+
+        self.assertEqual(self.lines[0], expected[0])
+        self.assertEqual(self.lines[-1], expected[-1])
+        self.assertEqual(self.lines[::3], expected[::3])
+        with self.assertRaises(IndexError):
+            self.lines[10]
+
+    def test_tab_width(self):
+
+        lines = _index(self.text.encode('utf8')).lines(tab_width=4)
+
+        self.assertEqual(lines[0], '    line 0\n')
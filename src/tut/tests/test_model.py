@@ -5,7 +5,9 @@ import unittest
 from unittest.mock import patch
 
 from sh import git
+import yaml
 
+from tut.cache import LRUCache
 import tut.model
 
 
@@ -77,6 +79,30 @@ class TutPointsTests(TutTestCase):
 
         self.assertEqual(t.points(), ['step1', 'step2'])
 
+    def test_points_are_parsed_once_per_config_revision(self):
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+
+        with patch.object(yaml, 'load', wraps=yaml.load) as load_mock:
+            t.points()
+            t.points()
+            self.assertEqual(load_mock.call_count, 1)
+
+            t.start('step2')
+            self.assertEqual(t.points(), ['step1', 'step2'])
+            self.assertEqual(load_mock.call_count, 2)
+
+    def test_points_cannot_modify_cached_config(self):
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+
+        t.points().append('bogus')
+        t._config()['points'].append('bogus')
+
+        self.assertEqual(t.points(), ['step1'])
+
     def test_current(self):
         t = tut.model.Tut(self._testpath)
         t.init()
@@ -97,6 +123,103 @@ class TutPointsTests(TutTestCase):
         self.assertEqual(t.current(), None)
 
 
+class PointIndexTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.index = tut.model.PointIndex(['step1', 'step2', 'step3'])
+
+    def test_neighbors(self):
+
+        self.assertEqual(self.index.previous('step1'), None)
+        self.assertEqual(self.index.previous('step2'), 'step1')
+        self.assertEqual(self.index.next('step2'), 'step3')
+        self.assertEqual(self.index.next('step3'), None)
+        self.assertEqual(list(self.index.after('step1')), ['step2', 'step3'])
+
+    def test_unknown_point_raises_key_error(self):
+
+        with self.assertRaises(KeyError):
+            self.index.previous('missing')
+        with self.assertRaises(KeyError):
+            self.index.position('missing')
+
+    def _assert_positions_ordered(self):
+
+        positions = [self.index.position(point) for point in self.index]
+        self.assertEqual(positions, sorted(set(positions)))
+
+    def test_insert_after_updates_order_and_positions(self):
+
+        self._assert_positions_ordered()
+
+        self.index.insert_after('step1', 'step1a')
+        self.index.insert_after(None, 'step0')
+        self.index.insert_after('step3', 'step4')
+
+        self.assertEqual(
+            list(self.index),
+            ['step0', 'step1', 'step1a', 'step2', 'step3', 'step4'],
+        )
+        self._assert_positions_ordered()
+        self.assertEqual(self.index.previous('step2'), 'step1a')
+        self.assertEqual(len(self.index), 6)
+
+    def test_insert_keeps_other_positions(self):
+
+        before = self.index.position('step2')
+        self.index.insert_after('step1', 'step1a')
+
+        self.assertEqual(self.index.position('step2'), before)
+        self.assertLess(
+            self.index.position('step1'), self.index.position('step1a'),
+        )
+
+    def test_repeated_inserts_renumber_when_out_of_room(self):
+
+        point = 'step1'
+        for number in range(40):
+            new = 'step1.%d' % number
+            self.index.insert_after(point, new)
+            point = new
+
+        self.assertEqual(len(self.index), 43)
+        self._assert_positions_ordered()
+
+    def test_frozen_index_refuses_inserts(self):
+
+        self.index.freeze()
+
+        with self.assertRaises(TypeError):
+            self.index.insert_after('step1', 'step1a')
+
+        copy = self.index.copy()
+        copy.insert_after('step1', 'step1a')
+        self.assertEqual(list(copy), ['step1', 'step1a', 'step2', 'step3'])
+        self.assertNotIn('step1a', self.index)
+
+    def test_insert_duplicate_raises_value_error(self):
+
+        with self.assertRaises(ValueError):
+            self.index.insert_after('step3', 'step1')
+
+    def test_tut_point_index_follows_config(self):
+
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        t = tut.model.Tut(path)
+        t.init()
+        t.start('step1')
+        first = t.point_index()
+        self.assertIs(t.point_index(), first)
+        with self.assertRaises(TypeError):
+            first.insert_after(None, 'step0')
+
+        t.start('step2')
+        self.assertEqual(list(t.point_index()), ['step1', 'step2'])
+
+
 class TutStartEditTests(TutTestCase):
 
     def test_start_adds_name_to_pointfile(self):
@@ -170,6 +293,140 @@ class TutStartEditTests(TutTestCase):
         )
 
 
+    def test_start_does_not_touch_work_tree_or_index(self):
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+
+        os.chdir(self._testpath)
+        with open('staged.txt', 'w') as staged:
+            staged.write('staged\n')
+        git('add', 'staged.txt')
+        with open('untracked.txt', 'w') as untracked:
+            untracked.write('untracked\n')
+
+        t.start('step2')
+
+        self.assertEqual(t.points(), ['step1', 'step2'])
+        self.assertEqual(t.current(), 'step2')
+        self.assertEqual(
+            git('status', '--porcelain').strip().splitlines(),
+            ['A  staged.txt', '?? untracked.txt'],
+        )
+
+    def test_config_update_refreshes_checked_out_tut_branch(self):
+        t = tut.model.Tut(self._testpath)
+        t.init()
+
+        t.checkout('tut')
+        t._update_config({'points': ['step1']})
+
+        os.chdir(self._testpath)
+        with open('tut.cfg') as config:
+            self.assertEqual(config.read().strip(), 'points:\n- step1')
+        self.assertEqual(git('status', '--porcelain').strip(), '')
+
+
+class TutDirtyTests(TutTestCase):
+
+    def setUp(self):
+        super(TutDirtyTests, self).setUp()
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        self.tut.start('step1')
+
+        os.chdir(self._testpath)
+        self._write('tracked.txt', 'tracked\n')
+        git('add', 'tracked.txt')
+        git('commit', m='Add tracked file.')
+
+    def _write(self, path, content):
+
+        with open(os.path.join(self._testpath, path), 'w') as outfile:
+            outfile.write(content)
+
+    def test_clean_tree_is_not_dirty(self):
+
+        self._write('untracked.txt', 'untracked\n')
+        os.utime(os.path.join(self._testpath, 'tracked.txt'))
+
+        self.assertFalse(self.tut._repo_dirty())
+
+    def test_work_tree_changes_are_dirty(self):
+
+        self.assertFalse(self.tut._repo_dirty())
+        self._write('tracked.txt', 'changed\n')
+
+        self.assertTrue(self.tut._repo_dirty())
+
+    def test_staged_changes_are_dirty(self):
+
+        self.assertFalse(self.tut._repo_dirty())
+        self._write('tracked.txt', 'changed\n')
+        git('add', 'tracked.txt')
+
+        self.assertTrue(self.tut._repo_dirty())
+
+        git('reset', '--hard', '--quiet')
+        self.assertFalse(self.tut._repo_dirty())
+
+    def test_index_check_is_cached_until_index_changes(self):
+
+        # files written in the same instant as the index are "racily
+        # clean" and make git rewrite the index on every refresh
+        past = os.stat('tracked.txt').st_mtime - 60
+        os.utime('tracked.txt', (past, past))
+
+        calls = []
+        real_git = self.tut._git
+
+        def counting_git(*args, **kwargs):
+            calls.append(args[0])
+            return real_git(*args, **kwargs)
+
+        with patch.object(self.tut, '_git', counting_git):
+            self.tut._repo_dirty()
+            self.tut._repo_dirty()
+            self.assertEqual(calls.count('diff-index'), 1)
+
+            self._write('tracked.txt', 'changed\n')
+            git('add', 'tracked.txt')
+            self.assertTrue(self.tut._repo_dirty())
+            self.assertEqual(calls.count('diff-index'), 2)
+
+    def test_clean_tree_is_not_refreshed(self):
+
+        calls = []
+        real_git = self.tut._git
+
+        def counting_git(*args, **kwargs):
+            calls.append(args)
+            return real_git(*args, **kwargs)
+
+        with patch.object(self.tut, '_git', counting_git):
+            self.assertFalse(self.tut._repo_dirty())
+
+        self.assertFalse([args for args in calls if 'update-index' in args])
+
+    def test_fsmonitor_follows_git_config(self):
+
+        self.assertFalse(tut.model.Tut(self._testpath)._repo_dirty())
+        git('config', 'tut.fsmonitor', 'true')
+
+        t = tut.model.Tut(self._testpath)
+        self.assertFalse(t._repo_dirty())
+        self.assertTrue(t.fsmonitor)
+
+    def test_fsmonitor_gives_same_answer(self):
+
+        t = tut.model.Tut(self._testpath, fsmonitor=True)
+        self.assertFalse(t._repo_dirty())
+
+        self._write('tracked.txt', 'changed\n')
+        self.assertTrue(t._repo_dirty())
+
+
 class TutNextTests(TutTestCase):
 
     def test_next_checks_out_next_in_list(self):
@@ -191,6 +448,170 @@ class TutNextTests(TutTestCase):
         self.assertEqual(t.current(), 'step2')
 
 
+class TutFetchTests(TutTestCase):
+
+    def setUp(self):
+        super(TutFetchTests, self).setUp()
+
+        self._remote_path = os.path.join(self._testpath, 'remote')
+        remote = tut.model.Tut(self._remote_path)
+        remote.init()
+        for name in ('step1', 'step2', 'step3'):
+            remote.start(name)
+            git('-C', self._remote_path,
+                'commit', '--allow-empty', m='Work on %s' % name)
+
+        self._local_path = os.path.join(self._testpath, 'local')
+        self.tut = tut.model.Tut(self._local_path)
+        self.tut.init()
+        git('-C', self._local_path, 'remote', 'add', 'origin', self._remote_path)
+        git('-C', self._local_path, 'fetch', '--quiet', 'origin')
+
+    def test_points_lists_remote_points(self):
+
+        self.assertEqual(
+            self.tut.points('origin'),
+            ['origin/step1', 'origin/step2', 'origin/step3'],
+        )
+
+    def test_fetch_creates_all_points(self):
+
+        self.tut.fetch('origin')
+
+        self.assertEqual(self.tut.points(), ['step1', 'step2', 'step3'])
+        self.assertEqual(self.tut.current(), 'step3')
+        for name in ('step1', 'step2', 'step3'):
+            self.assertEqual(
+                self.tut.resolve(name),
+                self.tut.resolve('origin/' + name),
+            )
+
+    def test_fetch_writes_one_config_commit(self):
+
+        before = self.tut.resolve('tut')
+        self.tut.fetch('origin')
+
+        self.assertEqual(
+            git('-C', self._local_path,
+                'rev-list', '--count', before + '..tut').strip(),
+            '1',
+        )
+
+    def test_fetch_refuses_duplicate_points(self):
+
+        self.tut.start('step2')
+        before = self.tut.resolve('tut')
+
+        with self.assertRaises(tut.model.TutException):
+            self.tut.fetch('origin')
+
+        self.assertEqual(self.tut.resolve('tut'), before)
+        self.assertIsNone(self.tut.resolve('refs/heads/step1'))
+
+    def test_fetch_refuses_existing_branches(self):
+
+        git('-C', self._local_path, 'branch', 'step2')
+        before = self.tut.resolve('tut')
+
+        with self.assertRaises(tut.model.TutException):
+            self.tut.fetch('origin')
+
+        self.assertEqual(self.tut.resolve('tut'), before)
+        self.assertIsNone(self.tut.resolve('refs/heads/step1'))
+
+
+class TutPropagateTests(TutTestCase):
+
+    def setUp(self):
+        super(TutPropagateTests, self).setUp()
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        os.chdir(self._testpath)
+
+        for name, filename in (('step1', 'a.txt'),
+                               ('step2', 'b.txt'),
+                               ('step3', 'c.txt')):
+            self.tut.start(name)
+            self._commit(filename, '%s\n' % name)
+
+    def _commit(self, filename, content):
+
+        with open(os.path.join(self._testpath, filename), 'w') as outfile:
+            outfile.write(content)
+        git('add', filename)
+        git('commit', m='Change %s' % filename)
+
+    def test_propagate_merges_into_later_points(self):
+
+        self.tut.edit('step1')
+        self._commit('a.txt', 'fixed\n')
+
+        self.assertEqual(self.tut.propagate(), ['step2', 'step3'])
+
+        self.assertEqual(self.tut.current(), 'step1')
+        for name in ('step2', 'step3'):
+            self.assertEqual(self.tut.file(name, 'a.txt'), b'fixed\n')
+        self.assertEqual(self.tut.file('step3', 'b.txt'), b'step2\n')
+        self.assertEqual(self.tut.file('step3', 'c.txt'), b'step3\n')
+
+    def test_propagate_skips_points_already_merged(self):
+
+        self.assertEqual(self.tut.propagate('step1'), [])
+
+    def test_propagate_updates_checked_out_point(self):
+
+        self.tut.edit('step1')
+        self._commit('a.txt', 'fixed\n')
+        self.tut.checkout('step3')
+
+        self.tut.propagate('step1')
+
+        with open(os.path.join(self._testpath, 'a.txt')) as merged:
+            self.assertEqual(merged.read(), 'fixed\n')
+        self.assertEqual(git('status', '--porcelain').strip(), '')
+
+    def test_propagate_needs_merge_tree(self):
+
+        with patch('tut.model.git_version', return_value=(2, 30, 1)):
+            with self.assertRaises(tut.model.TutException) as raised:
+                self.tut.propagate('step1')
+
+        self.assertIn('git 2.38 or later', str(raised.exception))
+        self.assertIn('git 2.30.1', str(raised.exception))
+
+    def test_propagate_stops_at_conflict(self):
+
+        self.tut.edit('step2')
+        self._commit('a.txt', 'step2 change\n')
+        self.tut.edit('step1')
+        self._commit('a.txt', 'step1 change\n')
+        step3 = self.tut.resolve('step3')
+
+        with self.assertRaises(tut.model.TutException) as raised:
+            self.tut.propagate()
+
+        self.assertIn('step1 into step2', str(raised.exception))
+        self.assertIn('a.txt', str(raised.exception))
+        self.assertEqual(self.tut.resolve('step3'), step3)
+        self.assertEqual(raised.exception.updated, [])
+
+    def test_conflict_reports_updated_points(self):
+
+        self.tut.edit('step3')
+        self._commit('a.txt', 'step3 change\n')
+        self.tut.edit('step1')
+        self._commit('a.txt', 'step1 change\n')
+
+        with self.assertRaises(tut.model.TutException) as raised:
+            self.tut.propagate()
+
+        self.assertIn('step2 into step3', str(raised.exception))
+        self.assertIn('Already updated: step2', str(raised.exception))
+        self.assertEqual(raised.exception.updated, ['step2'])
+        self.assertEqual(self.tut.file('step2', 'a.txt'), b'step1 change\n')
+
+
 class TutFileTests(TutTestCase):
 
     def test_file_retrieves_content_from_branch(self):
@@ -203,3 +624,296 @@ class TutFileTests(TutTestCase):
             t.file('tut', 'tut.cfg').strip(),
             b'points: []',
         )
+
+    def test_file_raises_exception_for_missing_path(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+
+        with self.assertRaises(tut.model.TutException):
+            t.file('tut', 'missing.cfg')
+
+    def test_file_reuses_git_process(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+
+        t.file('tut', 'tut.cfg')
+        processes = t._objects._processes.copy()
+
+        t.blob_cache.clear()
+        t.file('tut', 'tut.cfg')
+        self.assertEqual(t._objects._processes, processes)
+
+    def test_close_stops_git_process(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+
+        t.file('tut', 'tut.cfg')
+        processes = list(t._objects._processes.values())
+        t.close()
+
+        self.assertEqual(t._objects._processes, {})
+        for process in processes:
+            self.assertIsNotNone(process.returncode)
+
+        # reading again starts a new process
+        self.assertEqual(t.file('tut', 'tut.cfg').strip(), b'points: []')
+
+
+class TutBlobIndexTests(TutTestCase):
+
+    def setUp(self):
+        super(TutBlobIndexTests, self).setUp()
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        self.tut.start('step1')
+        os.chdir(self._testpath)
+        with open('big.txt', 'w') as outfile:
+            outfile.write(''.join('line %d\n' % n for n in range(50000)))
+        git('add', 'big.txt')
+        git('commit', m='Add big file.')
+
+    def test_blob_index_streams_lines(self):
+
+        with patch.object(self.tut._objects, 'read') as read:
+            index = self.tut.blob_index('step1', 'big.txt')
+
+        self.assertFalse(read.called)
+        self.assertEqual(len(index), 50000)
+        self.assertEqual(index.lines()[49999], 'line 49999\n')
+        self.assertEqual(
+            list(index.lines()[10:12]), ['line 10\n', 'line 11\n'],
+        )
+
+    def test_blob_index_is_cached_by_sha(self):
+
+        index = self.tut.blob_index('step1', 'big.txt')
+
+        self.assertIs(self.tut.blob_index('HEAD', 'big.txt'), index)
+
+    def test_blob_index_raises_exception_for_missing_path(self):
+
+        with self.assertRaises(tut.model.TutException):
+            self.tut.blob_index('step1', 'missing.txt')
+
+
+class TutDiffOpcodesTests(TutTestCase):
+
+    def test_diff_opcodes_come_from_git(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+        os.chdir(self._testpath)
+        with open('a.py', 'w') as outfile:
+            outfile.write('a = 1\nb = 2\nc = 3\n')
+        git('add', 'a.py')
+        git('commit', m='Add a.')
+        t.start('step2')
+        with open('a.py', 'w') as outfile:
+            outfile.write('a = 1\nb = 20\nc = 3\nd = 4\n')
+        git('commit', '-a', m='Change a.')
+
+        self.assertEqual(
+            t.diff_opcodes('step1:a.py', 'step2:a.py'),
+            [('replace', 1, 2, 1, 2), ('insert', 3, 3, 3, 4)],
+        )
+
+
+class TutBlobCacheTests(TutTestCase):
+
+    def test_file_is_served_from_cache(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+
+        t.file('tut', 'tut.cfg')
+        t.file('tut', 'tut.cfg')
+
+        self.assertEqual(t.blob_cache.misses, 1)
+        self.assertEqual(t.blob_cache.hits, 1)
+
+    def test_cache_is_keyed_by_blob(self):
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+
+        os.chdir(self._testpath)
+        with open('setup.py', 'w') as setup_py:
+            setup_py.write('# setup\n')
+        git.add('setup.py')
+        git.commit(m='Add setup.py')
+
+        t.start('step2')
+        t.blob_cache.clear()
+
+        # both points share the same blob
+        self.assertEqual(t.file('step1', 'setup.py'), b'# setup\n')
+        self.assertEqual(t.file('step2', 'setup.py'), b'# setup\n')
+        self.assertEqual(t.blob_cache.misses, 1)
+        self.assertEqual(t.blob_cache.hits, 1)
+
+
+class TutPrefetchTests(TutTestCase):
+
+    def setUp(self):
+        super(TutPrefetchTests, self).setUp()
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        self.tut.start('step1')
+        os.chdir(self._testpath)
+        for filename in ('a.py', 'b.py'):
+            with open(filename, 'w') as outfile:
+                outfile.write('# %s\n' % filename)
+        git('add', '.')
+        git('commit', m='Add files.')
+
+    def test_prefetch_warms_cache_and_resolutions(self):
+
+        shas = self.tut.prefetch(['step1:a.py', 'step1:b.py', 'step1:c.py'])
+
+        self.assertEqual(shas['step1:a.py'], self.tut.resolve('step1:a.py'))
+        self.assertIsNone(shas['step1:c.py'])
+
+        with patch.object(self.tut._objects, 'resolve') as resolve, \
+                patch.object(self.tut._objects, 'read') as read:
+            self.assertEqual(self.tut.file('step1', 'a.py'), b'# a.py\n')
+            self.assertEqual(self.tut.file('step1', 'b.py'), b'# b.py\n')
+            with self.assertRaises(tut.model.TutException):
+                self.tut.file('step1', 'c.py')
+
+        self.assertFalse(resolve.called)
+        self.assertFalse(read.called)
+
+    def test_prefetch_stays_within_cache_size(self):
+
+        self.tut.blob_cache = LRUCache(len(b'# a.py\n'))
+        self.tut.prefetch(['step1:a.py', 'step1:b.py'])
+
+        self.assertEqual(len(self.tut.blob_cache), 1)
+        self.assertEqual(self.tut.blob_cache.evictions, 0)
+
+    def test_reset_forgets_resolutions(self):
+
+        self.tut.prefetch(['step1:a.py'])
+        with open('a.py', 'w') as outfile:
+            outfile.write('# changed\n')
+        git('commit', '-a', m='Change a.')
+
+        self.assertEqual(self.tut.file('step1', 'a.py'), b'# a.py\n')
+        self.tut.reset()
+        self.assertEqual(self.tut.file('step1', 'a.py'), b'# changed\n')
+
+
+class TutWriteFileTests(TutTestCase):
+
+    def setUp(self):
+        super(TutWriteFileTests, self).setUp()
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        self.tut.start('step1')
+        os.chdir(self._testpath)
+        with open('a.py', 'w') as outfile:
+            outfile.write('# a.py\n')
+        git('add', '.')
+        git('commit', m='Add a.')
+        git('checkout', 'master')
+
+    def test_write_file_commits_without_touching_work_tree(self):
+
+        self.tut.prefetch(['step1:a.py'])
+        commit = self.tut.write_file('step1', 'a.py', '# new\n')
+
+        self.assertEqual(self.tut.resolve('step1'), commit)
+        self.assertEqual(self.tut.file('step1', 'a.py'), b'# new\n')
+        self.assertFalse(os.path.exists('a.py'))
+        self.assertEqual(git('status', '--porcelain').strip(), '')
+
+    def test_write_file_ignores_prefetched_branch(self):
+
+        self.tut.prefetch(['step1'])
+        # the branch moves after it was looked up
+        tut.model.Tut(self._testpath).write_file('step1', 'a.py', '# one\n')
+        self.tut.write_file('step1', 'b.py', '# two\n')
+        self.tut.reset()
+
+        self.assertEqual(self.tut.file('step1', 'a.py'), b'# one\n')
+        self.assertEqual(self.tut.file('step1', 'b.py'), b'# two\n')
+
+    def test_moved_branch_raises_exception(self):
+
+        parent = self.tut.resolve('step1')
+        self.tut.write_file('step1', 'a.py', '# one\n')
+
+        with patch.object(self.tut._objects, 'resolve', return_value=parent):
+            with self.assertRaises(tut.model.TutException):
+                self.tut.write_file('step1', 'a.py', '# two\n')
+
+    def test_unchanged_content_is_not_committed(self):
+
+        with patch.object(self.tut, '_commit_file') as commit_file:
+            self.assertIsNone(self.tut.write_file('step1', 'a.py', '# a.py\n'))
+
+        self.assertFalse(commit_file.called)
+
+
+class TutWorktreeTests(TutTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self._cachepath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._cachepath)
+
+        self.tut = tut.model.Tut(self._testpath)
+        self.tut.init()
+        self.tut.start('step1')
+
+        os.chdir(self._testpath)
+        with open('setup.py', 'w') as setup_py:
+            setup_py.write('# step1\n')
+        git.add('setup.py')
+        git.commit(m='Add setup.py')
+
+    def test_worktree_checks_out_ref(self):
+
+        path = self.tut.worktree('step1', self._cachepath)
+
+        self.assertTrue(path.startswith(self._cachepath))
+        with open(os.path.join(path, 'setup.py')) as setup_py:
+            self.assertEqual(setup_py.read(), '# step1\n')
+
+        # the main work tree is untouched
+        self.assertEqual(self.tut._current_branch(), 'step1')
+
+    def test_worktree_is_reused(self):
+
+        path = self.tut.worktree('step1', self._cachepath)
+
+        with patch('tut.model.git') as git_mock:
+            self.assertEqual(self.tut.worktree('step1', self._cachepath), path)
+
+        self.assertEqual(git_mock.call_count, 0)
+
+    def test_worktree_is_refreshed_when_branch_moves(self):
+
+        path = self.tut.worktree('step1', self._cachepath)
+
+        with open('setup.py', 'w') as setup_py:
+            setup_py.write('# step1, revised\n')
+        git.commit('-a', m='Revise setup.py')
+
+        self.assertEqual(self.tut.worktree('step1', self._cachepath), path)
+        with open(os.path.join(path, 'setup.py')) as setup_py:
+            self.assertEqual(setup_py.read(), '# step1, revised\n')
+
+    def test_worktree_raises_exception_on_unknown_ref(self):
+
+        with self.assertRaises(tut.model.TutException):
+            self.tut.worktree('blarf', self._cachepath)
@@ -0,0 +1,283 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sh import git
+
+import tut.model
+from tut.objects import (
+    CatFile,
+    ObjectMissing,
+    ObjectStore,
+    Pack,
+    UnsupportedName,
+)
+
+
+class RepositoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+
+        self._testpath = tempfile.mkdtemp()
+        self.git_dir = os.path.join(self._testpath, '.git')
+
+        t = tut.model.Tut(self._testpath)
+        t.init()
+        t.start('step1')
+
+        # write enough similar content that packing produces deltas
+        for i in range(3):
+            self._write(
+                'module.py',
+                ''.join('line %d\n' % n for n in range(200 + i)),
+            )
+            self._write(os.path.join('pkg', 'inner.py'), 'x = %d\n' % i)
+            self._git('add', '.')
+            self._git('commit', m='Change %d' % i)
+
+        t.start('step2')
+        self._git('tag', '-a', 'v1', m='Version 1')
+
+    def tearDown(self):
+
+        shutil.rmtree(self._testpath)
+
+    def _git(self, *args, **kwargs):
+
+        return git(
+            '--git-dir={0}'.format(self.git_dir),
+            '--work-tree={0}'.format(self._testpath),
+            *args, **kwargs
+        )
+
+    def _write(self, path, content):
+
+        path = os.path.join(self._testpath, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as outfile:
+            outfile.write(content)
+
+    def assertMatchesGit(self, store, names):
+
+        reference = CatFile(self.git_dir)
+        try:
+            for name in names:
+                self.assertEqual(store.read(name), reference.read(name))
+        finally:
+            reference.close()
+
+
+class ObjectStoreTests(RepositoryTestCase):
+
+    NAMES = (
+        'tut:tut.cfg',
+        'step1:module.py',
+        'step1:pkg/inner.py',
+        'step2^{tree}',
+        'v1',
+        'HEAD',
+    )
+
+    def test_reads_loose_objects(self):
+
+        store = ObjectStore(self.git_dir)
+        self.assertMatchesGit(store, self.NAMES)
+
+    def test_reads_packed_objects_and_refs(self):
+
+        self._git('gc', '--aggressive', '--quiet')
+        self.assertTrue(
+            os.path.exists(os.path.join(self.git_dir, 'packed-refs')))
+
+        store = ObjectStore(self.git_dir)
+        self.assertMatchesGit(store, self.NAMES)
+
+        for revision in range(3):
+            sha = self._git('rev-parse', 'step1~%d:module.py' % revision).strip()
+            self.assertEqual(
+                store.read(sha)[2],
+                self._git('cat-file', 'blob', sha).stdout,
+            )
+
+    def test_missing_objects_raise(self):
+
+        store = ObjectStore(self.git_dir)
+
+        with self.assertRaises(ObjectMissing):
+            store.read('step1:missing.py')
+        with self.assertRaises(ObjectMissing):
+            store.read('nobranch:module.py')
+
+    def test_resolves_revision_expressions(self):
+
+        names = [
+            'step1~1', 'step1~2:module.py', 'step2^', 'step1^0', 'step1^1',
+            'v1^{}', 'v1^{commit}', 'v1^{tree}', 'v1~1^{tree}', '@',
+            self._git('rev-parse', 'step1~1').strip()[:7],
+            self._git('rev-parse', 'step1:module.py').strip()[:10],
+        ]
+
+        self.assertMatchesGit(ObjectStore(self.git_dir), names)
+
+        self._git('gc', '--aggressive', '--quiet')
+        self.assertMatchesGit(ObjectStore(self.git_dir), names)
+
+    def test_missing_revisions_raise(self):
+
+        store = ObjectStore(self.git_dir)
+
+        for name in ('step1~10', 'step1^2', 'step1^{blob}', 'abcdef0'):
+            with self.assertRaises(ObjectMissing):
+                store.resolve(name)
+
+    def test_unsupported_names_raise(self):
+
+        store = ObjectStore(self.git_dir)
+
+        for name in ('step1@{1}', ':/Change', ':module.py', 'step1^{/x}',
+                     'step1..step2'):
+            with self.assertRaises(UnsupportedName):
+                store.resolve(name)
+
+        t = tut.model.Tut(self._testpath, backend='python')
+        with self.assertRaises(tut.model.TutException):
+            t.resolve('step1@{1}')
+
+    def test_truncated_pack_raises(self):
+
+        self._git('gc', '--aggressive', '--quiet')
+        store = ObjectStore(self.git_dir)
+        store._load_packs()
+        idx_path, = store._packs
+        sha = self._git('rev-parse', 'step1:module.py').strip()
+
+        # copy the pack, cut off partway through the blob
+        offset = store._packs[idx_path].offset(bytes.fromhex(sha))
+        copy = os.path.join(self._testpath, 'copy.pack')
+        with open(idx_path[:-len('.idx')] + '.pack', 'rb') as pack_file:
+            data = pack_file.read(offset + 8)
+        with open(copy, 'wb') as copy_file:
+            copy_file.write(data)
+        shutil.copy(idx_path, copy[:-len('.pack')] + '.idx')
+
+        pack = Pack(copy[:-len('.pack')] + '.idx')
+        self.addCleanup(pack.close)
+        with self.assertRaises(ValueError):
+            pack.read_at(offset, store)
+
+    def test_current_branch(self):
+
+        store = ObjectStore(self.git_dir)
+        self.assertEqual(store.current_branch(), 'step2')
+
+        self._git('checkout', '--detach', 'step1')
+        self.assertEqual(store.current_branch(), 'HEAD')
+
+
+    def test_reads_through_a_gitfile(self):
+
+        self._git('gc', '--quiet')
+        moved = os.path.join(self._testpath, 'modules', 'src')
+        os.makedirs(os.path.dirname(moved))
+        os.rename(self.git_dir, moved)
+        with open(self.git_dir, 'w') as gitfile:
+            gitfile.write('gitdir: modules/src\n')
+
+        store = ObjectStore(self.git_dir)
+        self.assertEqual(store.current_branch(), 'step2')
+        self.assertMatchesGit(store, self.NAMES)
+        self.assertEqual(
+            tut.model.Tut(self._testpath, backend='python').points(),
+            ['step1', 'step2'],
+        )
+
+    def test_reads_linked_worktrees(self):
+
+        worktree = os.path.join(self._testpath, 'wt')
+        self._git('worktree', 'add', '--detach', worktree, 'step1')
+
+        store = ObjectStore(os.path.join(worktree, '.git'))
+        self.assertEqual(store.current_branch(), 'HEAD')
+        self.assertEqual(store.resolve('HEAD'), store.resolve('step1'))
+        self.assertMatchesGit(store, self.NAMES[:-1])
+
+    def test_reads_alternates(self):
+
+        self._git('gc', '--quiet')
+        clone = os.path.join(self._testpath, 'clone')
+        git('clone', '--quiet', '--shared', '--no-checkout',
+            self._testpath, clone)
+        git('-C', clone, 'branch', 'step1', 'origin/step1')
+
+        store = ObjectStore(os.path.join(clone, '.git'))
+        self.assertMatchesGit(store, ['step1:module.py', 'step1:pkg/inner.py'])
+
+
+class CatFileTests(RepositoryTestCase):
+
+    def test_forked_child_uses_its_own_process(self):
+
+        reader = CatFile(self.git_dir)
+        expected = reader.read('step1:module.py')
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # child: report whether the read matched, then exit
+            os.close(read_fd)
+            try:
+                ok = reader.read('step1:module.py') == expected
+            except Exception:
+                ok = False
+            os.write(write_fd, b'1' if ok else b'0')
+            os._exit(0)
+
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd, 'rb') as child_result:
+            self.assertEqual(child_result.read(), b'1')
+
+        # the parent's process is still usable
+        self.assertEqual(reader.read('step1:module.py'), expected)
+        reader.close()
+
+    def test_batches_match_single_reads(self):
+
+        reader = CatFile(self.git_dir)
+        names = ['step1~%d:module.py' % n for n in range(3)] * 200
+        names.append('step1:missing.py')
+
+        contents = reader.read_many(names)
+        stats = reader.stat_many(names)
+
+        self.assertNotIn('step1:missing.py', contents)
+        self.assertNotIn('step1:missing.py', stats)
+        for name in names[:3]:
+            sha, obj_type, data = reader.read(name)
+            self.assertEqual(contents[name], (sha, obj_type, data))
+            self.assertEqual(stats[name], (sha, obj_type, len(data)))
+
+        # the processes are left ready for more requests
+        self.assertEqual(reader.read(names[0]), contents[names[0]])
+        reader.close()
+
+    def test_exited_process_raises_ioerror(self):
+
+        reader = CatFile(os.path.join(self._testpath, 'nonexistent'))
+
+        # git exits at once, so the request may hit a closed pipe
+        for attempt in range(3):
+            with self.assertRaises(IOError):
+                reader.read('step1:module.py')
+
+
+class TutPythonBackendTests(RepositoryTestCase):
+
+    def test_tut_reads_without_git(self):
+
+        t = tut.model.Tut(self._testpath, backend='python')
+
+        self.assertEqual(t._current_branch(), 'step2')
+        self.assertEqual(t.points(), ['step1', 'step2'])
+        self.assertEqual(t.file('step1', 'pkg/inner.py'), b'x = 2\n')
@@ -0,0 +1,155 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from tut.cache import LRUCache
+from tut.shell import (
+    ExecSession,
+    ShellError,
+    ShellSession,
+)
+
+
+class ShellSessionTests(TestCase):
+
+    def setUp(self):
+
+        self._path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._path)
+        os.mkdir(os.path.join(self._path, 'sub'))
+
+        self.shell = ShellSession(self._path, env={'TUT_TEST': 'yes'})
+        self.addCleanup(self.shell.close)
+
+    def test_state_carries_over(self):
+
+        self.shell.run('cd sub; GREETING=hello')
+
+        self.assertEqual(
+            self.shell.run('echo $GREETING $TUT_TEST; basename $PWD'),
+            (0, b'hello yes\nsub\n'),
+        )
+
+    def test_output_and_status(self):
+
+        self.assertEqual(
+            self.shell.run('echo out; echo err >&2; printf tail; false'),
+            (1, b'out\nerr\ntail'),
+        )
+        self.assertEqual(self.shell.run('cat'), (0, b''))
+
+    def test_syntax_errors_keep_the_shell(self):
+
+        status, _ = self.shell.run('if')
+
+        self.assertNotEqual(status, 0)
+        self.assertEqual(self.shell.run('echo ok'), (0, b'ok\n'))
+
+    def test_exit_raises(self):
+
+        with self.assertRaises(ShellError):
+            self.shell.run('exit 3')
+
+        # the next command starts a new shell
+        self.assertEqual(self.shell.run('echo ok'), (0, b'ok\n'))
+
+
+    def test_timeout_kills_the_shell(self):
+
+        shell = ShellSession(self._path, timeout=0.2)
+        self.addCleanup(shell.close)
+
+        with self.assertRaises(ShellError):
+            shell.run('sleep 5 & wait')
+        self.assertEqual(shell.run('echo ok'), (0, b'ok\n'))
+
+    def test_output_is_capped(self):
+
+        shell = ShellSession(self._path, max_output=10)
+        self.addCleanup(shell.close)
+
+        status, output = shell.run('head -c 100000 /dev/zero | tr "\\0" x')
+
+        self.assertEqual(status, 0)
+        self.assertEqual(
+            output, b'x' * 10 + b'\n[99990 more bytes of output]\n',
+        )
+
+
+class ExecSessionTests(TestCase):
+
+    def setUp(self):
+
+        self._path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._path)
+        self.cache = LRUCache(1024)
+
+    def _session(self):
+
+        session = ExecSession(
+            ShellSession(self._path), tree='abc', cache=self.cache,
+        )
+        self.addCleanup(session.close)
+
+        return session
+
+    def test_outputs_are_cached_by_history(self):
+
+        session = self._session()
+        self.assertEqual(session.run('X=1'), '')
+        self.assertEqual(session.run('echo $X'), '1\n')
+
+        session = self._session()
+        with patch.object(ShellSession, 'run') as run:
+            self.assertEqual(session.run('X=1'), '')
+            self.assertEqual(session.run('echo $X'), '1\n')
+        self.assertFalse(run.called)
+
+    def test_cached_commands_are_replayed_before_a_miss(self):
+
+        self._session().run('X=1')
+
+        session = self._session()
+        session.run('X=1')
+        self.assertEqual(session.run('echo $X'), '1\n')
+
+    def test_nothing_cached_without_a_tree(self):
+
+        session = ExecSession(ShellSession(self._path), cache=self.cache)
+        self.addCleanup(session.close)
+        session.run('echo hi')
+
+        self.assertEqual(len(self.cache), 0)
+
+    def test_results_are_used_before_running(self):
+
+        results = ExecSession(ShellSession(self._path)).run_all(
+            ['X=1', 'echo $X', 'exit 1', 'echo never'],
+        )
+        self.assertEqual(list(results), [
+            ('X=1',), ('X=1', 'echo $X'), ('X=1', 'echo $X', 'exit 1'),
+        ])
+
+        session = ExecSession(ShellSession(self._path), results=results)
+        self.addCleanup(session.close)
+        with patch.object(ShellSession, 'run') as run:
+            session.run('X=1')
+            self.assertEqual(session.run('echo $X'), '1\n')
+            with self.assertRaises(ShellError):
+                session.run('exit 1')
+        self.assertFalse(run.called)
+
+    def test_commands_after_a_failure_are_not_run(self):
+
+        session = self._session()
+        session.run('cd /')
+        with self.assertRaises(ShellError):
+            session.run('exit 1')
+
+        with patch.object(ShellSession, 'run') as run:
+            with self.assertRaises(ShellError):
+                session.run('pwd')
+        self.assertFalse(run.called)
+        self.assertEqual(len(self.cache), 1)
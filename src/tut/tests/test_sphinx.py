@@ -1,4 +1,8 @@
+import glob
+import io
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import (
     ANY,
@@ -6,9 +10,12 @@ from unittest.mock import (
 )
 
 from munch import munchify
-from sphinx_testing import with_app
+from sh import git
+from sphinx_testing import TestApp, with_app
 from sphinx_testing.path import path
 
+from tut.model import Tut
+from tut.objects import CatFile
 from tut.sphinx.manager import TutManager
 import tut.sphinx.checkpoint
 
@@ -113,6 +120,602 @@ class CheckpointDirectiveTests(TestCase):
         )
 
 
+@patch('tut.model.Tut.resolve', return_value='0' * 40)
+@patch('tut.model.git', return_value='x')
+class ObjectsCheckpointModeTests(TestCase):
+
+    @with_app(srcdir=test_root,
+              confoverrides={'tut_checkpoint_mode': 'objects'})
+    def test_checkpoint_does_not_checkout(self, git_mock, resolve_mock,
+                                          sphinx_app, status, warning):
+
+        import sphinx.pycode
+        sphinx.pycode.ModuleAnalyzer.cache = {'foo': 'bar'}
+        self.addCleanup(setattr, sphinx.pycode.ModuleAnalyzer, 'cache', {})
+
+        sphinx_app.build()
+
+        self.assertEqual(git_mock.call_count, 0)
+        self.assertEqual(resolve_mock.call_args[0], ('step_one',))
+
+        # the pycode cache is only invalidated by real checkouts
+        self.assertEqual(sphinx.pycode.ModuleAnalyzer.cache, {'foo': 'bar'})
+
+
+@patch('tut.model.git', return_value='x')
+class ParallelReadTests(TestCase):
+
+    @with_app(srcdir=test_root)
+    def test_checkout_mode_is_not_parallel_safe(self, git_mock, sphinx_app, status, warning):
+
+        self.assertFalse(sphinx_app.extensions['tut.sphinx'].parallel_read_safe)
+
+    @with_app(srcdir=test_root,
+              confoverrides={'tut_checkpoint_mode': 'objects'})
+    def test_objects_mode_is_parallel_safe(self, git_mock, sphinx_app, status, warning):
+
+        self.assertTrue(sphinx_app.extensions['tut.sphinx'].parallel_read_safe)
+
+    def test_merge_copies_document_state(self, git_mock):
+
+        main, other = TutManager(), TutManager()
+        other.update_defaults({'path': '/src'}, 'chapter1')
+        other.note_checkpoint('chapter1', '/src', 'step_one')
+        other.note_checkpoint('chapter2', '/src', 'step_two')
+
+        main.merge(['chapter1'], other)
+
+        self.assertEqual(main.doc_options, {'chapter1': {'path': '/src'}})
+        self.assertEqual(main.checkpoints, {'chapter1': [('/src', 'step_one')]})
+
+        main.purge_doc('chapter1')
+        self.assertEqual(main.doc_options, {})
+        self.assertEqual(main.checkpoints, {})
+
+
+class DocumentTestCase(TestCase):
+
+    def setUp(self):
+
+        self._docpath = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._docpath)
+        self._srcpath = os.path.join(self._docpath, 'src')
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'w') as conf:
+            conf.write(
+                "extensions = ['tut.sphinx']\n"
+                "master_doc = 'index'\n"
+                "tut_checkpoint_mode = 'objects'\n"
+            )
+        self._write('index.rst', '.. toctree::\n\n   first\n   second\n')
+        for docname, filename in (('first', 'a.py'), ('second', 'b.py')):
+            self._write(
+                docname + '.rst',
+                '%s\n======\n\n'
+                '.. tut::\n   :path: /src\n\n'
+                '.. tut:checkpoint:: step_one\n\n'
+                '.. tut:literalinclude:: /src/%s\n'
+                % (docname, filename),
+            )
+
+        Tut(self._srcpath).init()
+        Tut(self._srcpath).start('step_one')
+        self._write('src/a.py', 'a = 1\n')
+        self._write('src/b.py', 'b = 1\n')
+        self._git('add', '.')
+        self._git('commit', m='Add a and b.')
+
+    def _write(self, filename, content):
+
+        with open(os.path.join(self._docpath, filename), 'w') as outfile:
+            outfile.write(content)
+
+    def _git(self, *args, **kwargs):
+
+        return git('-C', self._srcpath, *args, **kwargs)
+
+    def _app(self, **kwargs):
+
+        return TestApp(
+            srcdir=self._docpath,
+            outdir=os.path.join(self._docpath, '_build', 'html'),
+            doctreedir=os.path.join(self._docpath, '_build', 'doctrees'),
+            **kwargs
+        )
+
+
+class IncrementalBuildTests(DocumentTestCase):
+
+    def test_only_documents_using_changed_blobs_are_outdated(self):
+
+        self._app().build()
+
+        self._write('src/b.py', 'b = 2\n')
+        self._git('commit', '-a', m='Change b.')
+
+        app = self._app()
+        self.assertEqual(TutManager.get(app.env).outdated(), {'second'})
+
+        app.build()
+        self.assertEqual(TutManager.get(app.env).outdated(), set())
+
+
+class PrefetchTests(DocumentTestCase):
+
+    def test_directives_read_from_prefetched_objects(self):
+
+        app = self._app()
+        with patch.object(CatFile, 'resolve', autospec=True,
+                          side_effect=CatFile.resolve) as resolve, \
+                patch.object(CatFile, 'read', autospec=True,
+                             side_effect=CatFile.read) as read, \
+                patch.object(CatFile, 'read_many', autospec=True,
+                             side_effect=CatFile.read_many) as read_many:
+            app.build()
+
+        self.assertFalse(resolve.called)
+        self.assertFalse(read.called)
+        self.assertEqual(read_many.call_count, 1)
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'second.html')) as html:
+            self.assertIn('<span class="n">b</span>', html.read())
+
+    def test_scan_finds_diff_blobs(self):
+
+        self._write(
+            'first.rst',
+            '.. tut:checkpoint:: Step_One\n'
+            '   :path: /src\n\n'
+            '.. tut:diff:: /src/a.py\n'
+            '   :path: /src\n'
+            '   :prev_ref: step_one\n',
+        )
+
+        with patch.object(Tut, 'prefetch') as prefetch:
+            self._app().build()
+
+        prefetch.assert_called_once_with([
+            'step_one', 'step_one:a.py', 'step_one:a.py',
+            'step_one', 'step_one:b.py',
+        ])
+
+
+class CheckoutScheduleTests(DocumentTestCase):
+
+    def setUp(self):
+        super(CheckoutScheduleTests, self).setUp()
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'w') as conf:
+            conf.write(
+                "extensions = ['tut.sphinx']\n"
+                "master_doc = 'index'\n"
+            )
+
+        Tut(self._srcpath).start('step_two')
+        self._write('src/a.py', 'a = 2\n')
+        self._git('commit', '-a', m='Change a.')
+
+        # chapters alternate between the checkpoints
+        os.remove(os.path.join(self._docpath, 'first.rst'))
+        os.remove(os.path.join(self._docpath, 'second.rst'))
+        docnames = ['ch%d' % n for n in range(4)]
+        self._write(
+            'index.rst',
+            '.. toctree::\n\n' + ''.join('   %s\n' % d for d in docnames),
+        )
+        for n, docname in enumerate(docnames):
+            self._write(
+                docname + '.rst',
+                '%s\n===\n\n'
+                '.. tut::\n   :path: /src\n\n'
+                '.. tut:checkpoint:: %s\n\n'
+                '.. literalinclude:: /src/a.py\n'
+                % (docname, ('step_one', 'step_two')[n % 2]),
+            )
+
+    def _build(self):
+
+        shutil.rmtree(os.path.join(self._docpath, '_build'), ignore_errors=True)
+        with patch.object(Tut, 'checkout', autospec=True,
+                          side_effect=Tut.checkout) as checkout:
+            self._app().build()
+
+        pages = {}
+        for n in range(4):
+            with open(os.path.join(self._docpath, '_build', 'html',
+                                   'ch%d.html' % n)) as html:
+                pages[n] = html.read()
+
+        return checkout.call_count, pages
+
+    def test_reordering_saves_checkouts_without_changing_output(self):
+
+        checkouts, pages = self._build()
+        with patch('tut.sphinx.scan.schedule',
+                   side_effect=lambda scans, docnames: list(docnames)):
+            unordered_checkouts, unordered_pages = self._build()
+
+        # one more checkout restores the original branch at the end
+        self.assertEqual(checkouts, 2 + 1)
+        self.assertEqual(unordered_checkouts, 4 + 1)
+        self.assertEqual(pages, unordered_pages)
+        self.assertIn('<span class="mi">2</span>', pages[1])
+
+
+class ExecTests(DocumentTestCase):
+
+    def setUp(self):
+        super(ExecTests, self).setUp()
+
+        self._write(
+            'first.rst',
+            'first\n=====\n\n'
+            '.. tut::\n   :path: /src\n\n'
+            '.. tut:checkpoint:: step_one\n\n'
+            '.. tut:exec::\n\n'
+            '   $ export GREETING=hello\n'
+            '   $ cat a.py\n\n'
+            '.. tut:exec::\n\n'
+            '   $ echo $GREETING from $(basename $PWD)\n',
+        )
+
+    def _page(self):
+
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'first.html')) as html:
+            return html.read()
+
+    def test_commands_share_a_shell_in_the_checkpoint(self):
+
+        self._app().build()
+
+        page = self._page()
+        self.assertIn('a = 1', page)
+        self.assertIn('hello from step_one', page)
+
+    def test_rebuild_uses_cached_output(self):
+
+        self._app().build()
+        expected = self._page()
+
+        with patch('tut.shell.ShellSession.run') as run:
+            self._app(freshenv=True).build()
+
+        self.assertFalse(run.called)
+        self.assertEqual(self._page(), expected)
+
+
+    def test_checkpoints_run_in_parallel(self):
+
+        # each command waits for the other checkpoint's to start
+        marks = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, marks)
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write(
+                "tut_exec_env = {'MARKS': %r}\n"
+                "tut_exec_timeout = 10\n" % marks
+            )
+        Tut(self._srcpath).start('step_two')
+        for docname, ref in (('first', 'step_one'), ('second', 'step_two')):
+            self._write(
+                docname + '.rst',
+                '%s\n=====\n\n'
+                '.. tut::\n   :path: /src\n\n'
+                '.. tut:checkpoint:: %s\n\n'
+                '.. tut:exec::\n\n'
+                '   $ touch $MARKS/$(basename $PWD); '
+                'until [ $(ls $MARKS | wc -l) -ge 2 ]; do sleep 0.05; done; '
+                'echo together at $(basename $PWD)\n'
+                '   $ touch ran-here\n'
+                % (docname, ref),
+            )
+
+        self._app().build()
+
+        self.assertIn('together at step_one', self._page())
+        self.assertEqual(sorted(os.listdir(marks)), ['step_one', 'step_two'])
+        # they ran in the worktrees TutExec itself would use
+        self.assertEqual(
+            len(glob.glob(os.path.join(
+                self._docpath, '_build', 'doctrees', 'tut_worktrees',
+                '*', 'step_*', 'ran-here',
+            ))),
+            2,
+        )
+
+    def test_checkout_mode_runs_in_the_work_tree(self):
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write("tut_checkpoint_mode = 'checkout'\n")
+        self._write(
+            'first.rst',
+            'first\n=====\n\n'
+            '.. tut::\n   :path: /src\n\n'
+            '.. tut:checkpoint:: step_one\n\n'
+            '.. tut:exec::\n\n'
+            '   $ pwd\n',
+        )
+
+        self._app().build()
+
+        self.assertIn(self._srcpath, self._page())
+
+    def test_timeout_is_a_warning(self):
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write("tut_exec_timeout = 0.5\n")
+        self._write(
+            'first.rst',
+            'first\n=====\n\n'
+            '.. tut::\n   :path: /src\n\n'
+            '.. tut:checkpoint:: step_one\n\n'
+            '.. tut:exec::\n\n'
+            '   $ sleep 10\n',
+        )
+
+        warning = io.StringIO()
+        self._app(warning=warning).build()
+
+        self.assertIn('timed out after 0.5 seconds', warning.getvalue())
+
+
+class InheritedDefaultsTests(DocumentTestCase):
+
+    def setUp(self):
+        super(InheritedDefaultsTests, self).setUp()
+
+        # only the first chapter sets the tut path
+        os.remove(os.path.join(self._docpath, 'first.rst'))
+        os.remove(os.path.join(self._docpath, 'second.rst'))
+        self.docnames = ['ch%d' % n for n in range(8)]
+        self._write(
+            'index.rst',
+            '.. toctree::\n\n' + ''.join('   %s\n' % d for d in self.docnames),
+        )
+        for docname in self.docnames:
+            self._write(
+                docname + '.rst',
+                '%s\n===\n\n%s'
+                '.. tut:checkpoint:: step_one\n\n'
+                '.. tut:literalinclude:: /src/a.py\n'
+                % (docname, '.. tut::\n   :path: /src\n\n'
+                   if docname == 'ch0' else ''),
+            )
+
+    def test_documents_are_read_serially(self):
+
+        app = self._app(parallel=4)
+        app.build()
+
+        self.assertFalse(app.extensions['tut.sphinx'].parallel_read_safe)
+        for docname in self.docnames:
+            with open(os.path.join(self._docpath, '_build', 'html',
+                                   docname + '.html')) as html:
+                self.assertIn('<span class="mi">1</span>', html.read())
+
+
+class SharedShellTests(DocumentTestCase):
+
+    def setUp(self):
+        super(SharedShellTests, self).setUp()
+
+        # the first chapter sets a variable the others use
+        os.remove(os.path.join(self._docpath, 'first.rst'))
+        os.remove(os.path.join(self._docpath, 'second.rst'))
+        self.docnames = ['ch%d' % n for n in range(8)]
+        self._write(
+            'index.rst',
+            '.. toctree::\n\n' + ''.join('   %s\n' % d for d in self.docnames),
+        )
+        for docname in self.docnames:
+            self._write(
+                docname + '.rst',
+                '%s\n===\n\n'
+                '.. tut::\n   :path: /src\n\n'
+                '.. tut:checkpoint:: step_one\n\n'
+                '.. tut:exec::\n\n'
+                '   $ %s\n'
+                % (docname, 'export FOO=bar' if docname == 'ch0'
+                   else 'echo foo=$FOO'),
+            )
+
+    def _pages(self):
+
+        pages = {}
+        for docname in self.docnames[1:]:
+            with open(os.path.join(self._docpath, '_build', 'html',
+                                   docname + '.html')) as html:
+                pages[docname] = 'foo=bar' in html.read()
+
+        return pages
+
+    def test_documents_are_read_serially(self):
+
+        app = self._app(parallel=4)
+        app.build()
+
+        self.assertFalse(app.extensions['tut.sphinx'].parallel_read_safe)
+        self.assertTrue(all(self._pages().values()), self._pages())
+
+    def test_rereading_a_document_rereads_its_shell(self):
+
+        self._app().build()
+        with open(os.path.join(self._docpath, 'ch5.rst'), 'a') as ch5:
+            ch5.write('\nMore.\n')
+
+        with patch('tut.shell.ShellSession.run') as run:
+            self._app().build()
+
+        # the earlier commands' output comes from the cache
+        self.assertFalse(run.called)
+        self.assertTrue(all(self._pages().values()), self._pages())
+
+
+class ContentTests(DocumentTestCase):
+
+    def setUp(self):
+        super(ContentTests, self).setUp()
+
+        self._write(
+            'first.rst',
+            'first\n=====\n\n'
+            '.. tut::\n   :path: /src\n\n'
+            '.. tut:checkpoint:: step_one\n\n'
+            '.. tut:content:: a.py\n\n'
+            '   a = 3\n\n'
+            '.. tut:literalinclude:: /src/a.py\n',
+        )
+
+    def _configure(self, mode):
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write("tut_content_mode = %r\n" % mode)
+
+    def test_commit_mode_writes_to_the_checkpoint(self):
+
+        self._configure('commit')
+        self._git('checkout', 'master')
+
+        self._app().build()
+
+        self.assertEqual(self._git('cat-file', '-p', 'step_one:a.py').strip(), 'a = 3')
+        self.assertFalse(os.path.exists(os.path.join(self._srcpath, 'a.py')))
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'first.html')) as html:
+            self.assertIn('<span class="mi">3</span>', html.read())
+
+    def test_commit_mode_skips_unchanged_content(self):
+
+        self._configure('commit')
+        self._app().build()
+        commit = self._git('rev-parse', 'step_one').strip()
+
+        with patch.object(Tut, '_commit_file') as commit_file:
+            self._app(freshenv=True).build()
+
+        self.assertFalse(commit_file.called)
+        self.assertEqual(self._git('rev-parse', 'step_one').strip(), commit)
+
+    def test_commit_mode_reads_serially(self):
+
+        self._configure('commit')
+        docnames = ['ch%d' % n for n in range(8)]
+        self._write(
+            'index.rst',
+            '.. toctree::\n\n' + ''.join('   %s\n' % d for d in docnames),
+        )
+        for docname in docnames:
+            self._write(
+                docname + '.rst',
+                '%s\n===\n\n'
+                '.. tut::\n   :path: /src\n\n'
+                '.. tut:checkpoint:: step_one\n\n'
+                '.. tut:content:: %s.py\n\n'
+                '   name = %r\n' % (docname, docname, docname),
+            )
+
+        app = self._app(parallel=4)
+        app.build()
+
+        self.assertFalse(app.extensions['tut.sphinx'].parallel_read_safe)
+        for docname in docnames:
+            self.assertEqual(
+                self._git('cat-file', '-p', 'step_one:%s.py' % docname).strip(),
+                'name = %r' % docname,
+            )
+
+    def test_write_mode_leaves_unchanged_files(self):
+
+        self._app().build()
+        filename = os.path.join(self._srcpath, 'a.py')
+        with open(filename) as infile:
+            self.assertEqual(infile.read(), 'a = 3')
+        os.utime(filename, (0, 0))
+
+        self._app(freshenv=True).build()
+
+        self.assertEqual(os.stat(filename).st_mtime, 0)
+
+
+class DiffDocumentTestCase(DocumentTestCase):
+
+    def setUp(self):
+        super(DiffDocumentTestCase, self).setUp()
+
+        Tut(self._srcpath).start('step_two')
+        self._write('src/a.py', 'a = 2\n')
+        self._git('commit', '-a', m='Change a.')
+        self._write(
+            'first.rst',
+            'first\n=====\n\n'
+            '.. tut::\n   :path: /src\n\n'
+            '.. tut:checkpoint:: step_two\n\n'
+            '.. tut:diff:: /src/a.py\n',
+        )
+
+
+class DiffCacheTests(DiffDocumentTestCase):
+
+    def test_warm_rebuild_does_not_diff(self):
+
+        self._app().build()
+
+        app = self._app(freshenv=True)
+        with patch('tut.diff.diff_contents') as diff_contents:
+            app.build()
+
+        self.assertFalse(diff_contents.called)
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'first.html')) as html:
+            self.assertIn('<span class="mi">2</span>', html.read())
+
+
+class GitDiffAlgorithmTests(DiffDocumentTestCase):
+
+    def test_git_diff_matches_difflib(self):
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write("tut_diff_cache_size = 0\n")
+
+        self._app().build()
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'first.html')) as html:
+            expected = html.read()
+
+        with open(os.path.join(self._docpath, 'conf.py'), 'a') as conf:
+            conf.write("tut_diff_algorithm = 'git'\n")
+
+        with patch('tut.algorithms.matcher') as matcher:
+            self._app(freshenv=True).build()
+
+        self.assertFalse(matcher.called)
+        with open(os.path.join(self._docpath, '_build', 'html',
+                               'first.html')) as html:
+            self.assertEqual(html.read(), expected)
+
+
+class WorktreePathsTests(TestCase):
+
+    def test_paths_in_repo_resolve_to_worktree(self):
+
+        class Environment(object):
+            temp_data = {
+                'tut_worktrees': {'/docs/src': '/cache/step_one'},
+            }
+
+            def relfn2path(self, filename, docname=None):
+                return filename.lstrip('/'), '/docs' + filename
+
+        resolve = tut.sphinx.checkpoint.WorktreePaths(Environment())
+
+        self.assertEqual(
+            resolve('/src/setup.py'),
+            ('src/setup.py', '/cache/step_one/setup.py'),
+        )
+        self.assertEqual(resolve('/src'), ('src', '/docs/src'))
+        self.assertEqual(resolve('/other.py'), ('other.py', '/docs/other.py'))
+
+
 class CheckpointDirectiveWithLiveGitTests(TestCase):
 
     def test_invalid_checkpoint(self):
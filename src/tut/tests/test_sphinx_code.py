@@ -5,6 +5,7 @@ from unittest.mock import patch
 from sphinx_testing import with_app
 from sphinx_testing.path import path
 
+from tut.lines import BlobIndex
 from tut.sphinx.manager import TutManager
 
 
@@ -20,18 +21,40 @@ class TutLiteralIncludeTests(TestCase):
         git_mock().configure_mock(**{
             'resolve_option.return_value': '/testing',
         })
+        index = BlobIndex()
+        index.write(b'foobar')
         git_mock().tut().configure_mock(**{
-            'file.return_value': b'foobar',
+            'blob_index.return_value': index.finish(),
             'path': test_root/'literalinclude'/'testing',
         })
         sphinx_app.builder.build_all()
 
-        self.assertEqual(git_mock().tut().file.call_count, 1)
+        self.assertEqual(git_mock().tut().blob_index.call_count, 1)
         self.assertEqual(
-            git_mock().tut().file.call_args[0],
+            git_mock().tut().blob_index.call_args[0],
             ('step_one', 'setup.py'),
         )
 
         # ensure the content was correctly included
         with open(os.path.join(sphinx_app.builddir, 'html', 'index.html')) as output_html:
             self.assertIn('foobar', output_html.read())
+
+    @with_app(srcdir=test_root/'literalinclude')
+    def test_literalinclude_reports_wrong_encoding(self, git_mock, sphinx_app, status, warning):
+
+        git_mock().configure_mock(**{
+            'resolve_option.return_value': '/testing',
+        })
+        index = BlobIndex()
+        index.write(b'caf\xe9\n')
+        git_mock().tut().configure_mock(**{
+            'blob_index.return_value': index.finish(),
+            'file.return_value': b'caf\xe9\n',
+            'path': test_root/'literalinclude'/'testing',
+        })
+        sphinx_app.builder.build_all()
+
+        self.assertIn(
+            "Encoding 'utf-8-sig' used for reading included file",
+            warning.getvalue(),
+        )
@@ -0,0 +1,162 @@
+from unittest import TestCase
+
+from tut.sphinx.manager import TutManager
+from tut.sphinx.scan import (
+    DocumentScan,
+    scan_document,
+    schedule,
+)
+
+
+class Environment(object):
+
+    def relfn2path(self, filename, docname=None):
+        return filename.lstrip('/'), '/docs' + filename
+
+
+def _scan(*refs, **flags):
+
+    scan = DocumentScan()
+    scan.checkouts = [('/docs/src', ref) for ref in refs]
+    for flag, value in flags.items():
+        setattr(scan, flag, value)
+
+    return scan
+
+
+class ScanDocumentTests(TestCase):
+
+    def _scan(self, source, defaults=None):
+
+        return scan_document(
+            TutManager(), Environment(), 'doc', source, defaults or {},
+        )
+
+    def test_names_and_checkouts(self):
+
+        scan, defaults = self._scan(
+            '.. tut::\n   :path: /src\n\n'
+            '.. checkpoint:: One\n\n'
+            '.. tut:literalinclude:: /src/a.py\n'
+            '   :lines: 1-2\n\n'
+            '.. tut:checkpoint:: two\n'
+        )
+
+        self.assertEqual(defaults, {'path': '/src'})
+        self.assertEqual(
+            scan.names,
+            [('/docs/src', 'one'), ('/docs/src', 'one:a.py'),
+             ('/docs/src', 'two')],
+        )
+        self.assertEqual(
+            scan.checkouts, [('/docs/src', 'one'), ('/docs/src', 'two')],
+        )
+        self.assertTrue(scan.sets_defaults)
+        self.assertFalse(scan.inherits_defaults)
+        self.assertFalse(scan.reads_work_tree)
+
+    def test_inherited_defaults(self):
+
+        scan, defaults = self._scan(
+            '.. checkpoint:: one\n', defaults={'path': '/src'},
+        )
+
+        self.assertEqual(scan.checkouts, [('/docs/src', 'one')])
+        self.assertTrue(scan.inherits_defaults)
+
+    def test_reading_work_tree_before_checkpoint(self):
+
+        scan, _ = self._scan(
+            '.. literalinclude:: /src/a.py\n\n'
+            '.. checkpoint:: one\n   :path: /src\n'
+        )
+        self.assertTrue(scan.reads_work_tree)
+
+        scan, _ = self._scan(
+            '.. checkpoint:: one\n   :path: /src\n\n'
+            '.. literalinclude:: /src/a.py\n'
+        )
+        self.assertFalse(scan.reads_work_tree)
+
+    def test_commands(self):
+
+        scan, _ = self._scan(
+            '.. checkpoint:: one\n   :path: /src\n\n'
+            '.. tut:exec::\n   :path: /src\n\n   $ ls\n\n'
+            'After.\n'
+        )
+
+        self.assertTrue(scan.runs_commands)
+        self.assertFalse(scan.reads_work_tree)
+        self.assertEqual(scan.commands, [('/docs/src', 'one', 'ls')])
+
+    def test_content_in_commit_mode(self):
+
+        manager = TutManager()
+        manager.content_mode = 'commit'
+        scan, _ = scan_document(
+            manager, Environment(), 'doc',
+            '.. checkpoint:: one\n   :path: /src\n\n'
+            '.. tut:content:: pkg/a.py\n   :path: /src\n\n   a = 1\n',
+            {},
+        )
+
+        self.assertTrue(scan.writes_files)
+        self.assertIn(('/docs/src', 'one:pkg/a.py'), scan.names)
+
+
+class ScheduleTests(TestCase):
+
+    def test_documents_are_grouped_by_checkpoint(self):
+
+        scans = {
+            'a': _scan('one'),
+            'b': _scan('two'),
+            'c': _scan('one'),
+            'd': _scan('two'),
+            'index': _scan(),
+        }
+
+        self.assertEqual(
+            schedule(scans, ['a', 'b', 'c', 'd', 'index']),
+            ['index', 'a', 'c', 'b', 'd'],
+        )
+
+    def test_order_dependent_documents_stay_put(self):
+
+        scans = {
+            'a': _scan('one'),
+            'b': _scan('two'),
+            'c': _scan('one', inherits_defaults=True),
+            'd': _scan('two'),
+            'e': _scan('one'),
+        }
+
+        self.assertEqual(
+            schedule(scans, ['a', 'b', 'c', 'd', 'e']),
+            ['a', 'b', 'c', 'e', 'd'],
+        )
+
+    def test_documents_before_work_tree_readers_stay_put(self):
+
+        scans = {
+            'a': _scan('one'),
+            'b': _scan('two'),
+            'c': _scan('one'),
+            'd': _scan(reads_work_tree=True),
+        }
+
+        self.assertEqual(
+            schedule(scans, ['a', 'b', 'c', 'd', 'unknown']),
+            ['a', 'b', 'c', 'd', 'unknown'],
+        )
+
+    def test_documents_writing_files_stay_put(self):
+
+        scans = {
+            'a': _scan('one'),
+            'b': _scan('two', writes_files=True),
+            'c': _scan('one'),
+        }
+
+        self.assertEqual(schedule(scans, ['a', 'b', 'c']), ['a', 'b', 'c'])